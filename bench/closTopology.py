@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: closTopology.py
+## Description: Parametric generator of 3-stage (one pod) and 5-stage (pods interconnected by
+##              super-spines) Clos fabrics, with border leaves and partially wired leaves. Each
+##              fabric comes with the roles the agent is expected to infer for every node, so it can
+##              feed nodesRolesAlgorithm and check its result.
+##################################################################################################
+"""
+import random
+
+LEAF = 'leaf'
+SPINE = 'spine'
+SUPER_SPINE = 'super-spine'
+BORDER = 'border'
+
+
+class ClosFabric(object):
+    def __init__(self):
+        self.nodes = []   # node names
+        self.links = []   # (node, node)
+        self.roles = {}   # node name -> expected role
+
+    def addNode(self, name, role):
+        self.nodes.append(name)
+        self.roles[name] = role
+
+    def neighbors(self):
+        adjacency = dict((n, []) for n in self.nodes)
+        for a, b in self.links:
+            adjacency[a].append(b)
+            adjacency[b].append(a)
+        return adjacency
+
+    def toGraph(self, seed=None):
+        ## - List g as built by the agent: index 0 is a placeholder and the other indexes are the
+        ## - nodes in the order of their loopback IPs, which is shuffled here (seed=None keeps the order)
+        order = list(self.nodes)
+        if seed is not None:
+            random.Random(seed).shuffle(order)
+        ids = dict((order[i], i + 1) for i in range(len(order)))
+        adjacency = self.neighbors()
+        g = [[0, 0]]
+        for name in order:
+            g.append([ids[n] for n in adjacency[name]])
+        return g, ['index_0'] + order
+
+    def expectedRoles(self, order):
+        ## - Expected (leaves, spines, super_spines, border) as sets of ids of the given order
+        expected = {LEAF: set(), SPINE: set(), SUPER_SPINE: set(), BORDER: set()}
+        for i in range(1, len(order)):
+            expected[self.roles[order[i]]].add(i)
+        return expected[LEAF], expected[SPINE], expected[SUPER_SPINE], expected[BORDER]
+
+
+def closTopology(pods=2, leaves=2, spines=2, super_spines=2, borders=0, partial_leaves=0):
+    ## - pods=1 with no super-spines is a 3-stage fabric: border leaves are wired as leaves and are
+    ## - inferred as leaves. Otherwise the spines of every pod connect to all the super-spines and the
+    ## - border leaves hang from the super-spines. Partially wired leaves miss their pod's last spine;
+    ## - every pod keeps at least one fully wired leaf, as the algorithm requires.
+    fabric = ClosFabric()
+    five_stage = pods > 1 or super_spines > 0
+    pod_spines = []
+    for p in range(1, pods + 1):
+        names = [f'pod{p}-spine{s}' for s in range(1, spines + 1)]
+        for name in names:
+            fabric.addNode(name, SPINE)
+        pod_spines.append(names)
+        for l in range(1, leaves + 1):
+            leaf = f'pod{p}-leaf{l}'
+            fabric.addNode(leaf, LEAF)
+            fabric.links += [(leaf, s) for s in names]
+        for l in range(1, partial_leaves + 1):
+            leaf = f'pod{p}-pleaf{l}'
+            fabric.addNode(leaf, LEAF)
+            fabric.links += [(leaf, s) for s in names[:max(1, spines - 1)]]
+    tops = []
+    for s in range(1, super_spines + 1):
+        name = f'super-spine{s}'
+        fabric.addNode(name, SUPER_SPINE)
+        tops.append(name)
+        for names in pod_spines:
+            fabric.links += [(spine, name) for spine in names]
+    for b in range(1, borders + 1):
+        name = f'border{b}'
+        if five_stage:
+            fabric.addNode(name, BORDER)
+            fabric.links += [(name, s) for s in tops]
+        else:
+            fabric.addNode(name, LEAF)
+            fabric.links += [(name, s) for s in pod_spines[0]]
+    return fabric
+
+
+def closForSize(num_nodes, stages=5, spines=4, super_spines=4, borders=2, partial_ratio=0.1):
+    ## - Picks the pods and leaves per pod to get close to num_nodes nodes
+    if stages == 3:
+        leaves = max(2, num_nodes - spines - borders)
+        partial = int(leaves * partial_ratio)
+        return closTopology(1, leaves - partial, spines, 0, borders, partial)
+    pods = max(2, int(round((num_nodes / 48.0))))
+    per_pod = max(2, (num_nodes - super_spines - borders) // pods - spines)
+    partial = min(per_pod - 1, int(per_pod * partial_ratio))
+    return closTopology(pods, per_pod - partial, spines, super_spines, borders, partial)
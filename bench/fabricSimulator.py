@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: fabricSimulator.py
+## Description: Fabric convergence simulator, offline and in one process. Every switch of a
+##              generated Clos fabric (see closTopology.py) or of a containerlab topology (--clab,
+##              e.g. srl-dcf-ztp.clab.yml) runs its own State and notification handling of the
+##              agent, against a simulated gNMI server of its own. All of them share a simulated
+##              IS-IS: each change of the fabric (nodes booting, links and nodes failing or coming
+##              back) is a new version of the LSDB, flooded to every node after --spf-delay plus
+##              --flood-delay per hop, and turned into the route notifications of that node. Each
+##              phase reports the time until every node agrees on the roles and the RRs, the time
+##              until the last iBGP change, and the notifications and gNMI Sets it took.
+##              Times are simulated: every node has a CPU of its own, charged with the measured time
+##              of its handling, so the results do not depend on the number of nodes run by this one
+##              process. The run itself (wall_s of each phase) grows with the nodes: about 15 s for
+##              the bring-up of 150 nodes.
+##              Usage: python3 bench/fabricSimulator.py [--nodes 40 | --clab FILE]
+##                                   [--link-failures 2] [--node-failures 1] [--rr-strategy per-pod]
+##                                   [--output FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import threading
+import tempfile
+
+from closTopology import closForSize, LEAF, SPINE, SUPER_SPINE, BORDER
+
+NDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk')
+
+
+class SimFabric(object):
+    ## - Ground truth of the fabric: nodes and links, and which of them are up. Every change is a new version of the LSDB
+    def __init__(self, names, links, roles=None):
+        self.names = list(names)
+        self.links = [tuple(link) for link in links]
+        self.roles = roles   # node name -> expected role (generated fabrics only)
+        self.ip = {n : f'10.{(i + 1) // 250}.{(i + 1) % 250}.1' for i, n in enumerate(self.names)}
+        self.sys_id = {n : '1000.%04X.%04X' % ((i + 1) // 0x10000, (i + 1) % 0x10000) for i, n in enumerate(self.names)}
+        self.up_nodes = set()
+        self.up_links = set(frozenset(link) for link in self.links)
+        self.version = 0
+
+    def mac(self, node):
+        digits = self.sys_id[node].replace('.', '')
+        return ':'.join(digits[i:i + 2] for i in range(0, len(digits), 2))
+
+    def adjacency(self, up_nodes, up_links):
+        adjacency = {n : [] for n in up_nodes}
+        for link in up_links:
+            a, b = tuple(link)
+            if a in up_nodes and b in up_nodes:
+                adjacency[a].append(b)
+                adjacency[b].append(a)
+        return adjacency
+
+    def snapshot(self):
+        ## - Version of the LSDB: the LSP of every node that is up, with its neighbors over the links that are up
+        self.version += 1
+        adjacency = self.adjacency(self.up_nodes, self.up_links)
+        lsps = {}
+        for n, neighbors in adjacency.items():
+            reach = [ {'neighbor' : self.sys_id[m] + '.00', 'default-metric' : 10} for m in sorted(neighbors) ]
+            lsps[n] = {'ipv4-interface-addresses' : [self.ip[n]], 'extended-is-reachability' : reach}
+        return {'version' : self.version, 'adjacency' : adjacency, 'lsps' : lsps}
+
+    def components(self):
+        ## - Nodes that are up, by connected component: the nodes of a component have to agree
+        adjacency = self.adjacency(self.up_nodes, self.up_links)
+        seen = set()
+        components = []
+        for n in sorted(adjacency):
+            if n not in seen:
+                component = distances(adjacency, [n])
+                seen.update(component)
+                components.append(sorted(component))
+        return components
+
+    def expected(self, component):
+        ## - Expected roles of a component of a generated fabric, when all of its nodes and links are up
+        if self.roles is None or len(self.up_nodes) < len(self.names) or len(self.up_links) < len(self.links):
+            return None
+        return tuple(tuple(sorted(self.ip[n] for n in component if self.roles[n] == role)) for role in [LEAF, SPINE, SUPER_SPINE, BORDER])
+
+
+def distances(adjacency, origins):
+    ## - Hops from the nearest origin, for the nodes reachable from the origins
+    hops = {o : 0 for o in origins if o in adjacency}
+    frontier = list(hops)
+    while frontier:
+        following = []
+        for n in frontier:
+            for m in adjacency[n]:
+                if m not in hops:
+                    hops[m] = hops[n] + 1
+                    following.append(m)
+        frontier = following
+    return hops
+
+
+class SimGnmi(object):
+    ## - gNMI server of one node: its own view of the LSDB (the last version flooded to it) and the Sets it received
+    def __init__(self, fabric, node):
+        self.fabric = fabric
+        self.node = node
+        self.view = None
+        self.gets = 0
+        self.sets = 0
+        self.bgp_sets = 0
+
+    def reachable(self, view):
+        if view is None or self.node not in view['adjacency']:
+            return {}
+        return distances(view['adjacency'], [self.node])
+
+    def get(self, path, encoding=None):
+        self.gets += 1
+        path = path[0]
+        if 'hw-mac-address' in path:
+            return {'notification' : [{'update' : [{'val' : self.fabric.mac(self.node)}]}]}
+        if 'system0' in path:
+            return {'notification' : [{'update' : [{'val' : {'address' : [{'ip-prefix' : self.fabric.ip[self.node] + '/32'}]}}]}]}
+        reachable = self.reachable(self.view)
+        if 'route-table' in path:
+            routes = [{'ipv4-prefix' : self.fabric.ip[n] + '/32', 'route-owner' : 'isis_mgr'} for n in sorted(reachable) if n != self.node]
+            return {'notification' : [{'update' : [{'val' : {'route' : routes}}]}]}
+        if 'level-database' in path:
+            lsps = [{'lsp-id' : self.fabric.sys_id[n] + '.00-00', 'defined-tlvs' : self.view['lsps'][n]} for n in sorted(reachable)]
+            return {'notification' : [{'update' : [{'val' : {'level-database' : lsps}}]}]}
+        return {'notification' : [{}]}
+
+    def set(self, update=None, replace=None, delete=None, encoding=None):
+        self.sets += 1
+        paths = [str(p) for p, _ in (update or []) + (replace or [])] + [str(p) for p in (delete or [])]
+        if any('protocols/bgp' in p for p in paths):
+            self.bgp_sets += 1
+        return {'response' : [{'path' : str(p).lstrip('/'), 'op' : 'UPDATE'} for p, _ in (update or []) + (replace or [])]}
+
+
+class SimAgent(object):
+    ## - One switch: State and notification handling of the agent, fed with the LSDB versions flooded to it
+    def __init__(self, agent, fabric, node):
+        self.agent = agent
+        self.node = node
+        self.gnmi = SimGnmi(fabric, node)
+        self.state = agent.State()
+        self.state.underlay_protocol = 'IS-IS'
+        self.notifications = 0
+
+    def boot(self):
+        with self.agent.state_lock:
+            self.agent.systemIds(self.state, self.gnmi)
+            self.agent.bringUp(self.state, self.gnmi, self.node)
+
+    def deliver(self, view):
+        ## - Route notifications of the new version: nodes now reachable (create), no longer reachable (delete)
+        ## - or whose LSP changed (update)
+        if self.gnmi.view is not None and view['version'] < self.gnmi.view['version']:
+            return
+        before = self.gnmi.reachable(self.gnmi.view)
+        old = self.gnmi.view['lsps'] if self.gnmi.view is not None else {}
+        with self.agent.state_lock:
+            self.gnmi.view = view
+            after = self.gnmi.reachable(view)
+            for n in sorted(set(before) | set(after)):
+                if n == self.node:
+                    continue
+                if n not in before:
+                    op = 0
+                elif n not in after:
+                    op = 2
+                elif old.get(n) != view['lsps'].get(n):
+                    op = 1
+                else:
+                    continue
+                self.notifications += 1
+                self.agent.handleNotification(routeNotification(self.gnmi.fabric.ip[n], op), self.state, self.gnmi)
+
+    def idle(self):
+        return not self.agent.batchesPending(self.state)
+
+    def roles(self):
+        state = self.state
+        return (tuple(sorted(state.leaves)), tuple(sorted(state.spines)), tuple(sorted(state.super_spines)),
+                tuple(sorted(state.borders)), tuple(sorted(state.route_reflectors)))
+
+    def overlay(self):
+        ## - The order of the neighbors does not matter: the agent only pushes the differences
+        overlay = self.state.overlay
+        return None if overlay is None else (overlay['cluster_id'], tuple(sorted(overlay['neighbors'])))
+
+    def close(self):
+        self.state.route_batch.cancel()
+        self.state.lldp_writes.cancel()
+        self.state.overlay_apply.cancel()
+        self.state.roles_worker.close()
+
+
+def routeNotification(ip, op):
+    from ndk.sdk_service_pb2 import Notification
+    notification = Notification()
+    notification.route.op = op
+    notification.route.key.ip_prefix.ip_addr.addr = bytes(int(b) for b in ip.split('.'))
+    notification.route.key.ip_prefix.prefix_length = 32
+    return notification
+
+
+class SimClock(object):
+    ## - Simulated time of the run, with one CPU per node: an event of a node (delivery of a LSDB version, timer of the
+    ## - agent) starts once the node is done with its previous one, and the handling, measured, moves that node alone
+    ## - forward. The results do not depend on how many nodes share the CPU of the simulator, only the run time does
+    def __init__(self):
+        self.now = 0.0
+        self.events = []   # heap of [due, sequence, node, callback], callback None once cancelled
+        self.sequence = 0
+        self.busy = {}     # node -> simulated time at which it is done with its last event
+        self.node = None   # node of the event being handled
+
+    def monotonic(self):
+        return self.now
+
+    def at(self, due, node, callback):
+        self.sequence += 1
+        event = [due, self.sequence, node, callback]
+        heapq.heappush(self.events, event)
+        return event
+
+    def pending(self):
+        while self.events and self.events[0][3] is None:
+            heapq.heappop(self.events)
+        return len(self.events) > 0
+
+    def step(self, deadline):
+        ## - Handles the next event due by the deadline: (node, simulated time its handling ended), or None
+        while self.pending() and self.events[0][0] <= deadline:
+            event = heapq.heappop(self.events)
+            due, _, node, callback = event
+            ready = self.busy.get(node, 0.0)
+            if ready > due:
+                ## - The node is still busy: the event waits for it (a timer event stays cancellable)
+                event[0] = ready
+                heapq.heappush(self.events, event)
+                continue
+            self.now = due
+            self.node = node
+            cpu = time.perf_counter()
+            try:
+                callback()
+            finally:
+                self.node = None
+            self.busy[node] = due + time.perf_counter() - cpu
+            return node, self.busy[node]
+        return None
+
+
+class SimTimer(object):
+    ## - threading.Timer of the agent on the simulated clock: an event of the node that started it
+    def __init__(self, clock, interval, function):
+        self.clock = clock
+        self.interval = interval
+        self.function = function
+        self.event = None
+        self.daemon = True
+
+    def start(self):
+        self.event = self.clock.at(self.clock.now + self.interval, self.clock.node, self.function)
+
+    def cancel(self):
+        if self.event is not None:
+            self.event[3] = None
+
+
+class SimModule(object):
+    ## - Module of the agent with some of its attributes replaced (the clock and the timers)
+    def __init__(self, module, **replaced):
+        self.module = module
+        self.__dict__.update(replaced)
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
+class Simulator(object):
+    def __init__(self, agent, fabric, spf_delay, flood_delay, seed):
+        self.agent = agent
+        self.fabric = fabric
+        self.spf_delay = spf_delay
+        self.flood_delay = flood_delay
+        self.rng = random.Random(seed)
+        self.agents = {}
+        self.clock = SimClock()
+        ## - Every agent runs in this thread, on the simulated clock: its batches and overlay applies are timer events
+        for module in (agent, sys.modules['batching']):
+            module.time = SimModule(time, monotonic=self.clock.monotonic)
+            module.threading = SimModule(threading, Timer=lambda interval, function: SimTimer(self.clock, interval, function))
+
+    def change(self, origins, before):
+        ## - New version of the LSDB, flooded from the changed nodes: hops counted over the links before and after the change
+        view = self.fabric.snapshot()
+        union = {n : set(before.get(n, [])) | set(view['adjacency'].get(n, [])) for n in set(before) | set(view['adjacency'])}
+        for node, hops in distances(union, origins).items():
+            if node in self.agents:
+                self.clock.at(self.clock.now + self.spf_delay + self.flood_delay * hops, node, lambda node=node: self.deliver(node, view))
+
+    def deliver(self, node, view):
+        if node in self.agents:
+            self.agents[node].deliver(view)
+
+    def nodeUp(self, node):
+        before = self.fabric.adjacency(self.fabric.up_nodes, self.fabric.up_links)
+        self.fabric.up_nodes.add(node)
+        self.agents[node] = SimAgent(self.agent, self.fabric, node)
+        self.agents[node].boot()
+        self.change([node], before)
+
+    def nodeDown(self, node):
+        ## - The agent of the node goes with it: a node coming back boots a fresh agent
+        before = self.fabric.adjacency(self.fabric.up_nodes, self.fabric.up_links)
+        self.fabric.up_nodes.discard(node)
+        self.agents.pop(node).close()
+        self.change(before.get(node, []), before)
+
+    def link(self, link, up):
+        before = self.fabric.adjacency(self.fabric.up_nodes, self.fabric.up_links)
+        (self.fabric.up_links.add if up else self.fabric.up_links.discard)(frozenset(link))
+        self.change(list(link), before)
+
+    def current(self):
+        return {n : (a.roles(), a.overlay()) for n, a in self.agents.items()}
+
+    def converge(self, start, timeout):
+        ## - Runs the events (deliveries and timers of the agents) in simulated time, and follows the roles, RRs and overlay
+        ## - of every node until there is no event left and the nodes of each component agree, or until the timeout
+        last_roles = last_overlay = start
+        seen = self.current()
+        deadline = start + timeout
+        while True:
+            handled = self.clock.step(deadline)
+            if handled is None:
+                break
+            node, end = handled
+            if node in self.agents:
+                roles, overlay = self.agents[node].roles(), self.agents[node].overlay()
+                if node not in seen or seen[node][0] != roles:
+                    last_roles = end
+                if node not in seen or seen[node][1] != overlay:
+                    last_overlay = end
+                seen[node] = (roles, overlay)
+        converged = not self.clock.pending() and all(a.idle() for a in self.agents.values()) and self.agreement(self.current())[0]
+        return converged, last_roles - start, max(last_roles, last_overlay) - start
+
+    def agreement(self, current):
+        ## - (whether the nodes of each component have the same roles and RRs, whether they are the expected ones)
+        agree, expected = True, None
+        for component in self.fabric.components():
+            roles = set(current[n][0] for n in component if n in current)
+            agree = agree and len(roles) == 1
+            reference = self.fabric.expected(component)
+            if reference is not None and len(roles) == 1:
+                expected = (expected is not False) and next(iter(roles))[:4] == reference
+        return agree, expected
+
+    def counters(self):
+        return {n : (a.notifications, a.gnmi.sets, a.gnmi.bgp_sets) for n, a in self.agents.items()}
+
+    def phase(self, name, action, timeout):
+        ## - action: [(seconds after the start of the phase, node, callback)], run as events of those nodes
+        before = self.counters()
+        wall = time.monotonic()
+        start = self.clock.now
+        for delay, node, callback in action:
+            self.clock.at(start + delay, node, callback)
+        converged, roles_s, overlay_s = self.converge(start, timeout)
+        after = self.counters()
+        delta = [tuple(c - b for c, b in zip(after[n], before.get(n, (0, 0, 0)))) for n in after]
+        current = self.current()
+        agree, expected = self.agreement(current)
+        components = self.fabric.components()
+        return {
+            'phase' : name,
+            'nodes_up' : len(self.fabric.up_nodes),
+            'components' : len(components),
+            'converged' : converged,
+            'roles_converged_s' : round(roles_s, 4),
+            'overlay_converged_s' : round(overlay_s, 4),
+            'agree' : agree,
+            'expected_roles' : expected,
+            'notifications' : sum(d[0] for d in delta),
+            'gnmi_sets' : sum(d[1] for d in delta),
+            'bgp_sets' : sum(d[2] for d in delta),
+            'route_reflectors' : [list(current[c[0]][0][4]) for c in components if c[0] in current],
+            ## - iBGP sessions of the busiest node: bounded by the RR strategy as the fabric grows
+            'max_ibgp_neighbors' : max((len(overlay[1]) for _, overlay in current.values() if overlay is not None), default=0),
+            'wall_s' : round(time.monotonic() - wall, 2),
+        }
+
+    def bringUp(self, jitter, timeout):
+        ## - Every node boots within jitter seconds, in a random order
+        order = list(self.fabric.names)
+        self.rng.shuffle(order)
+        boots = [(jitter * i / max(len(order) - 1, 1), node, lambda node=node: self.nodeUp(node)) for i, node in enumerate(order)]
+        return self.phase('bring-up', boots, timeout)
+
+    def close(self):
+        for a in self.agents.values():
+            a.close()
+
+
+def clabTopology(path):
+    ## - SR Linux nodes of a containerlab topology and the links between them (servers and other kinds are left out)
+    import yaml   # Only needed for containerlab files
+    with open(path) as f:
+        lab = yaml.safe_load(f)
+    topology = lab['topology']
+    default_kind = (topology.get('defaults') or {}).get('kind')
+    names = [n for n, node in topology['nodes'].items() if (node or {}).get('kind', default_kind) in ('nokia_srlinux', 'srl')]
+    links = []
+    for link in topology.get('links') or []:
+        a, b = (endpoint.split(':')[0] for endpoint in link['endpoints'])
+        if a in names and b in names:
+            links.append((a, b))
+    return names, links, None
+
+
+def run(agent, names, links, roles, args):
+    fabric = SimFabric(names, links, roles)
+    simulator = Simulator(agent, fabric, args.spf_delay, args.flood_delay, args.seed)
+    rng = random.Random(args.seed)
+    results = [simulator.bringUp(args.boot_jitter, args.timeout)]
+    for i in range(args.link_failures):
+        link = rng.choice(sorted(fabric.links))
+        results.append(simulator.phase(f'link-down {link[0]}-{link[1]}', [(0.0, None, lambda: simulator.link(link, False))], args.timeout))
+        if args.restore:
+            results.append(simulator.phase(f'link-up {link[0]}-{link[1]}', [(0.0, None, lambda: simulator.link(link, True))], args.timeout))
+    for i in range(args.node_failures):
+        node = rng.choice(sorted(fabric.up_nodes))
+        results.append(simulator.phase(f'node-down {node}', [(0.0, None, lambda: simulator.nodeDown(node))], args.timeout))
+        if args.restore:
+            results.append(simulator.phase(f'node-up {node}', [(0.0, node, lambda: simulator.nodeUp(node))], args.timeout))
+    simulator.close()
+    summary = {
+        'summary' : True,
+        'nodes' : len(names),
+        'links' : len(links),
+        'all_converged' : all(r['converged'] and r['agree'] for r in results),
+        'all_expected' : all(r['expected_roles'] is not False for r in results),
+        'max_roles_converged_s' : max(r['roles_converged_s'] for r in results),
+        'bgp_sets' : sum(r['bgp_sets'] for r in results),
+        'max_ibgp_neighbors' : max(r['max_ibgp_neighbors'] for r in results),
+        'settings' : {name : getattr(agent, name) for name in agent.CAPTURE_SETTINGS},
+    }
+    return results, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='in-process fabric convergence simulator of the configurationless agent')
+    parser.add_argument('--nodes', type=int, default=40, help='approximate number of nodes of the generated 5-stage Clos fabric')
+    parser.add_argument('--clab', help='containerlab topology instead of a generated fabric, e.g. srl-dcf-ztp.clab.yml')
+    parser.add_argument('--boot-jitter', type=float, default=1.0, help='seconds over which the nodes boot at bring-up')
+    parser.add_argument('--spf-delay', type=float, default=0.05, help='seconds before a node acts on a new LSDB version')
+    parser.add_argument('--flood-delay', type=float, default=0.01, help='seconds of LSP flooding per hop')
+    parser.add_argument('--link-failures', type=int, default=2, help='links failed one after the other once the fabric converged')
+    parser.add_argument('--node-failures', type=int, default=1, help='nodes failed one after the other')
+    parser.add_argument('--restore', action='store_true', help='brings every failed link or node back before the next failure')
+    parser.add_argument('--quiet-window', type=float, help='ROUTE_QUIET_WINDOW of the agents (default: the agent setting)')
+    parser.add_argument('--ibgp-delay', type=int, help='ibgp-timer-delay of the agents (default: the agent setting)')
+    parser.add_argument('--rr-count', type=int, help='RRs of each scope (default: the agent setting RR_NUMBER)')
+    parser.add_argument('--rr-strategy', choices=['global', 'per-pod', 'hierarchical'], help='RR placement (default: the agent setting RR_STRATEGY)')
+    parser.add_argument('--rr-cluster-size', type=int, help='RRs sharing a cluster-id (default: the agent setting RR_CLUSTER_SIZE)')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the fabric, the boot order and the failures')
+    parser.add_argument('--timeout', type=float, default=60.0, help='simulated seconds each phase has to converge')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    args = parser.parse_args()
+
+    ## - Same layout as in the nodes: nodesRolesAlgorithm.py is mounted as algorithms/nodesRolesAlgorithm.py
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, 'algorithms'))
+        os.symlink(os.path.abspath(os.path.join(NDK_DIR, 'nodesRolesAlgorithm.py')), os.path.join(root, 'algorithms', 'nodesRolesAlgorithm.py'))
+        sys.path.insert(0, root)
+        sys.path.insert(0, NDK_DIR)
+        import configurationless as agent
+        sys.path.remove(root)
+    agent.logging.disable(agent.logging.CRITICAL)
+    ## - One process for every agent: the LSDB is read from the simulated gNMI server of each node, not mirrored
+    agent.LSDB_MIRROR = False
+    ## - The roles are computed in the handling of each node, on its simulated CPU, not in a worker process
+    agent.ROLES_IN_WORKER = False
+    if args.quiet_window is not None:
+        agent.ROUTE_QUIET_WINDOW = args.quiet_window
+    if args.ibgp_delay is not None:
+        agent.IBGP_TIMER_DELAY = args.ibgp_delay
+    if args.rr_count is not None:
+        agent.RR_NUMBER = args.rr_count
+    if args.rr_strategy is not None:
+        agent.RR_STRATEGY = args.rr_strategy
+    if args.rr_cluster_size is not None:
+        agent.RR_CLUSTER_SIZE = args.rr_cluster_size
+
+    if args.clab:
+        names, links, roles = clabTopology(args.clab)
+    else:
+        fabric = closForSize(args.nodes, 5)
+        names, links, roles = fabric.nodes, fabric.links, fabric.roles
+    results, summary = run(agent, names, links, roles, args)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in results + [summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    return 0 if summary['all_converged'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: fakeGnmiServer.py
+## Description: Local gNMI server holding the IS-IS level-1 LSDB of a generated Clos fabric (see
+##              closTopology.py). It answers Capabilities, Get and STREAM/ON_CHANGE Subscribe on the
+##              level-database, and replays LSP adds, changes and deletes to its subscribers: adds
+##              stream the whole defined-tlvs container, changes a single TLV and deletes the LSP.
+##              Run on its own it checks the LSDB mirror of the agent (IsisLsdb) against the server
+##              after every event and reports the gNMI payload next to a full GET per event.
+##              Usage: python3 bench/fakeGnmiServer.py [--nodes 100] [--events 200] [--output FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import tempfile
+import threading
+from concurrent import futures
+
+import grpc
+from pygnmi.spec.v080 import gnmi_pb2
+from pygnmi.spec.v080 import gnmi_pb2_grpc
+from pygnmi.create_gnmi_path import gnmi_path_generator, gnmi_path_degenerator
+from closTopology import closForSize
+
+NDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk')
+ISIS_PATH = 'network-instance[name=default]/protocols/isis/instance[name=i1]'
+
+
+def jsonValue(value):
+    return gnmi_pb2.TypedValue(json_ietf_val=json.dumps(value).encode())
+
+
+class FakeGnmiServer(gnmi_pb2_grpc.gNMIServicer):
+    def __init__(self, lsdb):
+        self.lsdb = dict(lsdb)   # lsp-id -> defined-tlvs
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.stream_bytes = 0
+        self.get_bytes = 0
+        self.server = None
+        self.port = None
+
+    def start(self):
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+        gnmi_pb2_grpc.add_gNMIServicer_to_server(self, self.server)
+        self.port = self.server.add_insecure_port('localhost:0')
+        self.server.start()
+        return self.port
+
+    def endStreams(self):
+        ## - Subscriptions end on the server side, before the client closes its channel
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.put(None)
+
+    def stop(self):
+        self.endStreams()
+        self.server.stop(0)
+
+    ## - gNMI service
+
+    def Capabilities(self, request, context):
+        return gnmi_pb2.CapabilityResponse(supported_encodings=[gnmi_pb2.Encoding.JSON_IETF], gNMI_version='0.8.0')
+
+    def Get(self, request, context):
+        path = gnmi_path_degenerator(request.path[0])
+        lsp_id = path[path.index('[lsp-id=') + len('[lsp-id='):path.index(']', path.index('[lsp-id='))]
+        with self.lock:
+            lsps = [ {'lsp-id' : l, 'defined-tlvs' : self.lsdb[l]} for l in sorted(self.lsdb) if lsp_id in ('*', l) ]
+        notification = gnmi_pb2.Notification(timestamp=time.time_ns())
+        if lsps:
+            notification.update.add(path=gnmi_path_generator(ISIS_PATH), val=jsonValue({'level-database' : lsps}))
+        response = gnmi_pb2.GetResponse(notification=[notification])
+        with self.lock:
+            self.get_bytes += response.ByteSize()
+        return response
+
+    def Subscribe(self, request_iterator, context):
+        next(request_iterator)
+        subscriber = queue.Queue()
+        with self.lock:
+            initial = [self.lspUpdate(l, self.lsdb[l]) for l in sorted(self.lsdb)]
+            self.subscribers.append(subscriber)
+        try:
+            for response in initial:
+                yield response
+            yield gnmi_pb2.SubscribeResponse(sync_response=True)
+            while context.is_active():
+                try:
+                    response = subscriber.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if response is None:
+                    return
+                yield response
+        finally:
+            with self.lock:
+                self.subscribers.remove(subscriber)
+
+    ## - Replayed events
+
+    def lspUpdate(self, lsp_id, tlvs):
+        notification = gnmi_pb2.Notification(timestamp=time.time_ns(), prefix=gnmi_path_generator(lspPath(lsp_id)))
+        notification.update.add(path=gnmi_path_generator('defined-tlvs'), val=jsonValue(tlvs))
+        return gnmi_pb2.SubscribeResponse(update=notification)
+
+    def publish(self, response):
+        with self.lock:
+            self.stream_bytes += response.ByteSize() * len(self.subscribers)
+            for subscriber in self.subscribers:
+                subscriber.put(response)
+
+    def addLsp(self, lsp_id, tlvs):
+        with self.lock:
+            self.lsdb[lsp_id] = tlvs
+        self.publish(self.lspUpdate(lsp_id, tlvs))
+
+    def changeLsp(self, lsp_id, tlvs):
+        ## - Streams only the changed TLV: the subscriber has to read the LSP again
+        with self.lock:
+            self.lsdb[lsp_id] = tlvs
+        notification = gnmi_pb2.Notification(timestamp=time.time_ns(), prefix=gnmi_path_generator(lspPath(lsp_id) + '/defined-tlvs'))
+        notification.update.add(path=gnmi_path_generator('extended-is-reachability'), val=jsonValue(tlvs.get('extended-is-reachability', [])))
+        self.publish(gnmi_pb2.SubscribeResponse(update=notification))
+
+    def deleteLsp(self, lsp_id):
+        with self.lock:
+            self.lsdb.pop(lsp_id, None)
+        notification = gnmi_pb2.Notification(timestamp=time.time_ns(), delete=[gnmi_path_generator(lspPath(lsp_id))])
+        self.publish(gnmi_pb2.SubscribeResponse(update=notification))
+
+    def fullGetSize(self):
+        with self.lock:
+            lsps = [ {'lsp-id' : l, 'defined-tlvs' : self.lsdb[l]} for l in sorted(self.lsdb) ]
+        notification = gnmi_pb2.Notification()
+        notification.update.add(path=gnmi_path_generator(ISIS_PATH), val=jsonValue({'level-database' : lsps}))
+        return gnmi_pb2.GetResponse(notification=[notification]).ByteSize()
+
+
+def lspPath(lsp_id):
+    return f'{ISIS_PATH}/level-database[level-number=1][lsp-id={lsp_id}]'
+
+
+def fabricLsdb(num_nodes, seed):
+    ## - LSDB of a 5-stage Clos fabric: one LSP per node with its loopback and its metric-10 neighbors
+    fabric = closForSize(num_nodes, 5)
+    rng = random.Random(seed)
+    names = list(fabric.nodes)
+    sys_ids = {n : '1000.%04X.%04X' % (i // 0x10000, i % 0x10000) for i, n in enumerate(names)}
+    ips = {n : f'10.{(i + 1) // 250}.{(i + 1) % 250}.1' for i, n in enumerate(names)}
+    neighbors = fabric.neighbors()
+    def tlvs(n, up):
+        reach = [ {'neighbor' : sys_ids[m] + '.00', 'default-metric' : 10} for m in neighbors[n] if m in up ]
+        rng.shuffle(reach)
+        return {'ipv4-interface-addresses' : [ips[n]], 'extended-is-reachability' : reach}
+    return names, sys_ids, tlvs
+
+
+def replay(num_nodes, num_events, seed, timeout):
+    ## - Agent module, with nodesRolesAlgorithm.py laid out as algorithms/nodesRolesAlgorithm.py like in the nodes
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, 'algorithms'))
+        os.symlink(os.path.abspath(os.path.join(NDK_DIR, 'nodesRolesAlgorithm.py')), os.path.join(root, 'algorithms', 'nodesRolesAlgorithm.py'))
+        sys.path.insert(0, root)
+        sys.path.insert(0, NDK_DIR)
+        import configurationless as agent
+        sys.path.remove(root)
+    from pygnmi.client import gNMIclient
+
+    names, sys_ids, tlvs = fabricLsdb(num_nodes, seed)
+    rng = random.Random(seed)
+    up = set(rng.sample(names, len(names) // 2))
+    server = FakeGnmiServer({sys_ids[n] + '.00-00' : tlvs(n, up) for n in up})
+    port = server.start()
+    results = []
+    mirror = agent.IsisLsdb(agent.ISIS_LSDB_PATH, agent.state_lock)
+    with gNMIclient(target=('localhost', port), insecure=True) as gc:
+        mirror.start(gc)
+        start = time.perf_counter()
+        synced = waitFor(lambda: mirror.synced and mirror.lsps == server.lsdb, timeout)
+        results.append({'event' : 'sync', 'lsps' : len(server.lsdb), 'seconds' : round(time.perf_counter() - start, 4), 'consistent' : synced})
+        full_get_bytes = 0
+        server.stream_bytes = server.get_bytes = 0
+        for _ in range(num_events):
+            node = rng.choice(names)
+            lsp_id = sys_ids[node] + '.00-00'
+            if node not in up:
+                event = 'add'
+                up.add(node)
+                server.addLsp(lsp_id, tlvs(node, up))
+            elif rng.random() < 0.5:
+                event = 'delete'
+                up.discard(node)
+                server.deleteLsp(lsp_id)
+            else:
+                event = 'change'
+                server.changeLsp(lsp_id, tlvs(node, up))
+            full_get_bytes += server.fullGetSize()
+            start = time.perf_counter()
+            consistent = waitFor(lambda: mirror.lsps == server.lsdb, timeout)
+            results.append({'event' : event, 'lsps' : len(server.lsdb), 'seconds' : round(time.perf_counter() - start, 4), 'consistent' : consistent})
+        ## - The mirror answers like a GET of the whole LSDB
+        full = gc.get(path=[agent.ISIS_LSDB_PATH], encoding='json_ietf')
+        same_as_get = full['notification'][0]['update'][0]['val'] == mirror.database()['notification'][0]['update'][0]['val']
+        server.endStreams()
+        waitFor(lambda: not server.subscribers, timeout)
+        mirror.close()
+    server.stop()
+    summary = {
+        'summary' : True,
+        'nodes' : len(names),
+        'events' : num_events,
+        'all_consistent' : all(r['consistent'] for r in results) and same_as_get,
+        'mirror' : str(mirror),
+        'stream_bytes' : server.stream_bytes,
+        'refresh_get_bytes' : server.get_bytes - server.fullGetSize(),
+        'full_get_bytes' : full_get_bytes,
+    }
+    return results, summary
+
+
+def waitFor(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.001)
+    return condition()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake gNMI server replaying IS-IS LSDB changes to the agent LSDB mirror')
+    parser.add_argument('--nodes', type=int, default=100, help='approximate number of nodes of the fabric')
+    parser.add_argument('--events', type=int, default=200, help='LSP adds, changes and deletes replayed')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the fabric and of the events')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds the mirror has to converge after each event')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    args = parser.parse_args()
+
+    results, summary = replay(args.nodes, args.events, args.seed, args.timeout)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in results + [summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    return 0 if summary['all_consistent'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: pipelineBenchmark.py
+## Description: Notification storm against the agent, without SR Linux nodes. A generated Clos
+##              fabric (see closTopology.py) comes up and then flaps its nodes, as a burst of route
+##              notifications read from a simulated NDK stream, while every gNMI call of the agent
+##              takes --gnmi-latency seconds. The storm is handled inline (the stream is read in the
+##              handling thread) and through the notification pipeline of the agent; each run
+##              reports how long the stream was stalled, the time to converge and the final roles.
+##              A last run checks the drop_oldest overload policy: the DELETE of a node that left is
+##              dropped from a full queue, and the roles must still end up without that node.
+##              Usage: python3 bench/pipelineBenchmark.py [--nodes 60] [--flaps 1000] [--output FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from fakeGnmiServer import fabricLsdb
+
+NDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk')
+
+
+class SlowGnmi(object):
+    ## - Route table and LSDB of the nodes that are up, answered after a fixed latency
+    def __init__(self, names, sys_ids, tlvs, latency):
+        self.names = names
+        self.sys_ids = sys_ids
+        self.tlvs = tlvs
+        self.latency = latency
+        self.up = set()
+        self.calls = 0
+
+    def ip(self, node):
+        return self.tlvs(node, set())['ipv4-interface-addresses'][0]
+
+    def get(self, path, encoding=None):
+        time.sleep(self.latency)
+        self.calls += 1
+        up = set(self.up)
+        if 'route-table' in path[0]:
+            routes = [{'ipv4-prefix' : self.ip(n) + '/32', 'route-owner' : 'isis_mgr'} for n in self.names if n in up]
+            return {'notification' : [{'update' : [{'val' : {'route' : routes}}]}]}
+        lsps = [{'lsp-id' : self.sys_ids[n] + '.00-00', 'defined-tlvs' : self.tlvs(n, up)} for n in self.names if n in up]
+        return {'notification' : [{'update' : [{'val' : {'level-database' : lsps}}]}]}
+
+    def set(self, update=None, replace=None, delete=None, encoding=None):
+        time.sleep(self.latency)
+        self.calls += 1
+        return {'response' : [{'path' : str(p).lstrip('/')} for p, _ in (update or []) + (replace or [])]}
+
+
+def routeNotification(gnmi, node, op):
+    from ndk.sdk_service_pb2 import Notification
+    notification = Notification()
+    notification.route.op = op
+    notification.route.key.ip_prefix.ip_addr.addr = bytes(int(b) for b in gnmi.ip(node).split('.'))
+    notification.route.key.ip_prefix.prefix_length = 32
+    return notification
+
+
+def newPipeline(agent, size, overload):
+    ## - Notification pipeline of the agent, handing the notifications to its handlers with the state lock
+    return agent.NotificationPipeline(size, overload, agent.state_lock, agent.handleNotification, agent.resyncRoutes, agent.PIPELINE_STATS_INTERVAL)
+
+
+def storm(agent, gnmi, names, flaps, interval, seed):
+    ## - Simulated NDK stream: the fabric comes up, then random nodes flap every interval seconds; the network changes as it is read
+    rng = random.Random(seed)
+    route = lambda node, op: routeNotification(gnmi, node, op)
+    gnmi.up.add(names[0])
+    for node in names[1:]:
+        gnmi.up.add(node)
+        yield route(node, 0)
+    for _ in range(flaps):
+        time.sleep(interval)
+        node = rng.choice(names[1:])
+        if node in gnmi.up:
+            gnmi.up.discard(node)
+            yield route(node, 2)
+        else:
+            gnmi.up.add(node)
+            yield route(node, 0)
+
+
+def settled(agent, state, pipeline):
+    with agent.state_lock:
+        return (pipeline is None or (len(pipeline) == 0 and pipeline.handled + pipeline.coalesced + pipeline.dropped == pipeline.received
+                                     and not pipeline.resync and not pipeline.resyncing)) \
+            and len(state.route_batch) == 0 and state.route_batch.timer is None
+
+
+def run(agent, mode, num_nodes, flaps, interval, latency, seed, timeout):
+    names, sys_ids, tlvs = fabricLsdb(num_nodes, seed)
+    gnmi = SlowGnmi(names, sys_ids, tlvs, latency)
+    state = agent.State()
+    state.underlay_protocol = 'IS-IS'
+    state.sys_ip = gnmi.ip(names[0])
+    pipeline = None
+    if mode == 'pipeline':
+        pipeline = newPipeline(agent, agent.PIPELINE_QUEUE_SIZE, agent.PIPELINE_OVERLOAD)
+        pipeline.start(state, gnmi)
+    ## - Stall: time the stream reader spends on one notification before it can read the next one
+    start = time.perf_counter()
+    max_stall = 0.0
+    total_stall = 0.0
+    notifications = 0
+    for notification in storm(agent, gnmi, names, flaps, interval, seed):
+        before = time.perf_counter()
+        if pipeline is not None:
+            pipeline.put(notification)
+        else:
+            with agent.state_lock:
+                agent.handleNotification(notification, state, gnmi)
+        stall = time.perf_counter() - before
+        max_stall = max(max_stall, stall)
+        total_stall += stall
+        notifications += 1
+    read = time.perf_counter() - start
+    waitSettled(agent, state, pipeline, timeout)
+    converged = time.perf_counter() - start
+    record = {
+        'mode' : mode,
+        'nodes' : len(names),
+        'notifications' : notifications,
+        'stream_read_s' : round(read, 4),
+        'max_stream_stall_s' : round(max_stall, 4),
+        'total_stream_stall_s' : round(total_stall, 4),
+        'converged_s' : round(converged, 4),
+        'gnmi_calls' : gnmi.calls,
+        'roles' : [state.leaves, state.spines, state.super_spines, state.borders, state.route_reflectors],
+    }
+    if pipeline is not None:
+        record['pipeline'] = str(pipeline)
+        pipeline.close()
+    state.route_batch.cancel()
+    state.roles_worker.close()
+    return record
+
+
+def dropCheck(agent, num_nodes, seed, timeout):
+    ## - Fabric up and converged, then a node leaves: its DELETE is queued first and dropped by the next two notifications
+    ## - (queue of 2, handler not started yet). The roles must match the ones of the same fabric learnt from scratch
+    names, sys_ids, tlvs = fabricLsdb(num_nodes, seed)
+    def fresh(gnmi):
+        state = agent.State()
+        state.underlay_protocol = 'IS-IS'
+        state.sys_ip = gnmi.ip(names[0])
+        return state
+    gnmi = SlowGnmi(names, sys_ids, tlvs, 0.0)
+    gnmi.up = set(names)
+    state = fresh(gnmi)
+    with agent.state_lock:
+        for node in names[1:]:
+            agent.handleNotification(routeNotification(gnmi, node, 0), state, gnmi)
+    waitSettled(agent, state, None, timeout)
+    leaving = next(n for n in reversed(names) if gnmi.ip(n) in state.leaves)
+    gnmi.up.discard(leaving)
+    pipeline = newPipeline(agent, 2, 'drop_oldest')
+    pipeline.put(routeNotification(gnmi, leaving, 2))
+    for node in names[1:3]:
+        pipeline.put(routeNotification(gnmi, node, 1))
+    pipeline.start(state, gnmi)
+    waitSettled(agent, state, pipeline, timeout)
+    expected = fresh(gnmi)
+    with agent.state_lock:
+        for node in names[1:]:
+            if node in gnmi.up:
+                agent.handleNotification(routeNotification(gnmi, node, 0), expected, gnmi)
+    waitSettled(agent, expected, None, timeout)
+    roles = lambda s: [sorted(s.leaves), sorted(s.spines), sorted(s.super_spines), sorted(s.borders)]
+    record = {
+        'mode' : 'drop_oldest',
+        'dropped' : pipeline.dropped,
+        'resyncs' : pipeline.resyncs,
+        'left_node_known' : gnmi.ip(leaving) in state.isis_nodes,
+        'same_roles' : roles(state) == roles(expected),
+    }
+    pipeline.close()
+    for s in (state, expected):
+        s.route_batch.cancel()
+        s.overlay_apply.cancel()
+        s.roles_worker.close()
+    return record
+
+
+def waitSettled(agent, state, pipeline, timeout):
+    deadline = time.monotonic() + timeout
+    while not settled(agent, state, pipeline) and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='notification storm handled inline and through the agent pipeline')
+    parser.add_argument('--nodes', type=int, default=60, help='approximate number of nodes of the fabric')
+    parser.add_argument('--flaps', type=int, default=1000, help='route notifications of flapping nodes after the fabric is up')
+    parser.add_argument('--interval', type=float, default=0.005, help='seconds between two notifications of flapping nodes')
+    parser.add_argument('--gnmi-latency', type=float, default=0.02, help='seconds taken by every gNMI call of the agent')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the fabric and of the flaps')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds the agent has to converge after the storm')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    args = parser.parse_args()
+
+    ## - Same layout as in the nodes: nodesRolesAlgorithm.py is mounted as algorithms/nodesRolesAlgorithm.py
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, 'algorithms'))
+        os.symlink(os.path.abspath(os.path.join(NDK_DIR, 'nodesRolesAlgorithm.py')), os.path.join(root, 'algorithms', 'nodesRolesAlgorithm.py'))
+        sys.path.insert(0, root)
+        sys.path.insert(0, NDK_DIR)
+        import configurationless as agent
+        sys.path.remove(root)
+    agent.logging.disable(agent.logging.CRITICAL)
+
+    results = [run(agent, mode, args.nodes, args.flaps, args.interval, args.gnmi_latency, args.seed, args.timeout) for mode in ['inline', 'pipeline']]
+    results.append(dropCheck(agent, args.nodes, args.seed, args.timeout))
+    summary = {
+        'summary' : True,
+        'same_roles' : results[0]['roles'] == results[1]['roles'],
+        'drop_oldest_roles' : results[2]['same_roles'] and results[2]['dropped'] == 1,
+        'stall_ratio' : round(results[0]['max_stream_stall_s'] / max(results[1]['max_stream_stall_s'], 1e-9), 1),
+    }
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in results + [summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    return 0 if summary['same_roles'] and summary['drop_oldest_roles'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
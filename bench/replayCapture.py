@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: replayCapture.py
+## Description: Replays a capture of the agent (CAPTURE_PATH in configurationless.py) without an
+##              SR Linux node. The recorded NDK notifications are fed to handleNotification, the
+##              recorded LSDB stream to the LSDB mirror, and the gNMI calls of the agent are answered
+##              from the recorded ones: a Get gets the last response recorded for the same request
+##              before the next event of the capture, a Set its recorded response (or a generic one).
+##              Events are fed as fast as possible (--speed 0) or at a multiple of their recorded
+##              pace. Reports the handling latency of each event, the total processing time, the
+##              gNMI calls and the final State, and whether the Sets are the recorded ones. The agent
+##              runs with its own settings (the change under test), or with the recorded ones. It
+##              starts cold, or resumes from a saved warm-restart state (--snapshot, read only).
+##              Usage: python3 bench/replayCapture.py CAPTURE [--speed 0] [--recorded-settings]
+##                                   [--snapshot FILE] [--events] [--output FILE] [--compare PREVIOUS_FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import argparse
+import tempfile
+import threading
+
+NDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk')
+
+
+def requestKey(request):
+    ## - Same key for a request recorded as JSON and the same request made by the agent (tuples are lists in JSON)
+    return json.dumps(request, sort_keys=True, default=str)
+
+
+class ReplayGnmi(object):
+    ## - gNMI client of the agent answered from the recorded calls, as of the replay position (seconds of the capture)
+    def __init__(self, calls):
+        self.responses = {}   # (method, request) -> [(seconds, response, error)]
+        self.recorded_sets = []
+        for seconds, call in calls:
+            request = {k : v for k, v in call['request'].items() if k != 'encoding'}
+            self.responses.setdefault((call['method'], requestKey(request)), []).append((seconds, call['response'], call['error']))
+            if call['method'] == 'set':
+                self.recorded_sets.append(requestKey(request))
+        self.position = 0.0
+        self.gets = 0
+        self.sets = []
+        self.misses = 0
+        self.stream = None
+
+    def answer(self, method, request):
+        entries = self.responses.get((method, requestKey(request)))
+        if not entries:
+            self.misses += 1
+            return None
+        i = bisect.bisect_left([seconds for seconds, _, _ in entries], self.position)
+        seconds, response, error = entries[max(i - 1, 0)]
+        if error is not None:
+            raise Exception(f"recorded gNMI error: {error}")
+        return response
+
+    def get(self, path, encoding=None):
+        self.gets += 1
+        response = self.answer('get', {'path' : path})
+        return response if response is not None else {'notification' : [{}]}
+
+    def set(self, update=None, replace=None, delete=None, encoding=None):
+        request = json.loads(json.dumps({'update' : update, 'replace' : replace, 'delete' : delete}, default=str))
+        self.sets.append(requestKey(request))
+        response = self.answer('set', request)
+        if response is not None:
+            return response
+        return {'response' : [{'path' : str(p).lstrip('/'), 'op' : 'UPDATE'} for p, _ in (update or []) + (replace or [])]}
+
+    def subscribe_stream(self, subscribe):
+        self.stream = ReplayStream()
+        return self.stream
+
+
+class ReplayStream(object):
+    ## - LSDB subscription fed by the replay: push() returns once the mirror asked for the next response,
+    ## - that is once it handled the pushed one, so that it is in step with the notifications
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = []
+        self.pushed = 0
+        self.taken = 0
+        self.closed = False
+
+    def push(self, response, timeout=5.0):
+        with self.condition:
+            self.pending.append(response)
+            self.pushed += 1
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.taken > self.pushed or self.closed, timeout)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self.condition:
+            self.taken += 1
+            self.condition.notify_all()
+            self.condition.wait_for(lambda: self.pending or self.closed)
+            if self.closed:
+                raise StopIteration
+            return self.pending.pop(0)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+def settled(agent, state):
+    with agent.state_lock:
+        return not agent.batchesPending(state)
+
+
+def stateSummary(state):
+    return {
+        'sys_ip' : state.sys_ip,
+        'net_id' : state.net_id,
+        'leaves' : state.leaves,
+        'spines' : state.spines,
+        'super_spines' : state.super_spines,
+        'borders' : state.borders,
+        'route_reflectors' : state.route_reflectors,
+        'isis_nodes' : len(state.isis_nodes),
+        'lldp_neighbors' : len(state.lldp_neighbors),
+        'overlay' : state.overlay,
+        'ibgp_timer_delay' : state.ibgp_timer_delay,
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(p * len(values)), len(values) - 1)] if values else 0.0
+
+
+def replay(agent, path, speed, timeout, with_events, recorded_settings, snapshot=None):
+    records = list(agent.readCapture(path))
+    header = next(payload for kind, _, payload in records if kind == agent.Capture.HEADER)
+    settings = {name : getattr(agent, name) for name in header['settings']}
+    if recorded_settings:
+        for name, value in header['settings'].items():
+            setattr(agent, name, value)
+    calls = [(seconds, payload) for kind, seconds, payload in records if kind == agent.Capture.GNMI]
+    events = [(kind, seconds, payload) for kind, seconds, payload in records if kind in (agent.Capture.NOTIFICATION, agent.Capture.STREAM)]
+    gnmi = ReplayGnmi(calls)
+    state = agent.State()
+    state.underlay_protocol = agent.UNDERLAY_PROTOCOL
+    ## - Start of Run: system ids, the configuration of the node and, with a snapshot, the warm restart. The snapshot
+    ## - is not captured: it comes from the node (or an earlier run) and is not written by the replay
+    gnmi.position = events[0][1] if events else float('inf')
+    resumed = agent.startUp(state, gnmi, header['hostname'], snapshot)
+    state.snapshot_path = None
+    mirrored = agent.LSDB_MIRROR and state.underlay_protocol == 'IS-IS' and any(kind == agent.Capture.STREAM for kind, _, _ in events)
+    if mirrored:
+        state.lsdb.on_change = lambda ips: agent.lsdbChanged(state, gnmi, ips)
+        state.lsdb.start(gnmi)
+
+    results = []
+    latencies = []
+    kinds = {}
+    start = time.perf_counter()
+    for i, (kind, seconds, payload) in enumerate(events):
+        if speed > 0:
+            wait = start + (seconds - events[0][1]) / speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        ## - Gets answered as of the next event: whatever the agent reads, the world is the one of the events fed so far
+        gnmi.position = events[i + 1][1] if i + 1 < len(events) else float('inf')
+        before = time.perf_counter()
+        if kind == agent.Capture.STREAM:
+            if mirrored:
+                gnmi.stream.push(payload)
+            name = 'lsdb_stream'
+        elif payload.HasField('config') and payload.config.key.js_path == ".commit.end":
+            continue
+        else:
+            name = payload.WhichOneof('subscription_types') or 'other'
+            with agent.state_lock:
+                agent.handleNotification(payload, state, gnmi)
+        latency = time.perf_counter() - before
+        kinds[name] = kinds.get(name, 0) + 1
+        latencies.append(latency * 1000)
+        if with_events:
+            results.append({'event' : i, 'kind' : name, 'recorded_s' : round(seconds, 4), 'latency_ms' : round(latency * 1000, 3)})
+    handled = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    while not settled(agent, state) and time.monotonic() < deadline:
+        time.sleep(0.005)
+    total = time.perf_counter() - start
+    if gnmi.stream is not None:
+        gnmi.stream.close()
+    state.lsdb.close()
+    state.route_batch.cancel()
+    state.lldp_writes.cancel()
+    state.overlay_apply.cancel()
+    state.roles_worker.close()
+    summary = {
+        'summary' : True,
+        'capture' : os.path.basename(path),
+        'hostname' : header['hostname'],
+        'events' : kinds,
+        'recorded_s' : round(events[-1][1] - events[0][1], 4) if events else 0.0,
+        'speed' : speed,
+        'settings' : 'recorded' if recorded_settings else 'agent',
+        'resumed' : resumed,
+        ## - Settings of the agent that differ from the recorded ones (replaced by them with --recorded-settings)
+        'changed_settings' : {name : settings[name] for name, value in header['settings'].items() if settings[name] != value},
+        'total_s' : round(total, 4),
+        'after_last_event_s' : round(total - (handled - start), 4),
+        'latency_ms' : {'p50' : round(percentile(latencies, 0.5), 3), 'p99' : round(percentile(latencies, 0.99), 3),
+                        'max' : round(max(latencies, default=0.0), 3), 'sum' : round(sum(latencies), 3)},
+        'gnmi' : {'gets' : gnmi.gets, 'sets' : len(gnmi.sets), 'unrecorded' : gnmi.misses},
+        'roles_computations' : state.roles_cache.misses,
+        'same_sets' : gnmi.sets == gnmi.recorded_sets,
+        'state' : stateSummary(state),
+    }
+    return results, summary
+
+
+def compare(summary, previous_file, tolerance):
+    ## - Final state of a previous replay of the same capture, and its times times tolerance
+    with open(previous_file) as f:
+        previous = [json.loads(line) for line in f if line.strip() and json.loads(line).get('summary')][-1]
+    regressions = []
+    if summary['state'] != previous['state']:
+        regressions.append({'metric' : 'state', 'previous' : previous['state']})
+    for metric, now, before in [('total_s', summary['total_s'], previous['total_s']),
+                                ('latency_p99_ms', summary['latency_ms']['p99'], previous['latency_ms']['p99']),
+                                ('latency_sum_ms', summary['latency_ms']['sum'], previous['latency_ms']['sum'])]:
+        if now > before * tolerance:
+            regressions.append({'metric' : metric, 'value' : now, 'previous' : before})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay of a capture of the configurationless agent')
+    parser.add_argument('capture', help='capture file written by the agent (CAPTURE_PATH)')
+    parser.add_argument('--speed', type=float, default=0.0, help='0: as fast as possible; otherwise pace of the capture times this factor')
+    parser.add_argument('--recorded-settings', action='store_true', help='runs the agent with the settings of the capture (batch windows, RRs...)')
+    parser.add_argument('--snapshot', help='warm-restart state saved by the agent (SNAPSHOT_PATH) to resume from, instead of a cold start')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds the agent has to settle after the last event')
+    parser.add_argument('--events', action='store_true', help='one JSON line per event with its handling latency')
+    parser.add_argument('--log', action='store_true', help='agent logs on stderr')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON lines output of the same capture to check for changes and regressions')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown factor reported as a regression')
+    args = parser.parse_args()
+
+    ## - Same layout as in the nodes: nodesRolesAlgorithm.py is mounted as algorithms/nodesRolesAlgorithm.py
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, 'algorithms'))
+        os.symlink(os.path.abspath(os.path.join(NDK_DIR, 'nodesRolesAlgorithm.py')), os.path.join(root, 'algorithms', 'nodesRolesAlgorithm.py'))
+        sys.path.insert(0, root)
+        sys.path.insert(0, NDK_DIR)
+        import configurationless as agent
+        sys.path.remove(root)
+    if args.log:
+        agent.logging.basicConfig(stream=sys.stderr, level=agent.LOG_LEVEL)
+    else:
+        agent.logging.disable(agent.logging.CRITICAL)
+
+    results, summary = replay(agent, args.capture, args.speed, args.timeout, args.events, args.recorded_settings, args.snapshot)
+    if args.compare:
+        summary['regressions'] = compare(summary, args.compare, args.tolerance)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in results + [summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    return 1 if summary.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: rolesBenchmark.py
+## Description: Scaling benchmark of nodesRolesAlgorithm over generated 3-stage and 5-stage Clos
+##              fabrics (see closTopology.py). For each fabric size it checks the inferred roles
+##              against the expected ones and reports the wall time and the peak memory as JSON
+##              lines, plus the scaling exponent between consecutive sizes.
+##              Usage: python3 bench/rolesBenchmark.py [--sizes 10 100 1000] [--output FILE]
+##                                                     [--compare PREVIOUS_FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk'))
+from nodesRolesAlgorithm import nodesRolesAlgorithm
+from closTopology import closForSize
+
+DEFAULT_SIZES = [10, 30, 100, 300, 1000, 3000, 10000]
+
+
+def runCase(num_nodes, stages, repeat, seed):
+    fabric = closForSize(num_nodes, stages)
+    g, order = fabric.toGraph(seed=seed)
+    ## - Wall time: best of the repetitions, without tracemalloc overhead
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        roles = nodesRolesAlgorithm(g)
+        times.append(time.perf_counter() - start)
+    ## - Peak memory: one more run under tracemalloc
+    tracemalloc.start()
+    nodesRolesAlgorithm(g)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    expected = fabric.expectedRoles(order)
+    correct = all(set(roles[i]) == expected[i] and len(roles[i]) == len(expected[i]) for i in range(4))
+    return {
+        'stages' : stages,
+        'nodes' : len(g) - 1,
+        'links' : len(fabric.links),
+        'seconds' : min(times),
+        'peak_kb' : round(peak / 1024.0, 1),
+        'correct' : correct,
+    }
+
+
+def scalingExponents(results):
+    ## - Slope of log(time) over log(nodes) between consecutive sizes of the same fabric type
+    for prev, cur in zip(results, results[1:]):
+        if prev['stages'] == cur['stages'] and cur['nodes'] > prev['nodes'] and prev['seconds'] > 0:
+            cur['exponent'] = round(math.log(cur['seconds'] / prev['seconds']) / math.log(cur['nodes'] / prev['nodes']), 2)
+
+
+def compare(results, previous_file, tolerance):
+    ## - Flags the cases that got slower than tolerance times the previous run
+    previous = {}
+    with open(previous_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if 'nodes' in record:
+                previous[(record['stages'], record['nodes'])] = record
+    regressions = []
+    for r in results:
+        old = previous.get((r['stages'], r['nodes']))
+        if old is not None and r['seconds'] > old['seconds'] * tolerance:
+            regressions.append({'stages' : r['stages'], 'nodes' : r['nodes'], 'seconds' : r['seconds'], 'previous_seconds' : old['seconds']})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='nodesRolesAlgorithm scaling benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='approximate number of nodes of each fabric')
+    parser.add_argument('--stages', type=int, nargs='+', default=[3, 5], choices=[3, 5], help='Clos fabric types')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per fabric (the best time is reported)')
+    parser.add_argument('--seed', type=int, default=1, help='seed used to shuffle the node ids')
+    parser.add_argument('--budget', type=float, default=30.0, help='skip the larger sizes once a run takes longer than this (seconds)')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON lines output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown factor reported as a regression')
+    args = parser.parse_args()
+
+    results = []
+    skipped = []
+    for stages in args.stages:
+        over_budget = False
+        for size in sorted(args.sizes):
+            if over_budget:
+                skipped.append({'stages' : stages, 'size' : size})
+                continue
+            results.append(runCase(size, stages, args.repeat, args.seed))
+            over_budget = results[-1]['seconds'] > args.budget
+    scalingExponents(results)
+    summary = {
+        'summary' : True,
+        'python' : platform.python_version(),
+        'cases' : len(results),
+        'all_correct' : all(r['correct'] for r in results),
+        'skipped' : skipped,
+    }
+    if args.compare:
+        summary['regressions'] = compare(results, args.compare, args.tolerance)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in results + [summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    if not summary['all_correct'] or summary.get('regressions'):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
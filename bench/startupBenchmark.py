@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: startupBenchmark.py
+## Description: Startup benchmark of the configurationless agent, without SR Linux nodes. Each run
+##              starts a fresh interpreter that imports the agent (time until it can register with
+##              the NDK manager), imports the gNMI client (deferred until after the registration)
+##              and handles a first route notification against an in-memory gNMI stub. Reports
+##              the best of the runs as JSON lines, plus the heavy modules loaded at registration.
+##              Usage: python3 bench/startupBenchmark.py [--repeat 5] [--output FILE]
+##                                                       [--compare PREVIOUS_FILE]
+##################################################################################################
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import platform
+import tempfile
+import subprocess
+
+NDK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ndk')
+HEAVY_MODULES = ['numpy', 'pygnmi', 'multiprocessing', 'concurrent.futures.process', 'ndk.telemetry_service_pb2']
+METRICS = ['process_s', 'import_s', 'gnmi_import_s', 'first_notification_s', 'to_first_notification_s']
+
+
+class GnmiStub(object):
+    ## - Answers the two gets of a route notification with a 2-node IS-IS topology
+    def __init__(self, me, neighbor):
+        self.nodes = [(me, '1000.0000.0001'), (neighbor, '1000.0000.0002')]
+
+    def get(self, path, encoding=None):
+        if 'route-table' in path[0]:
+            routes = [{'ipv4-prefix' : ip + '/32', 'route-owner' : 'isis_mgr'} for ip, _ in self.nodes]
+            return {'notification' : [{'update' : [{'val' : {'route' : routes}}]}]}
+        lsps = []
+        for ip, sys_id in self.nodes:
+            neighbors = [{'neighbor' : other + '.00', 'default-metric' : 10} for _, other in self.nodes if other != sys_id]
+            lsps.append({'lsp-id' : sys_id + '.00-00', 'defined-tlvs' : {'ipv4-interface-addresses' : [ip], 'extended-is-reachability' : neighbors}})
+        return {'notification' : [{'update' : [{'val' : {'level-database' : lsps}}]}]}
+
+    def set(self, update=None, replace=None, delete=None, encoding=None):
+        return {'response' : []}
+
+
+def child(algorithms_root):
+    ## - Runs in a fresh interpreter: the agent imports nodesRolesAlgorithm from the algorithms folder
+    sys.path.insert(0, algorithms_root)
+    sys.path.insert(0, NDK_DIR)
+    start = time.perf_counter()
+    import configurationless as agent
+    imported = time.perf_counter()
+    loaded = {m : m in sys.modules for m in HEAVY_MODULES}
+    importlib.import_module('pygnmi.client')
+    gnmi_imported = time.perf_counter()
+
+    from ndk.sdk_service_pb2 import Notification
+    notification = Notification()
+    notification.route.op = 0
+    notification.route.key.ip_prefix.ip_addr.addr = bytes([10, 0, 0, 2])
+    notification.route.key.ip_prefix.prefix_length = 32
+    state = agent.State()
+    state.underlay_protocol = 'IS-IS'
+    state.sys_ip = '10.0.0.1'
+    before = time.perf_counter()
+    with agent.state_lock:
+        agent.handleNotification(notification, state, GnmiStub('10.0.0.1', '10.0.0.2'))
+    handled = time.perf_counter()
+    state.roles_worker.close()
+    return {
+        'import_s' : imported - start,
+        'gnmi_import_s' : gnmi_imported - imported,
+        'first_notification_s' : handled - before,
+        'to_first_notification_s' : (imported - start) + (gnmi_imported - imported) + (handled - before),
+        'loaded_at_registration' : loaded,
+    }
+
+
+def runOnce(algorithms_root):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', algorithms_root],
+                         check=True, capture_output=True, text=True).stdout
+    record = json.loads(out.strip().splitlines()[-1])
+    record['process_s'] = time.perf_counter() - start
+    return record
+
+
+def compare(result, previous_file, tolerance):
+    ## - Flags the metrics that got slower than tolerance times the previous run
+    with open(previous_file) as f:
+        previous = [json.loads(line) for line in f if line.strip()][0]
+    return [{'metric' : m, 'seconds' : result[m], 'previous_seconds' : previous[m]}
+            for m in METRICS if m in previous and result[m] > previous[m] * tolerance]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='configurationless agent startup benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters started (the best time of each metric is reported)')
+    parser.add_argument('--output', help='JSON lines file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON lines output to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='slowdown factor reported as a regression')
+    parser.add_argument('--child', metavar='ALGORITHMS_ROOT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.child)))
+        return 0
+
+    ## - Same layout as in the nodes: nodesRolesAlgorithm.py is mounted as algorithms/nodesRolesAlgorithm.py
+    with tempfile.TemporaryDirectory() as root:
+        os.mkdir(os.path.join(root, 'algorithms'))
+        os.symlink(os.path.abspath(os.path.join(NDK_DIR, 'nodesRolesAlgorithm.py')), os.path.join(root, 'algorithms', 'nodesRolesAlgorithm.py'))
+        runs = [runOnce(root) for _ in range(args.repeat)]
+
+    result = {m : round(min(r[m] for r in runs), 4) for m in METRICS}
+    result['loaded_at_registration'] = runs[0]['loaded_at_registration']
+    summary = {
+        'summary' : True,
+        'python' : platform.python_version(),
+        'runs' : len(runs),
+    }
+    if args.compare:
+        summary['regressions'] = compare(result, args.compare, args.tolerance)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    for record in [result, summary]:
+        out.write(json.dumps(record) + '\n')
+    if args.output:
+        out.close()
+    if summary.get('regressions'):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
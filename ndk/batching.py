@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: batching.py
+## Description: Batches of the agent, handled by a timer thread once they are due: the route
+##              notifications of a burst are handled with one recompute of the roles, the
+##              configurations of new LLDP neighbors are written with one gNMI SetRequest, and the
+##              overlay is applied once the ibgp-timer-delay is over.
+##################################################################################################
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class RouteBatch(object):
+    ## - Route notifications waiting to be handled together: only the latest op of each prefix is kept
+    ## - A batch is due after a quiet window without notifications, or at most max_delay after its first one
+    def __init__(self, quiet_window, max_delay):
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.ops = OrderedDict()
+        self.first = None
+        self.last = None
+        self.timer = None
+        self.notifications = 0
+        self.batches = 0
+        self.ids = []
+
+    def add(self, ip, op, ids=()):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.notifications += 1
+        self.ids.extend(ids)
+        if ip in self.ops:
+            ## - Whether the node was known before the batch or not, an update (value: 1) handles both
+            del self.ops[ip]
+            if op == 0:
+                op = 1
+        self.ops[ip] = op
+
+    def due(self):
+        ## - Seconds until the batch has to be handled
+        if self.first is None:
+            return 0.0
+        return max(0.0, min(self.last + self.quiet_window, self.first + self.max_delay) - time.monotonic())
+
+    def schedule(self, flush):
+        self.timer = threading.Timer(self.due(), flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def drain(self):
+        ops = list(self.ops.items())
+        self.ops.clear()
+        self.ids = []
+        self.first = None
+        self.last = None
+        self.batches += 1
+        return ops
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __str__(self):
+        return f"notifications={self.notifications} batches={self.batches}"
+
+
+class LldpWriteBatch(object):
+    ## - Interface, network-instance and IS-IS interface configurations of new (or gone) LLDP neighbors, buffered
+    ## - over a short window and written with one gNMI SetRequest: one update per interface, plus a single
+    ## - network-instance update and a single IS-IS update listing every interface of the batch
+    ## - A SetRequest is applied as a whole, so an interface is never left half configured
+    def __init__(self, window, size):
+        self.window = window
+        self.size = size
+        self.interfaces = OrderedDict()   # interface name -> {'configure' : bool, 'isis' : 'enable' or 'disable', 'events' : [(op, neighbor)]}
+        self.first = None
+        self.timer = None
+        self.batches = 0
+        self.last_latency = 0.0
+        self.last_set_time = 0.0
+        self.ids = []
+
+    def add(self, interface_name, op, neighbor, ids=()):
+        if self.first is None:
+            self.first = time.monotonic()
+        self.ids.extend(ids)
+        entry = self.interfaces.setdefault(interface_name, {'configure' : False, 'isis' : 'enable', 'events' : []})
+        if op == 0:
+            entry['configure'] = True
+            entry['isis'] = 'enable'
+        else:
+            entry['isis'] = 'disable'
+        entry['events'].append((op, neighbor))
+
+    def full(self):
+        return len(self.interfaces) >= self.size
+
+    def due(self):
+        ## - Seconds until the batch has to be written
+        if self.first is None:
+            return 0.0
+        return max(0.0, self.first + self.window - time.monotonic())
+
+    def schedule(self, flush):
+        self.timer = threading.Timer(self.due(), flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def drain(self):
+        interfaces = self.interfaces
+        waited = time.monotonic() - self.first if self.first is not None else 0.0
+        self.interfaces = OrderedDict()
+        self.ids = []
+        self.first = None
+        return interfaces, waited
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def __len__(self):
+        return len(self.interfaces)
+
+    def __str__(self):
+        return f"batches={self.batches} last_latency={self.last_latency * 1000:.1f}ms last_set={self.last_set_time * 1000:.1f}ms"
+
+
+class OverlaySchedule(object):
+    ## - Overlay apply deferred by the ibgp-timer-delay of the YANG configuration and run in a timer thread, so that the
+    ## - agent keeps handling notifications meanwhile. A newer overlay replaces the pending one and keeps its deadline
+    ## - A failed gNMI set is retried with an exponential backoff, with the latest overlay at that time
+    def __init__(self, retry_base, retry_max):
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.desired = None
+        self.pending = False
+        self.timer = None
+        self.failures = 0
+        self.applies = 0
+        self.superseded = 0
+        self.ids = []
+
+    def add(self, desired, ids=()):
+        if self.pending:
+            self.superseded += 1
+        self.desired = desired
+        self.pending = True
+        self.ids.extend(ids)
+
+    def backoff(self):
+        ## - Seconds before the next retry
+        return min(self.retry_max, self.retry_base * 2 ** (self.failures - 1))
+
+    def schedule(self, delay, flush):
+        self.timer = threading.Timer(delay, flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def drain(self):
+        desired = self.desired
+        self.desired = None
+        self.pending = False
+        self.ids = []
+        return desired
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def __str__(self):
+        return f"applies={self.applies} superseded={self.superseded} failures={self.failures}"
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: capture.py
+## Description: Capture of what the agent reads from the outside (NDK notifications, gNMI calls and
+##              streams), written to a gzip file while it runs and read back by bench/replayCapture.py
+##              to replay it offline.
+##################################################################################################
+"""
+import time
+import json
+import gzip
+import struct
+import threading
+from ndk.sdk_service_pb2 import Notification
+
+CAPTURE_VERSION = 1
+
+
+class Capture(object):
+    ## - Records what the agent reads from the outside: NDK notifications (protobuf), gNMI calls (request and
+    ## - response, JSON) and the responses of gNMI streams (JSON), for an offline replay (bench/replayCapture.py).
+    ## - gzip file of records: kind (1 byte), seconds since the capture started (double), length (uint32), payload
+    RECORD = struct.Struct('<cdI')
+    HEADER, NOTIFICATION, GNMI, STREAM = b'h', b'n', b'g', b's'
+
+    ## - settings: the agent settings that shape the handling, recorded in the header ({name : value})
+    def __init__(self, path, hostname, settings):
+        self.file = gzip.open(path, 'wb', compresslevel=5)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.records = 0
+        self.write(self.HEADER, json.dumps({'version' : CAPTURE_VERSION, 'hostname' : hostname, 'time' : time.time(), 'settings' : settings}).encode())
+
+    def write(self, kind, payload):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(self.RECORD.pack(kind, time.monotonic() - self.start, len(payload)))
+            self.file.write(payload)
+            self.records += 1
+
+    def notification(self, notification):
+        self.write(self.NOTIFICATION, notification.SerializeToString())
+
+    def gnmi(self, method, request, response, error=None):
+        self.write(self.GNMI, json.dumps({'method' : method, 'request' : request, 'response' : response, 'error' : error},
+                                         separators=(',', ':'), default=str).encode())
+
+    def stream(self, response):
+        self.write(self.STREAM, json.dumps(response, separators=(',', ':'), default=str).encode())
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class CapturedStream(object):
+    ## - gNMI subscription whose responses are also written to the capture
+    def __init__(self, subscription, capture):
+        self.subscription = subscription
+        self.capture = capture
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        response = next(self.subscription)
+        self.capture.stream(response)
+        return response
+
+    def close(self):
+        self.subscription.close()
+
+
+def readCapture(path):
+    ## - Records of a capture as (kind, seconds, payload): Notification protobufs, dicts for the others
+    with gzip.open(path, 'rb') as f:
+        while True:
+            head = f.read(Capture.RECORD.size)
+            if len(head) < Capture.RECORD.size:
+                return
+            kind, seconds, length = Capture.RECORD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length:
+                return   # Cut short (the agent was killed): the records before are usable
+            if kind == Capture.NOTIFICATION:
+                notification = Notification()
+                notification.ParseFromString(payload)
+                yield kind, seconds, notification
+            else:
+                yield kind, seconds, json.loads(payload)
@@ -17,6 +17,21 @@
 """
 from algorithms.nodesRolesAlgorithm import nodesRolesAlgorithm
 from algorithms.nodesRolesAlgorithm import intersect
+from algorithms.nodesRolesAlgorithm import IncrementalRoles
+## - Subsystems of the agent, in the same folder
+from rolesCache import RolesCache
+from rolesWorker import RolesWorker
+from batching import RouteBatch, LldpWriteBatch, OverlaySchedule
+from lsdbMirror import IsisLsdb
+from isisTopology import IsisNodeTable
+import tracing
+from tracing import Trace, span, trace, trace_ids
+from profiler import SamplingProfiler
+from pipeline import NotificationPipeline
+from capture import Capture, readCapture   # readCapture: for bench/replayCapture.py
+from histograms import Histogram
+from gnmiSession import GnmiSession
+from telemetry import AgentTelemetry
 import grpc
 import ctypes
 import os
@@ -27,14 +42,16 @@ import signal
 import socket
 import ipaddress
 import json
+import queue
+import atexit
 import threading
 import random
 import logging
 import traceback
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from copy import copy, deepcopy
-from pygnmi.client import gNMIclient
-from ndk import appid_service_pb2
+## - NDK services needed to register the agent and read its notifications. sdk_service_pb2 loads the modules of
+## - every event type itself (they are fields of Notification); the telemetry service is imported once registered
 from ndk.sdk_service_pb2_grpc import SdkMgrServiceStub
 from ndk.sdk_service_pb2_grpc import SdkNotificationServiceStub
 from ndk.sdk_service_pb2 import AgentRegistrationRequest
@@ -42,13 +59,11 @@ from ndk.sdk_common_pb2 import SdkMgrStatus
 from ndk.sdk_service_pb2 import NotificationRegisterRequest
 from ndk.sdk_service_pb2 import NotificationStreamRequest
 from ndk.sdk_service_pb2 import Notification
-from ndk.sdk_service_pb2 import AppIdRequest
 from ndk import interface_service_pb2
 from ndk import networkinstance_service_pb2
 from ndk import lldp_service_pb2
 from ndk import route_service_pb2
 from ndk import config_service_pb2
-from ndk.config_service_pb2 import ConfigSubscriptionRequest
 
 ## - Application name
 app_name ='configurationless'
@@ -67,6 +82,12 @@ SR_CA = '/ca.pem'
 SR_USER = 'admin'
 SR_PASSWORD = 'NokiaSrl1!'
 GNMI_PORT = '57400'
+GNMI_GET_TIMEOUT = 30 # Seconds a gNMI Get may take: the call fails and the session reconnects
+GNMI_SET_TIMEOUT = 30 # Seconds a gNMI Set may take: the call fails and the session reconnects
+GNMI_KEEPALIVE = 10 # Seconds between keepalive pings of the gNMI channel
+GNMI_RECONNECT_ATTEMPTS = 5 # Connection attempts (1s, 2s, 4s... apart) before a gNMI call fails on a lost session
+GNMI_DEBUG = False # Logs every gNMI request and response (can be changed at runtime: gnmiclient.debug)
+GNMI_PAYLOAD_SAMPLE = 16 # One gNMI call in that many, per method and path, is sized for the payload histogram
 SDK_MGR_FAILED = 'kSdkMgrFailed'   ### New convention = 'SDK_MGR_STATUS_FAILED'   ### Old convention = 'kSdkMgrFailed'
 NOS_TYPE = 'SRLinux'
 NEIGHBOR_CHASSIS = 'neighbor_chassis'
@@ -77,11 +98,53 @@ UNDERLAY_PROTOCOL = 'IS-IS' # can be changed to OSPFv3
 AREA_ID = '49.0001'
 ISIS_INSTANCE = 'i1'
 ISIS_LEVEL_CAPABILITY = 'L1'
-RR_NUMBER = 2
+ISIS_ROUTES_PATH = "/network-instance[name=default]/route-table/ipv4-unicast/route[ipv4-prefix=*][route-type=isis][route-owner=isis_mgr][id=0][origin-network-instance=default]/ipv4-prefix"
+ISIS_LSDB_PATH = f"network-instance[name=default]/protocols/isis/instance[name={ISIS_INSTANCE}]/level-database[level-number=1][lsp-id=*]/defined-tlvs"
+RR_NUMBER = 2 # Route Reflectors of each scope (YANG: route-reflectors/count): the fabric, or each pod and the top of the hierarchy
+RR_STRATEGY = 'global' # YANG route-reflectors/strategy: 'global' (RRs of the whole fabric), 'per-pod' (RRs in each pod, meshed together) or 'hierarchical' (RRs in each pod, clients of super-spine RRs)
+RR_CLUSTER_SIZE = 2 # RRs sharing a cluster-id (YANG route-reflectors/cluster-size): the clients of a scope are spread over its clusters
+INCREMENTAL_ROLES = True # False runs the full roles algorithm on every notification
+                          # It keeps 2 hop-count arrays per equivalence group (2 bytes x groups x nodes each): about 4 MB at
+                          # 3,000 nodes (250 groups), 10 MB at 5,000 nodes (418 groups). Its first computation takes about
+                          # 1.4 times a full run (one BFS per group over the whole fabric); a change then takes tens of ms
+ROLES_CACHE_SIZE = 16 # Number of topologies whose roles and RRs are kept
+ROLES_IN_WORKER = False # True computes the roles in a worker process, off the notification loop
+ROUTE_QUIET_WINDOW = 0.2 # Seconds without route notifications before a batch is handled (0 handles each notification at once)
+ROUTE_MAX_DELAY = 2.0 # Seconds a batch may wait for a quiet window after its first notification
+LSDB_MIRROR = True # False reads the whole IS-IS LSDB with a gNMI GET on every batch of route notifications
+LLDP_WRITE_WINDOW = 0.1 # Seconds LLDP neighbor configurations are buffered before one gNMI SetRequest (0 writes each one at once)
+LLDP_WRITE_BATCH = 64 # Interfaces that flush the buffered LLDP neighbor configurations without waiting for the window
+PIPELINE_QUEUE_SIZE = 1024 # Notifications read from the NDK stream and waiting for the handler thread
+PIPELINE_OVERLOAD = 'block' # Queue full: 'block' holds the NDK stream until there is room, 'drop_oldest' drops the oldest queued route notification
+PIPELINE_STATS_INTERVAL = 60 # Seconds between two logs of the pipeline queue depth and stage latencies
+WARM_RESTART = True # Saves the converged state to SNAPSHOT_PATH and resumes from it on restart, if it matches the IS-IS LSDB
+SNAPSHOT_PATH = '/etc/opt/srlinux/appmgr/dcf-ztp/configurationless_state.json'
+SNAPSHOT_VERSION = 3
+TRACE_SPANS = True # Times the stages of the handling of each notification (False: no timing at all)
+TRACE_SLOW = 0.1 # Seconds: slower notifications (or batches) log their spans at INFO level, the others at DEBUG level
+PROFILE_NOTIFICATIONS = 100 # Notifications profiled after a SIGUSR1 (YANG: profile-notifications)
+PROFILE_INTERVAL = 0.005 # Seconds between two samples of the stacks of the agent threads while profiling
+PROFILE_MAX_SECONDS = 300 # Longest profiling, when fewer notifications arrive
+PROFILE_DIR = '/var/log/srlinux/stdout'
+LOG_LEVEL = logging.INFO # DEBUG adds the IS-IS graph, every notification and every trace
+LOG_MAX_BYTES = 3000000 # Size of the log file before it rotates
+LOG_BACKUPS = 5 # Rotated log files kept
+CAPTURE_PATH = None # e.g. '/var/log/srlinux/stdout/configurationless.capture': records the NDK notifications and gNMI calls (replay: bench/replayCapture.py)
+CAPTURE_SETTINGS = ['RR_NUMBER', 'RR_STRATEGY', 'RR_CLUSTER_SIZE', 'INCREMENTAL_ROLES', 'ROLES_IN_WORKER', 'ROUTE_QUIET_WINDOW', 'ROUTE_MAX_DELAY', 'LSDB_MIRROR',
+                    'LLDP_WRITE_WINDOW', 'LLDP_WRITE_BATCH', 'IBGP_TIMER_DELAY'] # Recorded in the capture: they shape the handling
+TELEMETRY_INTERVAL = 10 # Seconds between two updates of the agent statistics (YANG: /system/configurationless/statistics)
 IBGP_ASN = '100'
+IBGP_TIMER_DELAY = 2 # Seconds an overlay apply is deferred, until ibgp-timer-delay is read from the YANG configuration (same default)
+OVERLAY_RETRY_BASE = 1.0 # Seconds before the first retry of a failed iBGP configuration, doubled on every failure
+OVERLAY_RETRY_MAX = 60.0 # Longest wait between two retries of a failed iBGP configuration
 
 event_types = ['intf', 'nw_inst', 'lldp', 'route', 'cfg']
 
+## - Serializes the notification handling with the roles coming back from the worker process
+state_lock = threading.RLock()
+## - Timing of the notification handling
+tracing.configure(TRACE_SPANS, TRACE_SLOW)
+
 
 #####################################################
 ####     METHODS TO CREATE THE NOTIFICATIONS     ####
@@ -131,22 +194,46 @@ class State(object):
     def __init__(self):
         self.lldp_neighbors = []
         self.new_lldp_notification = False
-        self.isis_nodes = [] #[ {role : leaf, ip_addr : 1.1.1.1, net_id : 49.0001.1A0D.00FF.0000.00, neighbors_ip : [ {ip_addr:2.2.2.2}, ...], neighbors_net_id } ]
+        self.isis_nodes = IsisNodeTable() # { ip_addr : { ip_addr : 1.1.1.1, net_id : 49.0001.1A0D.00FF.0000.00, neighbors_net_id : {49.0001.1A0D.00FF.0001.00 : None, ...} } }
         self.underlay_protocol = ""
         self.net_id = ""
         self.sys_ip = ""
         self.mac = ""
         self.route_reflectors = []
+        self.rr_clusters = [] # [{'cluster_id', 'route_reflectors', 'clients', 'peers' (non-client RRs)}], see electRouteReflectors
+        self.rr_number = RR_NUMBER
+        self.rr_strategy = RR_STRATEGY
+        self.rr_cluster_size = RR_CLUSTER_SIZE
         self.leaves = []
         self.spines = []
         self.super_spines = []
         self.borders = []
         self.ibgp = False
+        self.overlay = None # Last applied overlay: {'cluster_id' : RR cluster-id or None, 'neighbors' : [peer IPs], 'non_clients' : [peer IPs]}
+        self.ibgp_timer_delay = IBGP_TIMER_DELAY
+        self.overlay_apply = OverlaySchedule(OVERLAY_RETRY_BASE, OVERLAY_RETRY_MAX)
+        self.snapshot_path = None # No snapshot is saved unless set
+        self.snapshot_saved = None
+        self.roles_durations = Histogram(GnmiSession.LATENCY_BOUNDS) # ms
+        self.converged_at = None
+        self.profiler = None
+        self.profile_notifications = 0
+        self.roles_engine = IncrementalRoles(order_key=ipaddress.ip_address)
+        self.roles_cache = RolesCache(ROLES_CACHE_SIZE)
+        self.roles_worker = RolesWorker()
+        self.roles_generation = 0
+        self.route_batch = RouteBatch(ROUTE_QUIET_WINDOW, ROUTE_MAX_DELAY)
+        self.lsdb = IsisLsdb(ISIS_LSDB_PATH, state_lock)
+        self.lldp_writes = LldpWriteBatch(LLDP_WRITE_WINDOW, LLDP_WRITE_BATCH)
 
     def __str__(self):
         return str(self.__class__) + ": " + str(self.__dict__)
 
 
+def batchesPending(state):
+    return any(batch.timer is not None for batch in (state.route_batch, state.lldp_writes, state.overlay_apply))
+
+
 def binaryToDecimal(binary):
     ## - Convert binary string to decimal integer
     decimal = int(binary, 2)
@@ -185,26 +272,110 @@ def macToSYSID(mac_address:str):
     return sys_id
 
 
-def fillNodesNeighbors(state):
-    ## - Searches over each node's neighbor NET ID and compares with each node's NET ID to retrieve that IP
-    for node in state.isis_nodes:
-        if len(node['neighbors_ip']) != len(node['neighbors_net_id']):
-            node['neighbors_ip'] = []
-            for net in node['neighbors_net_id']:
-                for other_node in state.isis_nodes:
-                    if str(net) == str(other_node['net_id']):
-                        node['neighbors_ip'].append(other_node['ip_addr'])
-                        break
+def isisAdjacency(state):
+    ## - IP of each IS-IS node -> IPs of its known neighbors
+    return state.isis_nodes.adjacency()
 
-def orderIPs(ip_list):
-    try:
-        ip_objects = []
-        for ip in ip_list:
-            ip_objects.append(ipaddress.ip_address(ip))
-        ip_objects.sort()
-        return ip_objects
-    except ValueError as e:
-        logging.info(f"[ERROR] :: Invalid IP address format: {e}")
+def topologyFingerprint(nodes):
+    ## - Canonical form of the adjacency: does not depend on the order of the nodes or of their neighbors
+    return frozenset((ip, frozenset(neighbors)) for ip, neighbors in nodes.items())
+
+def rrSettings(state):
+    return (state.rr_number, state.rr_strategy, state.rr_cluster_size)
+
+def electRouteReflectors(leaves, spines, super_spines, border, nodes=None, count=RR_NUMBER, strategy=RR_STRATEGY, cluster_size=RR_CLUSTER_SIZE):
+    ## - RR clusters of the fabric: [{'cluster_id', 'route_reflectors', 'clients', 'peers'}], where peers are the RRs this cluster
+    ## - peers with as non-clients (the other clusters of its level, or the RRs of the upper level)
+    ## - Only depends on the roles, the adjacency and the settings: every node of the fabric elects the same clusters
+    nodes = nodes or {}
+    if strategy == 'global':
+        ## - Route Reflectors are elected among super-spines, then border-leaves, spines and leaves
+        rrs = pickRouteReflectors([super_spines, border, spines, leaves], count, leaves, nodes)
+        clusters = clusterScope(rrs, leaves, cluster_size)
+        meshClusters(clusters)
+        return clusters
+    pods = fabricPods(nodes, leaves, spines)
+    podded = set(ip for pod in pods for ip in pod)
+    core = [ip for ip in leaves if ip not in podded]
+    leaf_set = set(leaves)
+    pod_clusters = []
+    for pod in pods:
+        ## - RRs of a pod: its spines connected to most of its leaves, then its leaves
+        pod_leaves = [ip for ip in pod if ip in leaf_set]
+        rrs = pickRouteReflectors([[ip for ip in pod if ip not in leaf_set], pod_leaves], count, pod_leaves, nodes)
+        pod_clusters.extend(clusterScope(rrs, pod_leaves, cluster_size))
+    if strategy == 'hierarchical' and super_spines:
+        ## - The RRs of each pod cluster (and the leaves out of any pod) are clients of one cluster of super-spine RRs
+        pod_rrs = [ip for cluster in pod_clusters for ip in cluster['route_reflectors']]
+        top_clusters = clusterScope(pickRouteReflectors([super_spines], count, pod_rrs, nodes), [], cluster_size)
+        if top_clusters:
+            for cluster in pod_clusters:
+                top = min(top_clusters, key=lambda c: len(c['clients']))
+                top['clients'].extend(cluster['route_reflectors'])
+                cluster['peers'] = list(top['route_reflectors'])
+            spreadClients(top_clusters, core)
+        meshClusters(top_clusters)
+        return top_clusters + pod_clusters
+    ## - per-pod (or a hierarchy without super-spines): leaves out of any pod get their own clusters, all RRs are meshed
+    if core:
+        pod_clusters.extend(clusterScope(pickRouteReflectors([super_spines, border, core], count, core, nodes), core, cluster_size))
+    meshClusters(pod_clusters)
+    return pod_clusters
+
+def pickRouteReflectors(tiers, count, clients, nodes):
+    ## - The first count candidates, tier by tier; within a tier the ones adjacent to most clients, then the lowest IPs
+    clients = set(clients)
+    elected = []
+    for tier in tiers:
+        if len(elected) >= count:
+            break
+        ranked = sorted((ip for ip in tier if ip not in elected),
+                        key=lambda ip: (-len(clients.intersection(nodes.get(ip, ()))), ipaddress.ip_address(ip)))
+        elected.extend(ranked[:count - len(elected)])
+    return elected
+
+def clusterScope(rrs, clients, cluster_size):
+    ## - cluster_size RRs per cluster-id (the first of them), and the clients of the scope spread over the clusters
+    clusters = [{'cluster_id' : str(rrs[i]), 'route_reflectors' : rrs[i:i + cluster_size], 'clients' : [], 'peers' : []}
+                for i in range(0, len(rrs), max(cluster_size, 1))]
+    spreadClients(clusters, [ip for ip in clients if ip not in rrs])
+    return clusters
+
+def spreadClients(clusters, clients):
+    ## - Each client, by IP, joins the cluster with the fewest clients so far (the first one on a tie)
+    if not clusters:
+        return
+    for ip in sorted(clients, key=ipaddress.ip_address):
+        min(clusters, key=lambda c: len(c['clients']))['clients'].append(ip)
+
+def meshClusters(clusters):
+    ## - The RRs of different clusters of the same level peer with each other as non-clients, so that routes reach every cluster
+    for cluster in clusters:
+        cluster['peers'] = cluster['peers'] + [ip for other in clusters if other is not cluster for ip in other['route_reflectors']]
+
+def fabricPods(nodes, leaves, spines):
+    ## - Pods: the spines and the leaves connected through leaf-spine links only (not through super-spines), by lowest spine IP
+    members = set(leaves) | set(spines)
+    seen = set()
+    pods = []
+    for ip in sorted(spines, key=ipaddress.ip_address):
+        if ip in seen:
+            continue
+        seen.add(ip)
+        pod = []
+        stack = [ip]
+        while stack:
+            node = stack.pop()
+            pod.append(node)
+            for neighbor in nodes.get(node, ()):
+                if neighbor in members and neighbor not in seen:
+                    seen.add(neighbor)
+                    stack.append(neighbor)
+        pods.append(sorted(pod, key=ipaddress.ip_address))
+    return pods
+
+def routeReflectors(clusters):
+    return [ip for cluster in clusters for ip in cluster['route_reflectors']]
 
 def delete_ibgp(sys_ip, gnmiclient):
     delete = {
@@ -217,7 +388,8 @@ def delete_ibgp(sys_ip, gnmiclient):
                 }]
             }
     update = [ ('network-instance[name=default]/protocols/bgp', delete) ]
-    result = gnmiclient.set(replace=update, encoding="json_ietf")
+    with span('bgp_set'):
+        result = gnmiclient.set(replace=update, encoding="json_ietf")
     for conf in result['response']:
         if str(conf['path']) == '/network-instance[name=default]/protocols/bgp':
             logging.info('[OVERLAY] :: Removed all iBGP configurations')
@@ -226,294 +398,436 @@ def delete_ibgp(sys_ip, gnmiclient):
 #####################################################
 ####            THE AGENT'S MAIN LOGIC           ####
 
+def computeRolesInWorker(state, gnmiclient, nodes, fingerprint):
+    ## - Sends the topology snapshot to the worker process; the roles are applied when they come back, unless a newer snapshot exists by then
+    generation = state.roles_generation
+    ids = Trace.currentIds()
+    settings = rrSettings(state)
+
+    def rolesComputed(future):
+        if future.cancelled():
+            return
+        with state_lock:
+            if generation != state.roles_generation:
+                logging.info(f"[ROLES WORKER] :: Discarded the roles of a stale topology ({generation}/{state.roles_generation})")
+                return
+            try:
+                with trace('roles worker', ids):
+                    leaves, spines, super_spines, border = future.result()
+                    clusters = electRouteReflectors(leaves, spines, super_spines, border, nodes, *settings)
+                    state.roles_cache.put(fingerprint, (leaves, spines, super_spines, border, clusters))
+                    applyRoles(state, gnmiclient, leaves, spines, super_spines, border, clusters)
+                    convergedChange(state)
+            except Exception as e:
+                logging.error(f"[ROLES WORKER] :: {str(e)}\n{traceback.format_exc()}")
+
+    state.roles_worker.submit(nodes, rolesComputed)
+
+
+def logRoles(leaves, spines, super_spines, border, elected_rr, clusters):
+    ## - One JSON line with the roles and the RRs (read by show-fabric-plugin)
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return
+    logging.info(json.dumps({'event' : 'roles', 'leaves' : leaves, 'spines' : spines, 'super_spines' : super_spines,
+                             'border_leaves' : border, 'route_reflectors' : elected_rr,
+                             'rr_clusters' : [{'cluster_id' : c['cluster_id'], 'route_reflectors' : c['route_reflectors'], 'clients' : len(c['clients'])} for c in clusters]}))
+
+
+def applyRoles(state, gnmiclient, leaves, spines, super_spines, border, clusters):
+    ## - Reconfigures the overlay according to the roles of the current topology
+    elected_rr = routeReflectors(clusters)
+    if (len(leaves) + len(spines) + len(super_spines) + len(border)) > 2:
+        ## - Only set a new iBGP configuration if the previously known topology changed.
+        #if (len(intersect(state.leaves, leaves)) != len(state.leaves) or len(state.leaves) != len(leaves)) or (len(intersect(state.spines, spines)) != len(state.spines) or len(state.spines) != len(spines)) or (len(intersect(state.super_spines, super_spines)) != len(state.super_spines) or len(state.super_spines) != len(super_spines)) or (len(intersect(state.borders, border)) != len(state.borders) or len(state.super_spines) != len(border)):
+        if state.leaves != leaves or state.spines != spines or state.super_spines != super_spines or state.borders != border or state.rr_clusters != clusters:
+            logRoles(leaves, spines, super_spines, border, elected_rr, clusters)
+
+            ## - Set up the overlay infrastructure: only the differences with the applied overlay are pushed
+            scheduleOverlay(state, gnmiclient, desiredOverlay(state.sys_ip, clusters))
+
+            ## - Update the role of each node
+            state.route_reflectors = elected_rr
+            state.rr_clusters = clusters
+            state.leaves = leaves
+            state.spines = spines
+            state.super_spines = super_spines
+            state.borders = border
+    else:
+        scheduleOverlay(state, gnmiclient, None)
+
+
+def desiredOverlay(sys_ip, clusters):
+    ## - Overlay this node should have: RRs peer with their clients and, as non-clients, with their peer RRs; clients
+    ## - peer with the RRs of their cluster; None disables iBGP
+    for cluster in clusters:
+        if sys_ip in cluster['route_reflectors']:
+            return {'cluster_id' : cluster['cluster_id'], 'neighbors' : cluster['clients'] + cluster['peers'], 'non_clients' : list(cluster['peers'])}
+    neighbors = [ip for cluster in clusters if sys_ip in cluster['clients'] for ip in cluster['route_reflectors']]
+    if neighbors:
+        return {'cluster_id' : None, 'neighbors' : neighbors, 'non_clients' : []}
+    return None
+
+
+def scheduleOverlay(state, gnmiclient, desired):
+    ## - Enabling or changing the overlay waits for ibgp-timer-delay seconds, disabling it does not
+    state.overlay_apply.add(desired, Trace.currentIds())
+    if state.overlay_apply.timer is None:
+        delay = state.ibgp_timer_delay if desired is not None else 0
+        if delay > 0:
+            state.overlay_apply.schedule(delay, lambda: flushOverlay(state, gnmiclient))
+        else:
+            flushOverlay(state, gnmiclient)
+
+
+def flushOverlay(state, gnmiclient):
+    ## - Runs in the timer thread of the schedule (or at once without delay)
+    with state_lock:
+        schedule = state.overlay_apply
+        schedule.timer = None
+        if not schedule.pending:
+            return
+        ids = schedule.ids
+        desired = schedule.drain()
+        try:
+            with trace('overlay', ids):
+                applyOverlay(state, gnmiclient, desired)
+            schedule.failures = 0
+            schedule.applies += 1
+            convergedChange(state)
+        except Exception as e:
+            ## - The applied overlay is unchanged: the retry diffs against it again
+            schedule.failures += 1
+            schedule.desired = desired
+            schedule.pending = True
+            delay = schedule.backoff()
+            logging.error(f"[OVERLAY] :: iBGP configuration failed, retry {schedule.failures} in {delay}s: {str(e)}")
+            schedule.schedule(delay, lambda: flushOverlay(state, gnmiclient))
+
+
+def applyOverlay(state, gnmiclient, desired):
+    if desired is None:
+        ## - Delete any bgp configuration: If no longer is a leaf or a RR.
+        if state.ibgp == True:
+            delete_ibgp(state.sys_ip, gnmiclient)
+            state.ibgp = False
+        state.overlay = None
+        return
+    if state.ibgp == False or state.overlay is None:
+        ## - iBGP is not running: the whole overlay is set up
+        overlay = {
+                    'admin-state' : 'enable',
+                    'autonomous-system' : f'{IBGP_ASN}',
+                    'router-id' : f'{state.sys_ip}',
+                    'group' : [ {
+                        'group-name' : 'overlay',
+                        'admin-state' : 'enable',
+                        'export-policy' : 'all',
+                        'import-policy' : 'all',
+                        'peer-as' : f'{IBGP_ASN}',
+                        'local-as' : 
+                            { 'as-number' : f'{IBGP_ASN}' }
+                        ,
+                        'afi-safi' : [
+                            {
+                                'afi-safi-name' : 'ipv4-unicast',
+                                'admin-state' : 'disable'
+                            },
+                            {
+                                'afi-safi-name' : 'ipv6-unicast',
+                                'admin-state' : 'disable'
+                            },
+                            {
+                                'afi-safi-name' : 'evpn',
+                                'admin-state' : 'enable'
+                            }
+                        ]
+                    }],
+                    'afi-safi' : [ {
+                        'afi-safi-name' : 'evpn',
+                        'admin-state' : 'enable'
+                    }]
+                }
+        if desired['cluster_id'] is not None:
+            overlay['group'][0]['route-reflector'] = {
+                'client' : 'true',
+                'cluster-id' : desired['cluster_id']
+            }
+        if desired['neighbors']:
+            non_clients = set(desired.get('non_clients', ()))
+            overlay['neighbor'] = [overlayNeighbor(peer, peer in non_clients) for peer in desired['neighbors']]
+
+        update = [ ('/network-instance[name=default]/protocols/bgp', overlay) ]
+        with span('bgp_set'):
+            result = gnmiclient.set(update=update, encoding="json_ietf")
+        #while True:
+        #    try:
+        #        result = gnmiclient.set(update=update, encoding="json_ietf")
+        #        break
+        #    except Exception as X:
+        #        logging.info(f'[ERROR] :: iBGP was not configured. Agent will try again.')
+        for conf in result['response']:
+            if str(conf['path']) == 'network-instance[name=default]/protocols/bgp':
+                logging.info(f'[OVERLAY] :: {datetime.datetime.now()} iBGP initialized with ASN ' + f'{IBGP_ASN}')
+                state.ibgp = True
+                state.overlay = desired
+        return
+
+    ## - iBGP is running: existing sessions stay up, only added/removed neighbors, a changed cluster-id and neighbors
+    ## - becoming clients or non-clients are pushed
+    applied = state.overlay
+    update = []
+    delete = []
+    if desired['cluster_id'] != applied['cluster_id']:
+        if desired['cluster_id'] is not None:
+            update.append(('/network-instance[name=default]/protocols/bgp/group[group-name=overlay]/route-reflector',
+                           {'client' : 'true', 'cluster-id' : desired['cluster_id']}))
+        else:
+            delete.append('/network-instance[name=default]/protocols/bgp/group[group-name=overlay]/route-reflector')
+    applied_neighbors = set(applied['neighbors'])
+    desired_neighbors = set(desired['neighbors'])
+    applied_non_clients = set(applied.get('non_clients', ()))
+    desired_non_clients = set(desired.get('non_clients', ()))
+    added = [peer for peer in desired['neighbors'] if peer not in applied_neighbors]
+    removed = [peer for peer in applied['neighbors'] if peer not in desired_neighbors]
+    changed = [peer for peer in desired['neighbors'] if peer in applied_neighbors and (peer in desired_non_clients) != (peer in applied_non_clients)]
+    pushed = added + [peer for peer in changed if peer in desired_non_clients]
+    if pushed:
+        update.append(('/network-instance[name=default]/protocols/bgp', {'neighbor' : [overlayNeighbor(peer, peer in desired_non_clients) for peer in pushed]}))
+    for peer in removed:
+        delete.append(f'/network-instance[name=default]/protocols/bgp/neighbor[peer-address={peer}]')
+    for peer in changed:
+        if peer not in desired_non_clients:
+            delete.append(f'/network-instance[name=default]/protocols/bgp/neighbor[peer-address={peer}]/route-reflector')
+    if update or delete:
+        with span('bgp_set'):
+            gnmiclient.set(update=update, delete=delete, encoding="json_ietf")
+        logging.info(f"[OVERLAY] :: {datetime.datetime.now()} iBGP updated: +{len(added)} -{len(removed)} neighbors, {len(changed)} (non-)clients, cluster-id {desired['cluster_id']}")
+    state.overlay = desired
+
+
+def overlayNeighbor(peer, non_client=False):
+    neighbor = {
+        'peer-address' : f'{peer}',
+        'admin-state' : 'enable',
+        'peer-group' : 'overlay'
+    }
+    if non_client:
+        ## - Another RR cluster, or the RRs of the upper level: not a client of the route-reflector of the group
+        neighbor['route-reflector'] = {'client' : 'false'}
+    return neighbor
+
+
 def handle_RouteNotification(notification: Notification, state, gnmiclient) -> None:
     node_ip_add = ".".join(str(byte) for byte in notification.key.ip_prefix.ip_addr.addr)
-    node_ip_add.split('.')
     notif_ip_addr = str(node_ip_add)
     ## - Check if it is a valid IP address for a node loopback
     if node_ip_add != '0.0.0.0' and 1 <= int(node_ip_add.split('.')[0]) <= 223 and len(node_ip_add.split('.')) == 4:
-        state.route_reflectors = []
-        if state.underlay_protocol == 'IS-IS':
+        queueRouteOps(state, gnmiclient, [(notif_ip_addr, notification.op)])
+
+
+def queueRouteOps(state, gnmiclient, ops):
+    if ROUTE_QUIET_WINDOW > 0:
+        ## - Bursts of notifications (e.g. a pod coming up) are handled as one batch
+        for notif_ip_addr, op in ops:
+            state.route_batch.add(notif_ip_addr, op, Trace.currentIds())
+        if state.route_batch.timer is None:
+            state.route_batch.schedule(lambda: flushRouteBatch(state, gnmiclient))
+    else:
+        handleRouteBatch(state, gnmiclient, ops)
+
+
+def lsdbChanged(state, gnmiclient, ips):
+    ## - Runs in the LSDB mirror thread, with the state lock: the known nodes whose LSP changed are handled again as
+    ## - updates (op 1), so that roles computed before the LSPs of their neighbors arrived are corrected. A node with a
+    ## - pending route notification, or whose LSP is gone (its route DELETE follows), is left to that notification.
+    ## - This node is skipped: a link change also changes the LSP of the node at the other end
+    ops = [(ip, 1) for ip in sorted(ips, key=ipaddress.ip_address)
+           if ip in state.isis_nodes and ip != state.sys_ip and state.lsdb.knows(ip) and ip not in state.route_batch.ops]
+    if not ops:
+        return
+    logging.info("[LSDB] :: %d known nodes changed their LSP", len(ops))
+    try:
+        with trace('lsdb change', [next(trace_ids)]):
+            queueRouteOps(state, gnmiclient, ops)
+    except Exception as e:
+        logging.error(f"[LSDB] :: {str(e)}\n{traceback.format_exc()}")
+
+
+def flushRouteBatch(state, gnmiclient):
+    ## - Runs in the timer thread of the batch: waits again while notifications keep arriving (up to the max delay)
+    with state_lock:
+        state.route_batch.timer = None
+        if len(state.route_batch) == 0:
+            return
+        if state.route_batch.due() > 0:
+            state.route_batch.schedule(lambda: flushRouteBatch(state, gnmiclient))
+            return
+        ids = state.route_batch.ids
+        ops = state.route_batch.drain()
+        logging.info("[ROUTE BATCH] :: %d prefixes %s", len(ops), state.route_batch)
+        try:
+            with trace('route batch', ids):
+                handleRouteBatch(state, gnmiclient, ops)
+        except Exception as e:
+            logging.error(f"[ROUTE BATCH] :: {str(e)}\n{traceback.format_exc()}")
+
+
+def handleRouteBatch(state, gnmiclient, ops):
+    ## - ops: [(loopback IP, latest route op)] -> one topology refresh and one roles computation
+    if state.underlay_protocol == 'IS-IS':
+        routes = None
+        tlvs = None
+        for notif_ip_addr, op in ops:
             ## - Notification is CREATE (value: 0) or UPDATE (value: 1)
-            if notification.op == 0 or notification.op == 1:
+            if op == 0 or op == 1:
                 ## - Check if IP address is in routing table
-                result = gnmiclient.get(path=[f"/network-instance[name=default]/route-table/ipv4-unicast/route[ipv4-prefix=*][route-type=isis][route-owner=isis_mgr][id=0][origin-network-instance=default]/ipv4-prefix"], encoding="json_ietf")
-                if 'update' in result['notification'][0]:
-                    if result['notification'][0]['update'][0]['val']['route']:
-                        for dest in result['notification'][0]['update'][0]['val']['route']:
-                            ## - Check if it is a /32 loopback address and if IP is in IS-IS routing tables 
-                            if str(dest['ipv4-prefix']) == notif_ip_addr + '/32' and str(dest['route-owner']) == 'isis_mgr':
-                                ## - Find and store data about the neighbors of the new IS-IS node with TLVs
-                                tlvs = gnmiclient.get(path=[f"network-instance[name=default]/protocols/isis/instance[name={ISIS_INSTANCE}]/level-database[level-number=1][lsp-id=*]/defined-tlvs"], encoding="json_ietf")                             
-                                ## - Add information about a new isis node and its neighbors
-                                
-                                new_isis_node = { 'ip_addr' : notif_ip_addr, 'neighbors_ip' : [], 'neighbors_net_id' : [] }
-                                if 'update' in tlvs['notification'][0]:
-                                    if tlvs['notification'][0]['update'][0]['val']['level-database']:
-                                        for tlv in tlvs['notification'][0]['update'][0]['val']['level-database']:
-                                            node_net_id = str(tlv['lsp-id'])[:-3]
-                                            node_ip = str(tlv['defined-tlvs']['ipv4-interface-addresses'][0])
-                                            
-                                            if node_ip == notif_ip_addr:
-                                                ## - Creates a new entry for new node joining 
-                                                new_isis_node['net_id'] = AREA_ID +'.'+node_net_id
-                                                if 'extended-is-reachability' in tlv['defined-tlvs']:
-                                                    for neighbor in tlv['defined-tlvs']['extended-is-reachability']:
-                                                        ## - Directly connected nodes are at a distance metric of 10
-                                                        if neighbor['default-metric'] == 10:
-                                                            neighbor_net = AREA_ID+'.'+str(neighbor['neighbor'])
-                                                            new_isis_node['neighbors_net_id'].append(neighbor_net)
-                                                if notification.op == 1:
-                                                    ## - An update on a node means cleaning its existing information and setting new data
-                                                    index = ""
-                                                    for i in range(len(state.isis_nodes)):
-                                                        if state.isis_nodes[i]['ip_addr'] == node_ip:
-                                                            index = i
-                                                    if index != "":
-                                                        state.isis_nodes.pop(index)
-
-                                            else:
-                                                if node_ip == state.sys_ip:
-                                                    ## - Include the neighbors of this node (me) : updates every time a notif arrives
-                                                    i_am_in_list = False
-                                                    me_net = AREA_ID +'.'+node_net_id
-                                                    me_isis_node = { 'ip_addr' : node_ip, 'net_id' : me_net, 'neighbors_ip' : [], 'neighbors_net_id' : [] }
-                                                    for e in state.isis_nodes:
-                                                        if e['ip_addr'] == node_ip:
-                                                            i_am_in_list = True
-                                                            break
-                                                    if not i_am_in_list:
-                                                        state.isis_nodes.append(me_isis_node)
-                                                ## - Besides updating me, it also updates previously joined nodes
-                                                ## - Avoiding missing information regarding a node that joins later and connects with a previously known node that is not updated with this new neighbor's NET ID        
-                                                for e in state.isis_nodes:
-                                                    if e['ip_addr'] == node_ip:
-                                                        if 'extended-is-reachability' in tlv['defined-tlvs']:
-                                                            e['neighbors_net_id'] = []
-                                                            e['neighbors_ip'] = []
-                                                            for neighbor in tlv['defined-tlvs']['extended-is-reachability']:
-                                                                ## - Directly connected nodes are at a distance metric of 10
-                                                                if neighbor['default-metric'] == 10:
-                                                                    neighbor_net = AREA_ID+'.'+str(neighbor['neighbor'])
-                                                                    if neighbor_net not in e['neighbors_net_id']:
-                                                                        e['neighbors_net_id'].append(neighbor_net)
-                                
-                                state.isis_nodes.append(new_isis_node)
-                                fillNodesNeighbors(state)
-                                if notification.op == 0:
-                                    logging.info(f"[IS-IS] :: Node {notif_ip_addr} joined the network topology")
-                                elif notification.op == 1:
-                                    logging.info(f"[IS-IS] :: Node {notif_ip_addr} has changed in the topology")
-                                break
+                if routes is None:
+                    with span('route_get'):
+                        routes = gnmiclient.get(path=[ISIS_ROUTES_PATH], encoding="json_ietf")
+                if isisRoute(routes, notif_ip_addr):
+                    ## - Find and store data about the neighbors of the new IS-IS node with TLVs
+                    if tlvs is None:
+                        ## - The mirror is used once it holds the LSPs of every node of the batch
+                        with span('lsdb'):
+                            if state.lsdb.synced and all(state.lsdb.knows(ip) for ip, o in ops if o != 2):
+                                tlvs = state.lsdb.database()
+                            else:
+                                tlvs = gnmiclient.get(path=[ISIS_LSDB_PATH], encoding="json_ietf")
+                    with span('isis_nodes'):
+                        addIsisNode(state, notif_ip_addr, op, tlvs)
             ## - Notification is DELETE (value: 2)
-            elif notification.op == 2:
-                index = ""
-                net = ""
-                for node in range(len(state.isis_nodes)):
-                    if state.isis_nodes[node]['ip_addr'] == notif_ip_addr:
-                        index = node
-                        net = state.isis_nodes[node]['net_id']
-                if index != "":
-                    state.isis_nodes.pop(index)
-                    logging.info(f"[IS-IS] :: Node {notif_ip_addr} left the network topology")
-                    ## - Need to remove this node's IP and NET from other nodes' neighboring information
-                    for n in state.isis_nodes:
-                        for n_net in n['neighbors_net_id']:
-                            if n_net == net:
-                                n['neighbors_net_id'].remove(n_net)
-                        for n_ip in n['neighbors_ip']:
-                            if n_ip == notif_ip_addr:
-                                n['neighbors_ip'].remove(n_ip)
-        
-            #logging.info(f"[IS-IS] :: Updated information regarding each node in the IS-IS topology:\n{json.dumps(state.isis_nodes, indent=4)}")
-            
-        ## - Order all IP addresses from the IS-IS routing table
-        list_ips = []
-        for node in range(len(state.isis_nodes)):
-            list_ips.append(state.isis_nodes[node]['ip_addr'])
-        list_ips = orderIPs(list_ips)
-
-        ## - Create list g with each index corresponding to a node and the value is a list with ids of neighbors. These ids correspond to the index of the list_ips.
-        nodes_str = ''
-        str_list_ips = ['index_0']
-        g = [[0,0]]
-        for e in range(len(list_ips)):
-            str_list_ips.append(str(list_ips[e]))
-        for e in range(len(str_list_ips)):
-            for i in range(len(state.isis_nodes)):
-                if state.isis_nodes[i]['ip_addr'] == str_list_ips[e]:
-                    neighbors = state.isis_nodes[i]['neighbors_ip']
-                    nodes_str += str(state.isis_nodes[i]['ip_addr']) + ' : ' + str(neighbors) + '\n'
-                    node_neighbors = []
-                    for nei in range(len(neighbors)):
-                        for l in range(len(str_list_ips)):
-                            if neighbors[nei] == str_list_ips[l]:
-                                node_neighbors.append(l)
-                    g.append(node_neighbors)
-
-        logging.info(f"[IS-IS] :: {datetime.datetime.now()} Updated information on the IS-IS topology:\n{nodes_str}..............................\nNumber of nodes: {len(list_ips)}\n")
-        ## - Run the Roles Algorithm: g = [ [0,0], [one node], [needs one more node] ]
-        leaves, spines, super_spines, border = [], [], [], []
+            elif op == 2:
+                with span('isis_nodes'):
+                    removeIsisNode(state, notif_ip_addr)
+
+        #logging.info(f"[IS-IS] :: Updated information regarding each node in the IS-IS topology:\n{state.isis_nodes}")
+
+    start = time.monotonic()
+    recomputeRoles(state, gnmiclient)
+    state.roles_durations.add(round((time.monotonic() - start) * 1000, 3))
+    convergedChange(state)
+
+
+def resyncRoutes(state, gnmiclient):
+    ## - After dropped route notifications: every loopback of the IS-IS route table is read again (op 1) and every
+    ## - known node that is no longer in it leaves (op 2), as one batch
+    routes = gnmiclient.get(path=[ISIS_ROUTES_PATH], encoding="json_ietf")
+    routed = []
+    if 'update' in routes['notification'][0]:
+        for dest in routes['notification'][0]['update'][0]['val']['route'] or []:
+            if str(dest['ipv4-prefix']).endswith('/32') and str(dest['route-owner']) == 'isis_mgr':
+                routed.append(str(dest['ipv4-prefix'])[:-3])
+    known = set(routed)
+    ops = [(ip, 1) for ip in routed] + [(ip, 2) for ip in state.isis_nodes.nodes if ip not in known and ip != state.sys_ip]
+    logging.info("[PIPELINE] :: Route resync: %d loopbacks in the route table, %d nodes left", len(routed), len(ops) - len(routed))
+    handleRouteBatch(state, gnmiclient, ops)
+
+
+def isisRoute(routes, notif_ip_addr):
+    ## - Check if it is a /32 loopback address and if IP is in IS-IS routing tables
+    if 'update' in routes['notification'][0]:
+        if routes['notification'][0]['update'][0]['val']['route']:
+            for dest in routes['notification'][0]['update'][0]['val']['route']:
+                if str(dest['ipv4-prefix']) == notif_ip_addr + '/32' and str(dest['route-owner']) == 'isis_mgr':
+                    return True
+    return False
+
+
+def addIsisNode(state, notif_ip_addr, op, tlvs):
+    ## - Add information about a new isis node and its neighbors
+    net_id = None
+    neighbors_net_id = []
+    if 'update' in tlvs['notification'][0]:
+        if tlvs['notification'][0]['update'][0]['val']['level-database']:
+            for tlv in tlvs['notification'][0]['update'][0]['val']['level-database']:
+                node_net_id = str(tlv['lsp-id'])[:-3]
+                node_ip = str(tlv['defined-tlvs']['ipv4-interface-addresses'][0])
+                
+                if node_ip == notif_ip_addr:
+                    ## - Creates a new entry for new node joining: an update on a node means setting new data
+                    net_id = AREA_ID +'.'+node_net_id
+                    neighbors_net_id = isisNeighbors(tlv)
+                else:
+                    if node_ip == state.sys_ip and node_ip not in state.isis_nodes:
+                        ## - Include the neighbors of this node (me) : updates every time a notif arrives
+                        state.isis_nodes.join(node_ip, AREA_ID +'.'+node_net_id)
+                    ## - Besides updating me, it also updates previously joined nodes
+                    ## - Avoiding missing information regarding a node that joins later and connects with a previously known node that is not updated with this new neighbor's NET ID        
+                    if node_ip in state.isis_nodes and 'extended-is-reachability' in tlv['defined-tlvs']:
+                        state.isis_nodes.setNeighbors(node_ip, isisNeighbors(tlv))
+    
+    state.isis_nodes.join(notif_ip_addr, net_id, neighbors_net_id)
+    if op == 0:
+        logging.info("[IS-IS] :: Node %s joined the network topology", notif_ip_addr)
+    elif op == 1:
+        logging.info("[IS-IS] :: Node %s has changed in the topology", notif_ip_addr)
+
+
+def isisNeighbors(tlv):
+    ## - NET IDs of the directly connected nodes: they are at a distance metric of 10
+    neighbors_net_id = []
+    if 'extended-is-reachability' in tlv['defined-tlvs']:
+        for neighbor in tlv['defined-tlvs']['extended-is-reachability']:
+            if neighbor['default-metric'] == 10:
+                neighbors_net_id.append(AREA_ID+'.'+str(neighbor['neighbor']))
+    return neighbors_net_id
+
+
+def removeIsisNode(state, notif_ip_addr):
+    ## - Also removes this node's NET from other nodes' neighboring information
+    if state.isis_nodes.leave(notif_ip_addr):
+        logging.info("[IS-IS] :: Node %s left the network topology", notif_ip_addr)
+
+
+def recomputeRoles(state, gnmiclient):
+    with span('graph'):
+        nodes = isisAdjacency(state)
+    logging.info("[IS-IS] :: Updated information on the IS-IS topology: Number of nodes: %d", len(state.isis_nodes))
+    ## - The graph is only built and turned into text when DEBUG is enabled
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("[IS-IS] :: Nodes and their neighbors:\n%s..............................\n", state.isis_nodes.graph())
+    leaves, spines, super_spines, border = [], [], [], []
+    if INCREMENTAL_ROLES and not ROLES_IN_WORKER:
+        with span('roles'):
+            state.roles_engine.sync(nodes)
+    ## - A newer topology makes any computation still running for an older one stale
+    state.roles_generation += 1
+    ## - A topology seen before (with the same RR settings) resolves from the cache
+    fingerprint = (topologyFingerprint(nodes), rrSettings(state))
+    cached = state.roles_cache.get(fingerprint)
+    logging.info("[ROLES CACHE] :: %s %s", 'hit' if cached is not None else 'miss', state.roles_cache)
+    if cached is not None:
+        applyRoles(state, gnmiclient, *cached)
+        return
+    if ROLES_IN_WORKER:
+        computeRolesInWorker(state, gnmiclient, nodes, fingerprint)
+        return
+    if INCREMENTAL_ROLES:
+        if len(state.isis_nodes) >= 2:
+            with span('roles'):
+                leaves, spines, super_spines, border = [list(role) for role in state.roles_engine.roles()]
+    else:
         leaves_aux, spines_aux, super_spines_aux, border_aux = [], [], [], []
+        ## - Graph g with each row corresponding to a node and holding the ids of its neighbors. These ids follow the order of the loopback IPs.
+        with span('graph'):
+            g = state.isis_nodes.graph()
+        ## - Run the Roles Algorithm: g = [ [0,0], [one node], [needs one more node] ]
         if len(g) >= 3:
-            leaves_aux, spines_aux, super_spines_aux, border_aux = nodesRolesAlgorithm(g)
-        
+            with span('roles'):
+                leaves_aux, spines_aux, super_spines_aux, border_aux = nodesRolesAlgorithm(g)
+
         ## - Convert the IDs in the lists to the IPv4 addresses
         for e in range(len(leaves_aux)):
-            leaves.append(str_list_ips[leaves_aux[e]])
+            leaves.append(g.ip(leaves_aux[e]))
         for e in range(len(spines_aux)):
-            spines.append(str_list_ips[spines_aux[e]])
+            spines.append(g.ip(spines_aux[e]))
         for e in range(len(super_spines_aux)):
-            super_spines.append(str_list_ips[super_spines_aux[e]])
+            super_spines.append(g.ip(super_spines_aux[e]))
         for e in range(len(border_aux)):
-            border.append(str_list_ips[border_aux[e]])
-
-        ## - Choose 2 Route Reflectors and configure them.
-        if (len(leaves) + len(spines) + len(super_spines) + len(border)) > 2:
-            ## - Only set a new iBGP configuration if the previously known topology changed.
-            #if (len(intersect(state.leaves, leaves)) != len(state.leaves) or len(state.leaves) != len(leaves)) or (len(intersect(state.spines, spines)) != len(state.spines) or len(state.spines) != len(spines)) or (len(intersect(state.super_spines, super_spines)) != len(state.super_spines) or len(state.super_spines) != len(super_spines)) or (len(intersect(state.borders, border)) != len(state.borders) or len(state.super_spines) != len(border)):
-            if state.leaves != leaves or state.spines != spines or state.super_spines != super_spines or state.borders != border:
-                logging.info(f"Leaves: {str(leaves)}\nSpines: {str(spines)}\nSuper-Spines: {str(super_spines)}\nBorder-Leaves: {str(border)}\n")
-                elected_rr = []
-                if len(super_spines) > 0:
-                    for e in range(len(super_spines)):
-                        if len(elected_rr) < RR_NUMBER:
-                            elected_rr.append(super_spines[e])
-                        else:
-                            break
-                if len(elected_rr) < RR_NUMBER and len(border) > 0:
-                    for e in range(len(border)):
-                        if len(elected_rr) < RR_NUMBER:
-                            elected_rr.append(border[e])
-                        else:
-                            break
-                if len(elected_rr) < RR_NUMBER and len(spines) > 0:
-                    for e in range(len(spines)):
-                        if len(elected_rr) < RR_NUMBER:
-                            elected_rr.append(spines[e])
-                        else:
-                            break
-                if len(elected_rr) < RR_NUMBER and len(leaves) > 0:
-                    for e in range(len(leaves)):
-                        if len(elected_rr) < RR_NUMBER:
-                            elected_rr.append(leaves[e])
-                        else:
-                            break
-                ## - Only change a RR if it changed.
-                logging.info(f"[OVERLAY] :: Elected RRs are {str(elected_rr)}")
-                add_rr = []
-                remove_rr = []
-                for e in range(len(state.route_reflectors)):
-                    if state.route_reflectors[e] not in elected_rr:
-                        remove_rr.append(state.route_reflectors[e]) 
-                for e in range(len(elected_rr)):
-                    if elected_rr[e] not in state.route_reflectors:
-                        add_rr.append(elected_rr[e]) 
-
-                ## - Set up the overlay infrastructure
-                if state.sys_ip in elected_rr or state.sys_ip in leaves:
-                    if state.ibgp == True:
-                        delete_ibgp(state.sys_ip, gnmiclient)
-                        state.ibgp = False
-                    overlay = {
-                                'admin-state' : 'enable',
-                                'autonomous-system' : f'{IBGP_ASN}',
-                                'router-id' : f'{state.sys_ip}',
-                                'group' : [ {
-                                    'group-name' : 'overlay',
-                                    'admin-state' : 'enable',
-                                    'export-policy' : 'all',
-                                    'import-policy' : 'all',
-                                    'peer-as' : f'{IBGP_ASN}',
-                                    'local-as' : 
-                                        { 'as-number' : f'{IBGP_ASN}' }
-                                    ,
-                                    'afi-safi' : [
-                                        {
-                                            'afi-safi-name' : 'ipv4-unicast',
-                                            'admin-state' : 'disable'
-                                        },
-                                        {
-                                            'afi-safi-name' : 'ipv6-unicast',
-                                            'admin-state' : 'disable'
-                                        },
-                                        {
-                                            'afi-safi-name' : 'evpn',
-                                            'admin-state' : 'enable'
-                                        }
-                                    ]
-                                }],
-                                'afi-safi' : [ {
-                                    'afi-safi-name' : 'evpn',
-                                    'admin-state' : 'enable'
-                                }]
-                            }
-                    if state.sys_ip in leaves:
-                        for l in range(RR_NUMBER):
-                            if 'neighbor' not in overlay:
-                                overlay['neighbor'] = [ {
-                                    'peer-address' : f'{elected_rr[l]}',
-                                    'admin-state' : 'enable',
-                                    'peer-group' : 'overlay'
-                                }]
-                            else:
-                                overlay['neighbor'].append({
-                                    'peer-address' : f'{elected_rr[l]}',
-                                    'admin-state' : 'enable',
-                                    'peer-group' : 'overlay'
-                                })
-                    elif state.sys_ip in elected_rr:
-                        for group in range(len(overlay['group'])):
-                            if overlay['group'][group]['group-name'] == 'overlay':
-                                overlay['group'][group]['route-reflector'] = {
-                                    'client' : 'true',
-                                    #'cluster-id' : f'{state.sys_ip}'
-                                    'cluster-id' : f'{str(elected_rr[0])}' #Cluster-id is the same for both RRs
-                                }
-                        for l in range(len(leaves)):
-                            if 'neighbor' not in overlay:
-                                overlay['neighbor'] = [ {
-                                    'peer-address' : f'{leaves[l]}',
-                                    'admin-state' : 'enable',
-                                    'peer-group' : 'overlay'
-                                }]
-                            else:
-                                overlay['neighbor'].append({
-                                    'peer-address' : f'{leaves[l]}',
-                                    'admin-state' : 'enable',
-                                    'peer-group' : 'overlay'
-                                })
-
-                    update = [ ('/network-instance[name=default]/protocols/bgp', overlay) ]
-                    time.sleep(2) # Necessary for the testing environment hypervisor to execute the iBGP configuration with success.
-                    result = gnmiclient.set(update=update, encoding="json_ietf")
-                    #while True:
-                    #    try:
-                    #        result = gnmiclient.set(update=update, encoding="json_ietf")
-                    #        break
-                    #    except Exception as X:
-                    #        logging.info(f'[ERROR] :: iBGP was not configured. Agent will try again.')
-                    for conf in result['response']:
-                        if str(conf['path']) == 'network-instance[name=default]/protocols/bgp':
-                            logging.info(f'[OVERLAY] :: {datetime.datetime.now()} iBGP initialized with ASN ' + f'{IBGP_ASN}')
-                            state.ibgp = True
-                else:
-                    ## - Delete any bgp configuration: If no longer is a leaf or a RR.
-                    #if state.sys_ip in state.leaves or state.sys_ip in state.route_reflectors:
-                    if state.ibgp == True:
-                        delete_ibgp(state.sys_ip, gnmiclient)
-                        state.ibgp = False
-
-                ## - Update the role of each node
-                state.route_reflectors = elected_rr
-                state.leaves = leaves
-                state.spines = spines
-                state.super_spines = super_spines
-                state.borders = border
-        else:
-            if state.ibgp == True:
-                delete_ibgp(state.sys_ip, gnmiclient)
-                state.ibgp = False
+            border.append(g.ip(border_aux[e]))
+    clusters = electRouteReflectors(leaves, spines, super_spines, border, nodes, *rrSettings(state))
+    state.roles_cache.put(fingerprint, (leaves, spines, super_spines, border, clusters))
+    applyRoles(state, gnmiclient, leaves, spines, super_spines, border, clusters)
 
 
 def handle_LldpNeighborNotification(notification: Notification, state, gnmiclient) -> None:
@@ -530,94 +844,283 @@ def handle_LldpNeighborNotification(notification: Notification, state, gnmiclien
     port_id = str(notification.data.port_id)
     neighbor = {NEIGHBOR_CHASSIS:source_chassis, SYS_NAME:system_name, NEIGHBOR_INT:port_id, LOCAL_INT: interface_name}
     
-    int_conf = {
-                'subinterface' : [
-                    {
-                    'index' : '0',
-                    # /interface[name=ethernet-1/49]/subinterface[index=0]
-                    'ipv4' : {
-                        'unnumbered' : {
-                            'admin-state' : 'enable',
-                            'interface' : 'system0.0'
-                        },
-                        'admin-state' : 'enable'
-                    }, 
-                    'admin-state' : 'enable'
-                    #
-                    }
-                ],
-                'admin-state' : 'enable'
-                }
-    net_inst = {
-                'admin-state' : 'enable',
-                'interface' : [
-                    {'name' : f'{interface_name}.0'}
-                ]  
-                }
-    routing_conf = {}
-    if state.underlay_protocol == 'IS-IS':
-        # Configure IS-IS interfaces
-        instance_isis = {
-                            'instance' : [
-                                {'name' : f'{ISIS_INSTANCE}',
-                                 'interface' : [
-                                     {'interface-name' : f'{interface_name}.0',
-                                      'admin-state' : 'enable',
-                                      'circuit-type' : 'point-to-point'
-                                     }
-                                 ]
-                                }
-                            ]
-                        }
-        routing_conf = instance_isis
-    create_updates = []
-    delete_updates = []
-    
     ## - Notification is CREATE (value: 0)
     if notification.op == 0:
-        if state.underlay_protocol == 'IS-IS':
-            create_updates = [
-                (f'/interface[name={interface_name}]', int_conf),
-                ('/network-instance[name=default]', net_inst),
-                ('/network-instance[name=default]/protocols/isis', routing_conf)
-            ]
-        result = gnmiclient.set(update=create_updates, encoding="json_ietf")
-        #logging.info('[gNMIc] :: ' + f'{result}')
-        logging.info(f"[NEW NEIGHBOR] :: {source_chassis}, {system_name}, {port_id}, {interface_name}")
         state.lldp_neighbors.append(neighbor)
+        state.lldp_writes.add(interface_name, 0, neighbor, Trace.currentIds())
     ## - Notification is DELETE (value: 2)
     elif notification.op == 2:
         for i in state.lldp_neighbors[:]:
             if i[LOCAL_INT] == neighbor[LOCAL_INT] and i[NEIGHBOR_CHASSIS] == neighbor[NEIGHBOR_CHASSIS]:
-                #int_conf['admin-state'] = "disable"#!!!
-                #int_conf['subinterface'][0]['admin-state'] = "disable"
-                #int_conf['subinterface'][0]['ipv4']['admin-state'] = "disable"
-                #int_conf['subinterface'][0]['ipv4']['unnumbered']['admin-state'] = "disable"
-                routing_conf['instance'][0]['interface'][0]['admin-state'] = "disable"
-                delete_updates = [
-                    #(f'/interface[name={interface_name}]', int_conf),
-                    ('/network-instance[name=default]/protocols/isis', routing_conf)
-                ]
-                result = gnmiclient.set(update=delete_updates, encoding="json_ietf")
-                for conf in result['response']:
-                    if str(conf['path']) == f'interface[name={interface_name}]':
-                        logging.info(f"[REMOVED NEIGHBOR] :: {i[NEIGHBOR_CHASSIS]}, {i[SYS_NAME]}, {i[NEIGHBOR_INT]}, {i[LOCAL_INT]}")
-                        state.lldp_neighbors.remove(i)
-                
+                state.lldp_neighbors.remove(i)
+                state.lldp_writes.add(interface_name, 2, i, Trace.currentIds())
     ## - Notification is CHANGE (value: 1)
     else:
-        logging.info(str(notification))
+        logging.debug("[LLDP] :: Changed neighbor %s", notification)
         pass
         # TODO
     state.new_lldp_notification = True
-    
+
+    ## - Neighbors of a burst (e.g. a leaf coming up cabled) are written together, on a timer or once the batch is full
+    if len(state.lldp_writes) > 0:
+        if LLDP_WRITE_WINDOW <= 0 or state.lldp_writes.full():
+            state.lldp_writes.cancel()
+            writeLldpBatch(state, gnmiclient)
+        elif state.lldp_writes.timer is None:
+            state.lldp_writes.schedule(lambda: flushLldpBatch(state, gnmiclient))
+
+
+def flushLldpBatch(state, gnmiclient):
+    ## - Runs in the timer thread of the batch
+    with state_lock:
+        state.lldp_writes.timer = None
+        if len(state.lldp_writes) == 0:
+            return
+        try:
+            with trace('lldp batch', state.lldp_writes.ids):
+                writeLldpBatch(state, gnmiclient)
+        except Exception as e:
+            logging.error(f"[LLDP BATCH] :: {str(e)}\n{traceback.format_exc()}")
+
+
+def writeLldpBatch(state, gnmiclient):
+    interfaces, waited = state.lldp_writes.drain()
+    updates = []
+    net_inst_interfaces = []
+    isis_interfaces = []
+    for interface_name, entry in interfaces.items():
+        if entry['configure']:
+            int_conf = {
+                        'subinterface' : [
+                            {
+                            'index' : '0',
+                            # /interface[name=ethernet-1/49]/subinterface[index=0]
+                            'ipv4' : {
+                                'unnumbered' : {
+                                    'admin-state' : 'enable',
+                                    'interface' : 'system0.0'
+                                },
+                                'admin-state' : 'enable'
+                            }, 
+                            'admin-state' : 'enable'
+                            #
+                            }
+                        ],
+                        'admin-state' : 'enable'
+                        }
+            updates.append((f'/interface[name={interface_name}]', int_conf))
+            net_inst_interfaces.append({'name' : f'{interface_name}.0'})
+        if state.underlay_protocol == 'IS-IS':
+            ## - Configure IS-IS interfaces: disabled once the neighbor is gone
+            isis_interfaces.append({'interface-name' : f'{interface_name}.0',
+                                    'admin-state' : entry['isis'],
+                                    'circuit-type' : 'point-to-point'
+                                   })
+    if net_inst_interfaces:
+        net_inst = {
+                    'admin-state' : 'enable',
+                    'interface' : net_inst_interfaces
+                    }
+        updates.append(('/network-instance[name=default]', net_inst))
+    if isis_interfaces:
+        instance_isis = {
+                            'instance' : [
+                                {'name' : f'{ISIS_INSTANCE}',
+                                 'interface' : isis_interfaces
+                                }
+                            ]
+                        }
+        updates.append(('/network-instance[name=default]/protocols/isis', instance_isis))
+    if updates:
+        start = time.monotonic()
+        with span('lldp_set'):
+            result = gnmiclient.set(update=updates, encoding="json_ietf")
+        #logging.info('[gNMIc] :: ' + f'{result}')
+        state.lldp_writes.last_set_time = time.monotonic() - start
+        state.lldp_writes.last_latency = waited + state.lldp_writes.last_set_time
+    state.lldp_writes.batches += 1
+    for interface_name, entry in interfaces.items():
+        for op, neighbor in entry['events']:
+            if op == 0:
+                logging.info("[NEW NEIGHBOR] :: %s, %s, %s, %s", neighbor[NEIGHBOR_CHASSIS], neighbor[SYS_NAME], neighbor[NEIGHBOR_INT], neighbor[LOCAL_INT])
+            else:
+                logging.info("[REMOVED NEIGHBOR] :: %s, %s, %s, %s", neighbor[NEIGHBOR_CHASSIS], neighbor[SYS_NAME], neighbor[NEIGHBOR_INT], neighbor[LOCAL_INT])
+    logging.info("[LLDP BATCH] :: %d interfaces in one SetRequest, waited %.1fms %s", len(interfaces), waited * 1000, state.lldp_writes)
+
+
+def saveSnapshot(state):
+    ## - Saved once the agent is converged. Atomic: written next to the previous snapshot, then renamed over it
+    if state.snapshot_path is None or not converged(state):
+        return
+    snapshot = json.dumps({
+        'version' : SNAPSHOT_VERSION,
+        'mac' : state.mac,
+        'net_id' : state.net_id,
+        'sys_ip' : state.sys_ip,
+        'nodes' : [ [ip, node['net_id'], list(node['neighbors_net_id'])] for ip, node in state.isis_nodes.nodes.items() ],
+        'roles' : [state.leaves, state.spines, state.super_spines, state.borders],
+        'route_reflectors' : state.route_reflectors,
+        'rr_clusters' : state.rr_clusters,
+        'rr_settings' : list(rrSettings(state)),
+        'ibgp' : state.ibgp,
+        'overlay' : state.overlay,
+    }, separators=(',', ':'))
+    if snapshot == state.snapshot_saved:
+        return
+    try:
+        with open(state.snapshot_path + '.tmp', 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(state.snapshot_path + '.tmp', state.snapshot_path)
+        state.snapshot_saved = snapshot
+    except OSError as e:
+        logging.error(f"[SNAPSHOT] :: Not saved: {str(e)}")
+
+
+def loadSnapshot(path):
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def restoreSnapshot(state, snapshot, tlvs):
+    ## - tlvs: GET response of the level-database. The snapshot is only restored if its topology is the one of the LSDB
+    ## - (and its loopback the one of the node, when already read). Its roles and RRs seed the roles cache: the routes
+    ## - replayed by the new NDK stream rebuild the same topology and resolve from the cache, without a computation
+    nodes = IsisNodeTable()
+    for ip, net_id, neighbors_net_id in snapshot['nodes']:
+        nodes.join(ip, net_id, neighbors_net_id)
+    current = IsisNodeTable()
+    if 'update' in tlvs['notification'][0]:
+        for tlv in tlvs['notification'][0]['update'][0]['val']['level-database'] or []:
+            if tlv['defined-tlvs'].get('ipv4-interface-addresses'):
+                current.join(str(tlv['defined-tlvs']['ipv4-interface-addresses'][0]), AREA_ID + '.' + str(tlv['lsp-id'])[:-3], isisNeighbors(tlv))
+    if snapshot['sys_ip'] not in current or topologyFingerprint(nodes.adjacency()) != topologyFingerprint(current.adjacency()):
+        return False
+    if state.sys_ip and state.sys_ip != snapshot['sys_ip']:
+        return False
+    state.mac = snapshot['mac']
+    state.net_id = snapshot['net_id']
+    state.sys_ip = snapshot['sys_ip']
+    state.isis_nodes = nodes
+    state.leaves, state.spines, state.super_spines, state.borders = snapshot['roles']
+    state.route_reflectors = snapshot['route_reflectors']
+    state.rr_clusters = snapshot['rr_clusters']
+    state.ibgp = snapshot['ibgp']
+    state.overlay = snapshot['overlay']
+    state.rr_number, state.rr_strategy, state.rr_cluster_size = snapshot['rr_settings']
+    state.roles_cache.put((topologyFingerprint(nodes.adjacency()), rrSettings(state)),
+                          (state.leaves, state.spines, state.super_spines, state.borders, state.rr_clusters))
+    return True
+
+
+def converged(state):
+    ## - No route batch waiting, no roles computation running and no overlay apply pending
+    worker = state.roles_worker.pending
+    return len(state.route_batch) == 0 and not state.overlay_apply.pending and (worker is None or worker.done())
+
+
+def convergedChange(state):
+    ## - Called after a change of the topology, the roles or the overlay
+    if not converged(state):
+        return
+    state.converged_at = time.monotonic()
+    saveSnapshot(state)
+
+
+def percentiles(histogram):
+    ## - Latency percentiles in the YANG format (latency-percentiles grouping)
+    return {'p50' : histogram.percentile(0.5), 'p90' : histogram.percentile(0.9), 'p99' : histogram.percentile(0.99), 'max' : histogram.max}
+
+
+def telemetryState(state, pipeline, gnmiclient):
+    ## - Content of /system/configurationless/statistics (YANG names with '_' for '-')
+    statistics = {
+        'fabric_nodes' : len(state.isis_nodes),
+        'notifications' : dict(pipeline.kinds, coalesced=pipeline.coalesced, dropped=pipeline.dropped,
+                               queue_depth=len(pipeline), max_queue_depth=pipeline.max_depth),
+        'roles' : {
+            'recomputations' : state.roles_durations.count,
+            'cache_hits' : state.roles_cache.hits,
+            'duration' : percentiles(state.roles_durations)
+        },
+        'gnmi' : {
+            'get_count' : gnmiclient.methods['get'].count,
+            'set_count' : gnmiclient.methods['set'].count,
+            'errors' : gnmiclient.errors,
+            'timeouts' : gnmiclient.timeouts,
+            'reconnects' : gnmiclient.reconnects,
+            'get_latency' : percentiles(gnmiclient.methods['get']),
+            'set_latency' : percentiles(gnmiclient.methods['set'])
+        }
+    }
+    if state.converged_at is not None:
+        statistics['seconds_since_convergence'] = int(time.monotonic() - state.converged_at)
+    return statistics
+
+
+def configValue(config, name):
+    ## - Leaf of the configuration as rendered by the NDK (underscores, and {"value": ...} around numbers)
+    value = config.get(name.replace('-', '_'), config.get(name))
+    if isinstance(value, dict) and 'value' in value:
+        value = value['value']
+    return value
+
+
+def handle_ConfigNotification(notification: Notification, state, gnmiclient) -> None:
+    ## - Configuration of the agent (YANG: /system/configurationless), e.g. {"ibgp_timer_delay": {"value": "2"}}
+    if notification.key.js_path != '.system.configurationless':
+        return
+    settings = rrSettings(state)
+    ## - Notification is DELETE (value: 2): back to the YANG default
+    if notification.op == 2:
+        state.ibgp_timer_delay = IBGP_TIMER_DELAY
+        state.profile_notifications = 0
+        state.rr_number, state.rr_strategy, state.rr_cluster_size = RR_NUMBER, RR_STRATEGY, RR_CLUSTER_SIZE
+    elif notification.data.json:
+        config = json.loads(notification.data.json)
+        config = config.get('configurationless', config)
+        delay = configValue(config, 'ibgp-timer-delay')
+        if delay is not None:
+            state.ibgp_timer_delay = int(delay)
+        ## - A new non-zero profile-notifications profiles that many notifications
+        notifications = configValue(config, 'profile-notifications')
+        if notifications is not None and int(notifications) != state.profile_notifications:
+            state.profile_notifications = int(notifications)
+            if state.profile_notifications > 0 and state.profiler is not None:
+                state.profiler.start(state.profile_notifications)
+        route_reflectors = configValue(config, 'route-reflectors') or {}
+        count = configValue(route_reflectors, 'count')
+        if count is not None:
+            state.rr_number = int(count)
+        cluster_size = configValue(route_reflectors, 'cluster-size')
+        if cluster_size is not None:
+            state.rr_cluster_size = int(cluster_size)
+        ## - Enumerations may come with a prefix, e.g. "STRATEGY_per_pod"
+        strategy = configValue(route_reflectors, 'strategy')
+        if strategy is not None:
+            strategy = str(strategy).lower().replace('_', '-')
+            state.rr_strategy = next((s for s in ('global', 'per-pod', 'hierarchical') if strategy.endswith(s)), RR_STRATEGY)
+    logging.info(f"[CONFIG] :: ibgp-timer-delay is {state.ibgp_timer_delay}s, {state.rr_number} RRs {state.rr_strategy} in clusters of {state.rr_cluster_size}")
+    ## - New RR settings: the RRs are elected again on the current topology
+    if rrSettings(state) != settings and state.route_reflectors:
+        recomputeRoles(state, gnmiclient)
+
 
 def handleNotification(notification: Notification, state, gnmiclient)-> None:
+    if notification.HasField('config'):
+        handle_ConfigNotification(notification.config, state, gnmiclient)
     if notification.HasField('lldp_neighbor'):
-        logging.info(f"handleNotification: notification.HasField => lldp_neighbor")
+        logging.debug("handleNotification: notification.HasField => lldp_neighbor")
         handle_LldpNeighborNotification(notification.lldp_neighbor, state, gnmiclient)
     if notification.HasField("route"):
-        logging.info(f"handleNotification: notification.HasField => route")
+        logging.debug("handleNotification: notification.HasField => route")
         handle_RouteNotification(notification.route, state, gnmiclient)
     return False
 
@@ -626,6 +1129,116 @@ def handleNotification(notification: Notification, state, gnmiclient)-> None:
 ####       MAIN FUNCTIONS TO INITIALIZE THE      ####
 ####            AGENT AND THE LOG FILES          ####
 
+def systemIds(state, gnmiclient):
+    ## - System MAC of the node and the IS-IS NET ID derived from it
+    result = gnmiclient.get(path=["/platform/chassis/hw-mac-address"], encoding="json_ietf")
+    #for e in [e for i in result['notification'] if 'update' in i.keys() for e in i['update'] if 'val' in e.keys()]:
+    sys_mac = result['notification'][0]['update'][0]['val']
+    state.mac = sys_mac
+    logging.info('[SYSTEM MAC] :: ' + f'{sys_mac}')
+
+    sys_id = macToSYSID(sys_mac)
+    logging.info('[SYSTEM ID] :: ' + f'{sys_id}')
+    net_id = AREA_ID + '.' + sys_id + '.00'
+    state.net_id = net_id
+    logging.info('[NET ID] :: ' + f'{net_id}')
+
+
+def bringUp(state, gnmiclient, hostname):
+    ## - Checking if has any Loopback configuration
+    check_ip_exist = gnmiclient.get(path=["/interface[name=system0]/subinterface[index=0]/ipv4"], encoding="json_ietf")
+    if 'update' in check_ip_exist['notification'][0]:
+        if 'address' in check_ip_exist['notification'][0]['update'][0]['val']:
+            if 'ip-prefix' in check_ip_exist['notification'][0]['update'][0]['val']['address'][0]:
+                state.sys_ip = check_ip_exist['notification'][0]['update'][0]['val']['address'][0]['ip-prefix'][:-3]
+    ## - Create a Loopback address in case it doesn't exist already
+    else:
+        #router_id_ipv4 = bitsToIpv4(macToBits(state.mac))
+        router_id_ipv4 = bitsToIpv4(macToBits(state.mac), hostname)
+        sys0_conf = {
+                    'subinterface' : [
+                        {
+                        'index' : '0',
+                        # /interface[name=system]/subinterface[index=0]
+                        'ipv4' : {
+                            'address' : [
+                                {'ip-prefix' : f'{router_id_ipv4}/32'}
+                            ],
+                            'admin-state' : 'enable'
+                        }, 
+                        'admin-state' : 'enable'
+                        #
+                        }
+                    ],
+                    'admin-state' : 'enable'
+                    } 
+        net_inst = {
+                'admin-state' : 'enable',
+                'interface' : [
+                    {'name' : 'system0.0'}
+                ]  
+                }
+        updates = [
+            ('/network-instance[name=default]', net_inst),
+            ('/interface[name=system0]', sys0_conf)
+        ] 
+        result = gnmiclient.set(update=updates, encoding="json_ietf")
+        #logging.info('[gNMIc] :: ' + f'{result}')
+        for conf in result['response']:
+            if str(conf['path']) == 'interface[name=system0]':
+                logging.info('[SYSTEM IP] :: ' + f'{router_id_ipv4}')
+        state.sys_ip = router_id_ipv4
+
+    routing_policy = { 'default-action' : {'policy-result' : 'accept'} }
+    update = [ ('/routing-policy/policy[name=all]', routing_policy)]
+    result = gnmiclient.set(update=update, encoding="json_ietf")
+    #logging.info('[gNMIc] :: ' + f'{result}')
+    if state.underlay_protocol == 'IS-IS':
+        ## - Configure IS-IS NET ID and system0.0
+        instance_isis = {
+                            'instance' : [
+                                {'name' : f'{ISIS_INSTANCE}',
+                                 'admin-state' : 'enable',
+                                 'level-capability' : f'{ISIS_LEVEL_CAPABILITY}',
+                                 'net' :  [ {'net' : f'{state.net_id}'} ],
+                                 'interface' : [
+                                     {'interface-name' : 'system0.0',
+                                      'admin-state' : 'enable',
+                                      'circuit-type' : 'point-to-point',
+                                      'passive' : 'true'
+                                     }
+                                 ]
+                                }
+                            ]
+                        }
+        update = [ ('/network-instance[name=default]/protocols/isis', instance_isis) ]
+        result = gnmiclient.set(update=update, encoding="json_ietf")
+        #logging.info('[gNMIc] :: ' + f'{result}')
+        for conf in result['response']:
+            if str(conf['path']) == '/network-instance[name=default]/protocols/isis':
+                logging.info('[UNDERLAY] :: IS-IS with NET ID' + f'{state.net_id}')
+
+    elif state.underlay_protocol == 'OSPFv3':
+        pass #TODO
+
+
+def startUp(state, gnmiclient, hostname, snapshot_path=None):
+    ## - System ids and the bring-up configuration, always sent: it is idempotent, and a warm restart after a wiped or
+    ## - partial configuration configures the node again. Then the saved state is resumed if the IS-IS topology did
+    ## - not change meanwhile (only the roles computation is skipped, see restoreSnapshot)
+    systemIds(state, gnmiclient)
+    bringUp(state, gnmiclient, hostname)
+    if snapshot_path is None:
+        return False
+    state.snapshot_path = snapshot_path
+    snapshot = loadSnapshot(snapshot_path)
+    if snapshot is None or snapshot['mac'] != state.mac:
+        return False
+    resumed = restoreSnapshot(state, snapshot, gnmiclient.get(path=[ISIS_LSDB_PATH], encoding="json_ietf"))
+    logging.info(f"[SNAPSHOT] :: {'Resumed' if resumed else 'Discarded'} the saved state of {len(snapshot['nodes'])} IS-IS nodes")
+    return resumed
+
+
 def Run(hostname):
     print("RUN STart")
     #print("Metadata:", metadata)
@@ -670,107 +1283,42 @@ def Run(hostname):
         #print("Try before gnmic")
         ## - gNMI Server connection variables: default port for gNMI server is 57400
         gnmic_host = (hostname, GNMI_PORT) #172.20.20.11, 'clab-dc1-leaf1'
-        with gNMIclient(target=gnmic_host, insecure=True, username=SR_USER, password=SR_PASSWORD, debug=True) as gc:
+        with GnmiSession(gnmic_host, SR_USER, SR_PASSWORD, keepalive=GNMI_KEEPALIVE, debug=GNMI_DEBUG, get_timeout=GNMI_GET_TIMEOUT, set_timeout=GNMI_SET_TIMEOUT,
+                         reconnect_attempts=GNMI_RECONNECT_ATTEMPTS, payload_sample=GNMI_PAYLOAD_SAMPLE) as gc:
             #print("with gnmic")
-            ## - Initial Router ID; IP, NET; int system0 and routing-policy configurations
-            result = gc.get(path=["/platform/chassis/hw-mac-address"], encoding="json_ietf")
-            #for e in [e for i in result['notification'] if 'update' in i.keys() for e in i['update'] if 'val' in e.keys()]:
-            sys_mac = result['notification'][0]['update'][0]['val']
-            state.mac = sys_mac
-            logging.info('[SYSTEM MAC] :: ' + f'{sys_mac}')
-
-            sys_id = macToSYSID(sys_mac)
-            logging.info('[SYSTEM ID] :: ' + f'{sys_id}')
-            net_id = AREA_ID + '.' + sys_id + '.00'
-            state.net_id = net_id
-            logging.info('[NET ID] :: ' + f'{net_id}')
-            
-            ## - Checking if has any Loopback configuration
-            check_ip_exist = gc.get(path=["/interface[name=system0]/subinterface[index=0]/ipv4"], encoding="json_ietf")
-            if 'update' in check_ip_exist['notification'][0]:
-                if 'address' in check_ip_exist['notification'][0]['update'][0]['val']:
-                    if 'ip-prefix' in check_ip_exist['notification'][0]['update'][0]['val']['address'][0]:
-                        state.sys_ip = check_ip_exist['notification'][0]['update'][0]['val']['address'][0]['ip-prefix'][:-3]
-            ## - Create a Loopback address in case it doesn't exist already
-            else:
-                #router_id_ipv4 = bitsToIpv4(macToBits(sys_mac))
-                router_id_ipv4 = bitsToIpv4(macToBits(sys_mac), hostname)
-                sys0_conf = {
-                            'subinterface' : [
-                                {
-                                'index' : '0',
-                                # /interface[name=system]/subinterface[index=0]
-                                'ipv4' : {
-                                    'address' : [
-                                        {'ip-prefix' : f'{router_id_ipv4}/32'}
-                                    ],
-                                    'admin-state' : 'enable'
-                                }, 
-                                'admin-state' : 'enable'
-                                #
-                                }
-                            ],
-                            'admin-state' : 'enable'
-                            } 
-                net_inst = {
-                        'admin-state' : 'enable',
-                        'interface' : [
-                            {'name' : 'system0.0'}
-                        ]  
-                        }
-                updates = [
-                    ('/network-instance[name=default]', net_inst),
-                    ('/interface[name=system0]', sys0_conf)
-                ] 
-                result = gc.set(update=updates, encoding="json_ietf")
-                #logging.info('[gNMIc] :: ' + f'{result}')
-                for conf in result['response']:
-                    if str(conf['path']) == 'interface[name=system0]':
-                        logging.info('[SYSTEM IP] :: ' + f'{router_id_ipv4}')
-                state.sys_ip = router_id_ipv4
-
-            routing_policy = { 'default-action' : {'policy-result' : 'accept'} }
-            update = [ ('/routing-policy/policy[name=all]', routing_policy)]
-            result = gc.set(update=update, encoding="json_ietf")
-            #logging.info('[gNMIc] :: ' + f'{result}')
-            if state.underlay_protocol == 'IS-IS':
-                ## - Configure IS-IS NET ID and system0.0
-                instance_isis = {
-                                    'instance' : [
-                                        {'name' : f'{ISIS_INSTANCE}',
-                                         'admin-state' : 'enable',
-                                         'level-capability' : f'{ISIS_LEVEL_CAPABILITY}',
-                                         'net' :  [ {'net' : f'{state.net_id}'} ],
-                                         'interface' : [
-                                             {'interface-name' : 'system0.0',
-                                              'admin-state' : 'enable',
-                                              'circuit-type' : 'point-to-point',
-                                              'passive' : 'true'
-                                             }
-                                         ]
-                                        }
-                                    ]
-                                }
-                update = [ ('/network-instance[name=default]/protocols/isis', instance_isis) ]
-                result = gc.set(update=update, encoding="json_ietf")
-                #logging.info('[gNMIc] :: ' + f'{result}')
-                for conf in result['response']:
-                    if str(conf['path']) == '/network-instance[name=default]/protocols/isis':
-                        logging.info('[UNDERLAY] :: IS-IS with NET ID' + f'{state.net_id}')
+            ## - Records the notifications and gNMI calls of this run, for an offline replay
+            capture = None
+            if CAPTURE_PATH:
+                capture = gc.capture = Capture(CAPTURE_PATH, hostname, {name : globals()[name] for name in CAPTURE_SETTINGS})
+            ## - Initial Router ID; IP, NET; int system0, routing-policy and IS-IS configurations
+            ## - Warm restart: the converged state saved before is resumed if the IS-IS topology did not change meanwhile
+            startUp(state, gc, hostname, SNAPSHOT_PATH if WARM_RESTART else None)
 
-            elif state.underlay_protocol == 'OSPFv3':
-                pass #TODO
+            ## - IS-IS LSDB mirror kept up to date by an on-change subscription
+            if LSDB_MIRROR and state.underlay_protocol == 'IS-IS':
+                state.lsdb.on_change = lambda ips: lsdbChanged(state, gc, ips)
+                state.lsdb.start(gc)
+                gc.on_reconnect.append(lambda: state.lsdb.start(gc))
 
-            ## - New notifications incoming
+            ## - New notifications incoming: read here and handled in the pipeline thread
             count = 0
+            pipeline = NotificationPipeline(PIPELINE_QUEUE_SIZE, PIPELINE_OVERLOAD, state_lock, handleNotification, resyncRoutes, PIPELINE_STATS_INTERVAL)
+            pipeline.start(state, gc)
+            telemetry = AgentTelemetry(TELEMETRY_INTERVAL, channel, metadata, SdkMgrStatus.Value(SDK_MGR_FAILED))
+            telemetry.start(lambda: telemetryState(state, pipeline, gc))
+            ## - Profiling on demand: SIGUSR1 or the profile-notifications leaf of the YANG configuration
+            state.profiler = SamplingProfiler(PROFILE_DIR, lambda: pipeline.handled, lambda: batchesPending(state), PROFILE_INTERVAL, PROFILE_MAX_SECONDS)
+            signal.signal(signal.SIGUSR1, lambda signum, frame: state.profiler.start(PROFILE_NOTIFICATIONS))
             try:
                 for r in notification_stream_response:
                     count += 1
                     for obj in r.notification:
+                        if capture is not None:
+                            capture.notification(obj)
                         if obj.HasField('config') and obj.config.key.js_path == ".commit.end":
                             logging.info('[TO DO] :: -commit.end config')
                         else:
-                            handleNotification(obj, state, gc)
+                            pipeline.put(obj)
 
             except grpc.RpcError as e:
                 if e.code() == grpc.StatusCode.UNKNOWN and \
@@ -778,6 +1326,20 @@ def Run(hostname):
                     logging.info("gNMI stream closed on server side")
                 else:
                     raise
+            finally:
+                state.profiler.close()
+                telemetry.close()
+                pipeline.close()
+                logging.info(f"[PIPELINE] :: {pipeline}")
+                logging.info(f"[gNMI] :: {gc}")
+                state.route_batch.cancel()
+                state.lldp_writes.cancel()
+                state.overlay_apply.cancel()
+                state.roles_worker.close()
+                state.lsdb.close()
+                if capture is not None:
+                    gc.capture = None
+                    capture.close()
         
 
     except grpc._channel._Rendezvous as err:
@@ -816,11 +1378,17 @@ def initialLoggingSetup(hostname):
     if not os.path.exists(stdout_dir):
         os.makedirs(stdout_dir, exist_ok=True)
     log_filename = '{}/{}_configurationless.log'.format(stdout_dir, hostname)
-    logging.basicConfig(filename=log_filename, filemode='a',\
-                        format='[%(levelname)s %(asctime)s,%(msecs)d %(name)s]',\
-                        datefmt='%H:%M:%S', level=logging.INFO)
-    handler = RotatingFileHandler(log_filename, maxBytes=3000000, backupCount=5)
-    logging.getLogger().addHandler(handler)
+    ## - One rotating file handler, written by a background thread: the handling threads only queue their records.
+    ## - Same layout as before: a '[LEVEL time logger]' line, then the message (show-fabric-plugin reads the messages)
+    handler = RotatingFileHandler(log_filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    handler.setFormatter(logging.Formatter('[%(levelname)s %(asctime)s,%(msecs)d %(name)s]\n%(message)s', datefmt='%H:%M:%S'))
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(QueueHandler(records))
     logging.info("[START TIME] :: {}".format(datetime.datetime.now()))
 
 
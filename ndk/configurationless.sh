@@ -56,7 +56,6 @@ function main() {
     ip netns exec srbase-mgmt pip3 install srlinux-ndk==0.4.0   ### srlinux-ndk==0.5.0 changed many things
     ip netns exec srbase-mgmt pip3 install pygnmi
     ip netns exec srbase-mgmt pip3 install 'protobuf>3.20'
-    ip netns exec srbase-mgmt pip3 install numpy
 
     # update PYTHONPATH variable with the agent directories and ndk bindings
     #export PYTHONPATH="$PYTHONPATH:/etc/opt/srlinux/appmgr/dcf-ztp:/usr/lib/python3.11/dist-packages/sdk_protos/:/usr/lib/python3.6/site-packages/sdk_protos:/etc/opt/srlinux/appmgr/venv-dev/lib/python3.6/site-packages"
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: gnmiSession.py
+## Description: gNMI session of the agent with its node: deadlines on every call, keepalives and
+##              reconnection of a lost session, and per-path latency and payload statistics.
+##################################################################################################
+"""
+import grpc
+import time
+import json
+import re
+import threading
+import logging
+
+from histograms import Histogram
+from capture import CapturedStream
+
+
+class GnmiSession(object):
+    ## - gNMI session of the agent, used like the pygnmi gNMIclient (get, set, subscribe_stream):
+    ## - - keepalive pings on the channel, and a new channel (after a backoff) when the session is lost: a call failing
+    ## -   with UNAVAILABLE or CANCELLED is sent again once on the new channel
+    ## - - every Get and Set has a deadline: pygnmi has none, so the call runs in a small thread pool and the session
+    ## -   reconnects on expiry, with a new pool: the hung calls may keep their threads, the new calls do not wait for them
+    ## - - latency (ms) histograms per method and path (list keys masked), and payload size (bytes of JSON) histograms
+    ## -   sampled once every payload_sample calls: serializing a whole LSDB again costs about as much as reading it
+    ## - - debug logs of each request and response, formatted only when debug is on (pygnmi debug prints every message)
+    LATENCY_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+    PAYLOAD_BOUNDS = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+
+    def __init__(self, target, username, password, keepalive=10, debug=False, get_timeout=30, set_timeout=30, reconnect_attempts=5, payload_sample=16):
+        self.target = target
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.debug = debug
+        self.get_timeout = get_timeout
+        self.set_timeout = set_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.payload_sample = payload_sample
+        self.client = None
+        self.executor = None
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.on_reconnect = []
+        self.paths = {}   # (method, path) -> {'latency' : Histogram, 'payload' : Histogram, 'errors' : int}
+        self.methods = {'get' : Histogram(self.LATENCY_BOUNDS), 'set' : Histogram(self.LATENCY_BOUNDS)}
+        self.errors = 0
+        self.reconnects = 0
+        self.timeouts = 0
+        self.capture = None
+
+    def connect(self):
+        ## - Imported here: pygnmi is the slowest import of the agent and is only needed once it is registered
+        from pygnmi.client import gNMIclient
+        from concurrent.futures import ThreadPoolExecutor
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='gnmi')
+        self.client = gNMIclient(target=self.target, insecure=True, username=self.username, password=self.password,
+                                 debug=False, keepalive_time_ms=int(self.keepalive * 1000))
+        self.client.connect()
+
+    def reconnect(self, generation):
+        ## - Only the first call that sees a lost session reconnects
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.generation += 1
+            generation = self.generation
+            try:
+                self.client.close()
+            except Exception:
+                pass
+            ## - Calls still queued in the old pool fail with CancelledError and are sent again on the new session
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+        ## - The backoff runs without the lock: the other calls fail fast meanwhile instead of waiting for it
+        for attempt in range(self.reconnect_attempts):
+            with self.lock:
+                if generation != self.generation:
+                    ## - A call that failed meanwhile took over the reconnection
+                    return
+                try:
+                    self.connect()
+                    break
+                except Exception as e:
+                    logging.error(f"[gNMI] :: Connection attempt {attempt + 1} failed: {str(e)}")
+                    if attempt == self.reconnect_attempts - 1:
+                        raise
+            time.sleep(2 ** attempt)
+        with self.lock:
+            self.reconnects += 1
+            logging.info(f"[gNMI] :: Reconnected to {self.target[0]} ({self.reconnects} reconnects)")
+        for callback in self.on_reconnect:
+            callback()
+
+    def call(self, method, path, timeout, request, payload=None):
+        ## - request: function of the pygnmi client; payload: arguments of the call (a Set body is also sized)
+        from concurrent.futures import TimeoutError as FutureTimeoutError, CancelledError
+        key = (method, re.sub(r'=[^\]]*\]', '=*]', path))
+        for attempt in range(2):
+            generation = self.generation
+            start = time.monotonic()
+            if self.debug:
+                logging.info(f"[gNMI] :: {method} {path} request {payload}")
+            try:
+                with self.lock:
+                    if self.executor is None:
+                        raise CancelledError()
+                    future = self.executor.submit(request, self.client)
+                result = future.result(timeout)
+            except FutureTimeoutError:
+                self.record(key, start, error=True)
+                self.timeouts += 1
+                if self.capture is not None:
+                    self.capture.gnmi(method, payload, None, 'timeout')
+                logging.error(f"[gNMI] :: {method} {path} exceeded its {timeout}s deadline")
+                self.reconnect(generation)
+                raise TimeoutError(f"gNMI {method} {path} exceeded its {timeout}s deadline")
+            except Exception as e:
+                code = getattr(getattr(e, 'orig_exc', e), 'code', None)
+                if attempt == 0 and (isinstance(e, CancelledError) or callable(code) and code() in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.CANCELLED)):
+                    logging.error(f"[gNMI] :: {method} {path} failed on a lost session, sending it again: {str(e)}")
+                    self.reconnect(generation)
+                    continue
+                self.record(key, start, error=True)
+                if self.capture is not None:
+                    self.capture.gnmi(method, payload, None, str(e))
+                raise
+            size = None
+            if self.stats(key)['latency'].count % self.payload_sample == 0:
+                size = len(json.dumps(payload if method == 'set' else result, separators=(',', ':'), default=str))
+            self.record(key, start, size)
+            if self.capture is not None:
+                self.capture.gnmi(method, payload, result)
+            if self.debug:
+                logging.info(f"[gNMI] :: {method} {path} response {result}")
+            return result
+
+    def stats(self, key):
+        stats = self.paths.get(key)
+        if stats is None:
+            stats = self.paths[key] = {'latency' : Histogram(self.LATENCY_BOUNDS), 'payload' : Histogram(self.PAYLOAD_BOUNDS), 'errors' : 0}
+        return stats
+
+    def record(self, key, start, size=None, error=False):
+        ## - size: payload bytes of a sampled call (None: not sized)
+        stats = self.stats(key)
+        latency = round((time.monotonic() - start) * 1000, 1)
+        stats['latency'].add(latency)
+        self.methods[key[0]].add(latency)
+        if error:
+            stats['errors'] += 1
+            self.errors += 1
+        elif size is not None:
+            stats['payload'].add(size)
+
+    def get(self, path, encoding=None):
+        payload = {'path' : path, 'encoding' : encoding}
+        return self.call('get', path[0], self.get_timeout, lambda client: client.get(path=path, encoding=encoding), payload)
+
+    def set(self, update=None, replace=None, delete=None, encoding=None):
+        paths = [p for p, _ in (replace or []) + (update or [])] + (delete or [])
+        payload = {'update' : update, 'replace' : replace, 'delete' : delete, 'encoding' : encoding}
+        return self.call('set', paths[0] if paths else '', self.set_timeout,
+                         lambda client: client.set(update=update, replace=replace, delete=delete, encoding=encoding), payload)
+
+    def subscribe_stream(self, subscribe):
+        ## - Streams have no deadline: they end with the channel, and on_reconnect subscribes again
+        subscription = self.client.subscribe_stream(subscribe=subscribe)
+        if self.capture is not None:
+            return CapturedStream(subscription, self.capture)
+        return subscription
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __str__(self):
+        lines = [f"reconnects={self.reconnects} timeouts={self.timeouts}"]
+        for (method, path), stats in sorted(self.paths.items()):
+            lines.append(f"{method} {path} latency_ms({stats['latency']}) payload_bytes({stats['payload']}) errors={stats['errors']}")
+        return '\n'.join(lines)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: histograms.py
+## Description: Bucketed histograms of the agent statistics (gNMI latencies and payload sizes, roles
+##              computation times), cheap enough to be updated on every call.
+##################################################################################################
+"""
+import bisect
+
+
+class Histogram(object):
+    ## - Counts of the values up to each bound (the last bucket has no bound)
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        ## - Bound of the bucket holding the p-th percentile (no more than the max)
+        rank = p * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return 0
+
+    def __str__(self):
+        return f"n={self.count} p50<={self.percentile(0.5)} p99<={self.percentile(0.99)} max={self.max}"
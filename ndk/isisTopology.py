@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: isisTopology.py
+## Description: IS-IS topology learnt by the agent: the nodes of the LSDB indexed by loopback IP and
+##              by NET ID, and the graph g of the roles algorithm packed from them.
+##################################################################################################
+"""
+from algorithms.nodesRolesAlgorithm import CompactGraph
+import ipaddress
+import bisect
+
+
+class IsisNodeTable(object):
+    ## - IS-IS nodes indexed by loopback IP and by NET ID. Each node keeps the NET IDs of its neighbors (a dict used
+    ## - as an ordered set, in LSP order) and every NET ID keeps the nodes announcing it, so joining, leaving and
+    ## - resolving the neighbors of a node only touch that node and its neighbors
+    ## - The loopback IPs are also kept sorted as integers (bisect insertion) and the resolved neighbor IPs of each
+    ## - node are updated in place, so the graph of the roles algorithm is packed without sorting or resolving
+    def __init__(self):
+        self.nodes = {}
+        self.by_net = {}
+        self.announced_by = {}
+        self.order = []
+        self.by_key = {}
+
+    def join(self, ip, net_id, neighbors_net_id=()):
+        ## - A node that is already known is replaced (and moved to the end, like a new node)
+        old_net_id = None
+        if ip in self.nodes:
+            self.unindex(ip)
+            old = self.nodes.pop(ip)
+            old_net_id = old['net_id']
+            key = old['key']
+        else:
+            key = int(ipaddress.ip_address(ip))
+            bisect.insort(self.order, key)
+            self.by_key[key] = ip
+        self.nodes[ip] = { 'ip_addr' : ip, 'key' : key, 'net_id' : net_id, 'neighbors_net_id' : {}, 'neighbors_ip' : [] }
+        if net_id is not None:
+            self.by_net[net_id] = ip
+        self.setNeighbors(ip, neighbors_net_id)
+        ## - The nodes announcing this node (by its old or new NET ID) resolve their neighbors again
+        for net in {old_net_id, net_id}:
+            for other in self.announced_by.get(net, ()):
+                self.resolve(other)
+
+    def setNeighbors(self, ip, neighbors_net_id):
+        node = self.nodes[ip]
+        for net in node['neighbors_net_id']:
+            self.announced_by[net].discard(ip)
+        node['neighbors_net_id'] = dict.fromkeys(neighbors_net_id)
+        for net in node['neighbors_net_id']:
+            self.announced_by.setdefault(net, set()).add(ip)
+        self.resolve(ip)
+
+    def leave(self, ip):
+        ## - Keeps the neighbor relation symmetric: the nodes announcing the leaving node forget its NET ID
+        node = self.nodes.get(ip)
+        if node is None:
+            return False
+        self.unindex(ip)
+        del self.nodes[ip]
+        del self.order[bisect.bisect_left(self.order, node['key'])]
+        del self.by_key[node['key']]
+        for other in self.announced_by.pop(node['net_id'], ()):
+            del self.nodes[other]['neighbors_net_id'][node['net_id']]
+            self.resolve(other)
+        return True
+
+    def unindex(self, ip):
+        node = self.nodes[ip]
+        if self.by_net.get(node['net_id']) == ip:
+            del self.by_net[node['net_id']]
+        for net in node['neighbors_net_id']:
+            self.announced_by[net].discard(ip)
+
+    def resolve(self, ip):
+        ## - IPs of the known neighbors of a node, in LSP order
+        node = self.nodes[ip]
+        node['neighbors_ip'] = [self.by_net[net] for net in node['neighbors_net_id'] if net in self.by_net]
+
+    def neighbors(self, ip):
+        return self.nodes[ip]['neighbors_ip']
+
+    def adjacency(self):
+        return {ip : node['neighbors_ip'] for ip, node in self.nodes.items()}
+
+    def graph(self):
+        return IsisGraph(self)
+
+    def __contains__(self, ip):
+        return ip in self.nodes
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __str__(self):
+        return str(self.nodes)
+
+
+class IsisGraph(CompactGraph):
+    ## - Graph g of the roles algorithm, packed from the node table: row i holds the ids of the neighbors of the node with
+    ## - the i-th lowest loopback IP (row 0 is a placeholder)
+    def __init__(self, table):
+        CompactGraph.__init__(self, [[0,0]])
+        self.ips = [table.by_key[key] for key in table.order]
+        ids = {ip : i + 1 for i, ip in enumerate(self.ips)}
+        for ip in self.ips:
+            self.addRow([ids[nei] for nei in table.neighbors(ip)])
+
+    def ip(self, i):
+        return self.ips[i - 1]
+
+    def __str__(self):
+        return ''.join(f"{ip} : {[self.ip(nei) for nei in self.row(i + 1)]}\n" for i, ip in enumerate(self.ips))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: lsdbMirror.py
+## Description: In-memory mirror of the IS-IS LSDB of the node, kept up to date by a gNMI on-change
+##              subscription, so that the agent does not read the whole LSDB on every route
+##              notification.
+##################################################################################################
+"""
+import threading
+import logging
+
+
+class IsisLsdb(object):
+    ## - In-memory mirror of the IS-IS level-1 LSDB (lsp-id -> defined-tlvs): filled once with a GET and then
+    ## - kept up to date by a STREAM/ON_CHANGE subscription on the level-database, read in a background thread
+    ## - Updates carrying the whole defined-tlvs container are applied as they are; any other change to an LSP
+    ## - (a single leaf, a deleted TLV) re-reads that LSP only
+    ## - The loopback IPs of the LSPs that changed are handed to on_change (with the lock): the nodes already
+    ## - known by the agent are then handled again, since a route notification may have been read before their LSPs
+    ## - path: level-database path of the IS-IS instance (lsp-id=*); lock: state lock of the agent
+    def __init__(self, path, lock):
+        self.path = path
+        self.lock = lock
+        self.lsps = {}
+        self.ips = {}
+        self.changed = set()
+        self.on_change = None
+        self.synced = False
+        self.subscription = None
+        self.thread = None
+        self.updates = 0
+        self.refreshes = 0
+
+    def start(self, gnmiclient):
+        ## - Also called again on a new gNMI session: the stream of the previous one is closed
+        self.close()
+        self.subscription = gnmiclient.subscribe_stream(subscribe={
+            'subscription' : [ {'path' : self.path, 'mode' : 'on_change'} ],
+            'mode' : 'stream',
+            'encoding' : 'json_ietf'
+        })
+        self.thread = threading.Thread(target=self.follow, args=(gnmiclient, self.subscription), daemon=True)
+        self.thread.start()
+
+    def follow(self, gnmiclient, subscription):
+        try:
+            ## - pygnmi merges every update up to the sync response into the first message: the initial state, possibly
+            ## - leaf by leaf. It is discarded on purpose: the GET below reads that state again with whole LSPs (dropping
+            ## - the LSPs that left meanwhile), and the updates streamed after the sync are applied on top of it
+            next(subscription)
+            self.fill(gnmiclient.get(path=[self.path], encoding="json_ietf"))
+            logging.info(f"[LSDB] :: Mirror synced with {len(self.lsps)} LSPs")
+            with self.lock:
+                self.report()
+            for response in subscription:
+                with self.lock:
+                    refresh = self.apply(response)
+                    self.report()
+                for lsp_id in refresh:
+                    try:
+                        lsp = gnmiclient.get(path=[self.path.replace('[lsp-id=*]', f'[lsp-id={lsp_id}]')], encoding="json_ietf")
+                    except Exception as e:
+                        ## - The LSP is gone (or unreadable): a later update brings it back
+                        lsp = {'notification' : [{}]}
+                    with self.lock:
+                        self.refreshes += 1
+                        if not self.fill(lsp, lsp_id):
+                            self.deleteLsp(lsp_id)
+                        self.report()
+        except Exception as e:
+            logging.error(f"[LSDB] :: Subscription lost, reading the LSDB with GETs: {str(e)}")
+        finally:
+            with self.lock:
+                if self.subscription is subscription or self.subscription is None:
+                    self.synced = False
+
+    def fill(self, result, lsp_id=None):
+        ## - result: GET response of the level-database; returns whether it held any LSP
+        found = False
+        with self.lock:
+            if lsp_id is None:
+                ## - Full resync (also after a new gNMI session): LSPs that left while the stream was down are dropped too
+                previous = self.lsps
+                self.lsps = {}
+                self.ips = {}
+            if 'update' in result['notification'][0]:
+                if result['notification'][0]['update'][0]['val']['level-database']:
+                    for tlv in result['notification'][0]['update'][0]['val']['level-database']:
+                        self.setLsp(str(tlv['lsp-id']), tlv['defined-tlvs'])
+                        found = True
+            if lsp_id is None:
+                ## - Only the differences with the previous sync are changes: the first sync is the starting point
+                self.changed = set()
+                if previous:
+                    for changed_id in set(previous) | set(self.lsps):
+                        if previous.get(changed_id) != self.lsps.get(changed_id):
+                            self.changed.update(ip for ip in (lspIp(previous.get(changed_id)), lspIp(self.lsps.get(changed_id))) if ip is not None)
+                self.synced = True
+        return found
+
+    def report(self):
+        ## - Called with the lock
+        changed = self.changed
+        self.changed = set()
+        if changed and self.on_change is not None:
+            self.on_change(changed)
+
+    def apply(self, response):
+        ## - response: one streamed notification (pygnmi format); returns the LSPs that have to be read again
+        refresh = set()
+        if 'update' not in response:
+            return refresh
+        self.updates += 1
+        prefix = response['update'].get('prefix') or ''
+        for update in response['update'].get('update', []):
+            path = '/'.join(p for p in [prefix, update['path'] or ''] if p)
+            lsp_id = lspId(path)
+            if lsp_id is None:
+                continue
+            if path.endswith('defined-tlvs') and isinstance(update.get('val'), dict):
+                self.setLsp(lsp_id, update['val'])
+            else:
+                refresh.add(lsp_id)
+        for delete in response['update'].get('delete', []):
+            path = '/'.join(p for p in [prefix, delete['path'] or ''] if p)
+            lsp_id = lspId(path)
+            if lsp_id is None:
+                continue
+            if path.endswith(f'[lsp-id={lsp_id}]') or path.endswith('defined-tlvs'):
+                self.deleteLsp(lsp_id)
+                refresh.discard(lsp_id)
+            else:
+                refresh.add(lsp_id)
+        return refresh
+
+    def setLsp(self, lsp_id, tlvs):
+        if self.lsps.get(lsp_id) == tlvs:
+            return
+        self.deleteLsp(lsp_id)
+        self.lsps[lsp_id] = tlvs
+        ip = lspIp(tlvs)
+        if ip is not None:
+            self.ips[ip] = lsp_id
+            self.changed.add(ip)
+
+    def deleteLsp(self, lsp_id):
+        ip = lspIp(self.lsps.pop(lsp_id, None))
+        if ip is not None:
+            self.ips.pop(ip, None)
+            self.changed.add(ip)
+
+    def knows(self, ip):
+        return ip in self.ips
+
+    def database(self):
+        ## - Same shape as the GET response of the level-database, sorted by lsp-id
+        lsdb = [ {'lsp-id' : lsp_id, 'defined-tlvs' : self.lsps[lsp_id]} for lsp_id in sorted(self.lsps) ]
+        return {'notification' : [ {'update' : [ {'val' : {'level-database' : lsdb}} ]} ]}
+
+    def close(self):
+        if self.subscription is not None:
+            self.subscription.close()
+            self.subscription = None
+
+    def __len__(self):
+        return len(self.lsps)
+
+    def __str__(self):
+        return f"lsps={len(self.lsps)} synced={self.synced} updates={self.updates} refreshes={self.refreshes}"
+
+
+def lspId(path):
+    ## - lsp-id key of a level-database path, or None
+    start = path.find('[lsp-id=')
+    if start == -1:
+        return None
+    return path[start + len('[lsp-id='):path.index(']', start)]
+
+
+def lspIp(tlvs):
+    ## - Loopback IP announced in the defined-tlvs of an LSP, or None
+    if tlvs and tlvs.get('ipv4-interface-addresses'):
+        return str(tlvs['ipv4-interface-addresses'][0])
+    return None
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: pipeline.py
+## Description: Notification pipeline of the agent: the NDK stream is read and queued in the main
+##              thread, and the notifications are handled by a thread of their own, so that a slow
+##              gNMI call does not stall the stream.
+##################################################################################################
+"""
+import time
+import threading
+import logging
+import traceback
+from collections import OrderedDict
+
+from tracing import trace, trace_ids
+
+
+class StageLatency(object):
+    ## - Latency of one stage of the notification pipeline, in seconds
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    def __str__(self):
+        avg = self.total / self.count if self.count else 0.0
+        return f"avg={avg * 1000:.1f}ms max={self.max * 1000:.1f}ms"
+
+
+class NotificationPipeline(object):
+    ## - The NDK stream is only read and queued in the main thread: a handler thread takes the notifications from a
+    ## - bounded queue and does the gNMI I/O, so that a slow gNMI call does not stall the stream
+    ## - A route notification replaces the queued one of the same prefix (create after a pending op becomes an update):
+    ## - a storm of route flaps holds at most one entry per prefix. The overload policy applies once the queue is full;
+    ## - a dropped route notification makes the handler read the whole route table again once no route is left queued
+    ## - Stages: 'queue' (wait in the queue), 'lock' (wait for the timers and the worker callbacks), 'handle'
+    ## - lock: state lock of the agent; handle(notification, state, gnmiclient) and resync(state, gnmiclient) run with it
+    def __init__(self, size, overload, lock, handle, resync, stats_interval):
+        self.size = size
+        self.overload = overload
+        self.lock = lock
+        self.handle = handle
+        self.resync_routes = resync
+        self.stats_interval = stats_interval
+        self.events = OrderedDict()   # key -> [kind, notification, enqueued time]
+        self.cond = threading.Condition()
+        self.sequence = 0
+        self.thread = None
+        self.closed = False
+        self.received = 0
+        self.kinds = {'route' : 0, 'lldp' : 0, 'config' : 0, 'other' : 0}
+        self.coalesced = 0
+        self.dropped = 0
+        self.resync = False
+        self.resyncing = False
+        self.resyncs = 0
+        self.handled = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.blocked = 0.0
+        self.latency = {'queue' : StageLatency(), 'lock' : StageLatency(), 'handle' : StageLatency()}
+        self.last_log = time.monotonic()
+
+    def put(self, notification):
+        ## - Called by the stream reader: never waits for the handler, unless the queue is full and the policy is 'block'
+        if notification.HasField('route'):
+            kind = 'route'
+            key = (kind, bytes(notification.route.key.ip_prefix.ip_addr.addr), notification.route.key.ip_prefix.prefix_length)
+        elif notification.HasField('lldp_neighbor'):
+            kind = 'lldp'
+            key = None
+        else:
+            kind = 'config' if notification.HasField('config') else 'other'
+            key = None
+        with self.cond:
+            self.received += 1
+            self.kinds[kind] += 1
+            if key in self.events:
+                if notification.route.op == 0:
+                    notification.route.op = 1
+                self.events[key][1] = notification
+                self.coalesced += 1
+                return
+            if len(self.events) >= self.size:
+                start = time.monotonic()
+                while len(self.events) >= self.size and not self.closed:
+                    if self.overload == 'drop_oldest' and self.dropOldestRoute():
+                        break
+                    self.cond.wait()
+                self.blocked += time.monotonic() - start
+            if key is None:
+                self.sequence += 1
+                key = (kind, self.sequence)
+            self.events[key] = [kind, notification, time.monotonic()]
+            self.max_depth = max(self.max_depth, len(self.events))
+            self.cond.notify_all()
+
+    def dropOldestRoute(self):
+        ## - LLDP and configuration notifications are never dropped
+        for key, event in self.events.items():
+            if event[0] == 'route':
+                del self.events[key]
+                self.dropped += 1
+                self.resync = True
+                logging.warning(f"[PIPELINE] :: Queue full, dropped the route notification of {'.'.join(str(b) for b in key[1])} (op {event[1].route.op})")
+                return True
+        return False
+
+    def takeResync(self):
+        ## - The resync waits for the queued route notifications: a storm still filling the queue would drop more of them
+        with self.cond:
+            if not self.resync or any(event[0] == 'route' for event in self.events.values()):
+                return False
+            self.resync = False
+            self.resyncing = True
+            self.resyncs += 1
+            return True
+
+    def get(self):
+        with self.cond:
+            while not self.events and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            event = self.events.popitem(last=False)[1]
+            self.cond.notify_all()
+            return event
+
+    def start(self, state, gnmiclient):
+        self.thread = threading.Thread(target=self.work, args=(state, gnmiclient), daemon=True)
+        self.thread.start()
+
+    def work(self, state, gnmiclient):
+        while True:
+            event = self.get()
+            if event is None:
+                return
+            kind, notification, enqueued = event
+            start = time.monotonic()
+            with self.lock:
+                locked = time.monotonic()
+                try:
+                    with trace(kind, [next(trace_ids)]):
+                        self.handle(notification, state, gnmiclient)
+                except Exception as e:
+                    self.errors += 1
+                    logging.error(f"[PIPELINE] :: {kind} notification: {str(e)}\n{traceback.format_exc()}")
+            done = time.monotonic()
+            self.latency['queue'].add(start - enqueued)
+            self.latency['lock'].add(locked - start)
+            self.latency['handle'].add(done - locked)
+            self.handled += 1
+            if self.takeResync():
+                with self.lock:
+                    try:
+                        with trace('route resync', [next(trace_ids)]):
+                            self.resync_routes(state, gnmiclient)
+                    except Exception as e:
+                        self.errors += 1
+                        logging.error(f"[PIPELINE] :: route resync: {str(e)}\n{traceback.format_exc()}")
+                    self.resyncing = False
+            if done - self.last_log >= self.stats_interval:
+                self.last_log = done
+                logging.info(f"[PIPELINE] :: {self}")
+                logging.info(f"[gNMI] :: {gnmiclient}")
+
+    def close(self, timeout=5.0):
+        with self.cond:
+            self.closed = True
+            pending = len(self.events)
+            self.events.clear()
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        if pending:
+            logging.info(f"[PIPELINE] :: {pending} queued notifications discarded on exit")
+
+    def __len__(self):
+        return len(self.events)
+
+    def __str__(self):
+        stages = ' '.join(f"{stage}({latency})" for stage, latency in self.latency.items())
+        return (f"depth={len(self.events)}/{self.size} max_depth={self.max_depth} received={self.received} handled={self.handled} "
+                f"coalesced={self.coalesced} dropped={self.dropped} resyncs={self.resyncs} errors={self.errors} blocked={self.blocked:.3f}s {stages}")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: profiler.py
+## Description: On-demand sampling profiler of the agent threads (SIGUSR1 or YANG
+##              profile-notifications), written as folded stacks for flame graph tools.
+##################################################################################################
+"""
+import os
+import sys
+import time
+import datetime
+import threading
+import logging
+
+import tracing
+from tracing import Trace
+
+
+class SamplingProfiler(object):
+    ## - Samples the stacks of the agent threads while the next notifications are handled, and writes them as folded
+    ## - stacks ('thread;outer frame;...;inner frame count' lines, for flame graph tools). Started on demand: nothing
+    ## - runs otherwise. Only the threads handling a notification (with a trace) are sampled, gNMI waits included;
+    ## - without traces (tracing.SPANS False) the threads waiting in threading.py (idle queues, timers) are left out
+    def __init__(self, directory, handled, pending, interval, max_seconds):
+        self.directory = directory
+        self.handled = handled   # function: notifications handled so far
+        self.pending = pending   # function: True while batches wait for their timer
+        self.interval = interval
+        self.max_seconds = max_seconds   # longest profiling, when fewer notifications arrive
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self, notifications):
+        if self.thread is not None and self.thread.is_alive():
+            logging.info("[PROFILE] :: Already profiling")
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.sample, args=(self.handled() + notifications, notifications), daemon=True)
+        self.thread.start()
+        logging.info(f"[PROFILE] :: Profiling the next {notifications} notifications")
+
+    def sample(self, target, notifications):
+        stacks = {}
+        samples = 0
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        busy = True
+        ## - Goes on after the last notification until the batches it started (timer threads) are done
+        while (busy or self.pending() or self.handled() < target) and time.monotonic() < deadline and not self.stopped.wait(self.interval):
+            names = {t.ident : t.name for t in threading.enumerate()}
+            busy = False
+            handling = set(Trace.active)
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (ident not in handling if tracing.SPANS else frame.f_code.co_filename.endswith('threading.py')):
+                    continue
+                busy = True
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ';'.join(reversed(stack))
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+        path = os.path.join(self.directory, f"configurationless_profile_{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.folded")
+        try:
+            with open(path, 'w') as f:
+                for key, count in sorted(stacks.items(), key=lambda e: -e[1]):
+                    f.write(f"{key} {count}\n")
+            logging.info(f"[PROFILE] :: {samples} samples over {notifications} notifications written to {path}")
+        except OSError as e:
+            logging.error(f"[PROFILE] :: Not written: {str(e)}")
+
+    def close(self):
+        self.stopped.set()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: rolesCache.py
+## Description: Roles and elected Route Reflectors of the last topologies seen by the agent, so that
+##              a topology seen again (a flapping link, a rebooting node) needs no new computation.
+##################################################################################################
+"""
+from collections import OrderedDict
+
+
+class RolesCache(object):
+    ## - Bounded LRU cache of (leaves, spines, super_spines, border, RR clusters) keyed by the topology fingerprint and the RR settings
+    ## - A flapping link or a rebooting node swings the fabric between a few topologies that resolve here without a new computation
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint):
+        if fingerprint in self.entries:
+            self.entries.move_to_end(fingerprint)
+            self.hits += 1
+            return [list(e) for e in self.entries[fingerprint]]
+        self.misses += 1
+        return None
+
+    def put(self, fingerprint, result):
+        self.entries[fingerprint] = [list(e) for e in result]
+        self.entries.move_to_end(fingerprint)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return f"hits={self.hits} misses={self.misses} size={len(self.entries)}/{self.size}"
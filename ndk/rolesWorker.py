@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: rolesWorker.py
+## Description: Worker process of the agent that computes the roles of topology snapshots with the
+##              incremental roles engine, so that a large fabric does not stall the notification loop.
+##################################################################################################
+"""
+from algorithms.nodesRolesAlgorithm import initRolesWorker, snapshotRoles
+import ipaddress
+import logging
+
+
+class RolesWorker(object):
+    ## - Worker process (started on first use) that runs the roles engine on topology snapshots
+    ## - Only the latest snapshot matters: one still waiting for the worker is cancelled when a newer one arrives
+    def __init__(self):
+        self.executor = None
+        self.pending = None
+
+    def submit(self, nodes, callback):
+        if self.executor is None:
+            ## - Imported on first use: the worker is optional and its modules are not needed to register the agent
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=initRolesWorker, initargs=(ipaddress.ip_address,))
+        if self.pending is not None and self.pending.cancel():
+            logging.info("[ROLES WORKER] :: Cancelled the computation of a stale topology")
+        self.pending = self.executor.submit(snapshotRoles, nodes)
+        self.pending.add_done_callback(callback)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
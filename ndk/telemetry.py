@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: telemetry.py
+## Description: Statistics of the agent published as YANG operational state through the NDK
+##              telemetry service, from a thread of their own.
+##################################################################################################
+"""
+import json
+import threading
+import logging
+
+
+class AgentTelemetry(object):
+    ## - Operational state of the agent (YANG: /system/configurationless/statistics) published through the NDK telemetry
+    ## - service every interval seconds, from a thread of its own. It is read without the state lock, so that a busy
+    ## - agent still publishes its statistics
+    ## - channel, metadata: gRPC channel to the NDK manager and metadata of the agent; failed: status of a failed update
+    def __init__(self, interval, channel, metadata, failed):
+        self.interval = interval
+        self.channel = channel
+        self.metadata = metadata
+        self.failed = failed
+        self.stopped = threading.Event()
+        self.thread = None
+        self.updates = 0
+        self.errors = 0
+
+    def start(self, statistics):
+        ## - statistics: function returning the statistics of the agent (a dict, in the YANG model)
+        self.thread = threading.Thread(target=self.publish, args=(statistics,), daemon=True)
+        self.thread.start()
+
+    def publish(self, statistics):
+        ## - Client stub for the operational state of the agent
+        from ndk.telemetry_service_pb2 import TelemetryUpdateRequest
+        from ndk.telemetry_service_pb2_grpc import SdkMgrTelemetryServiceStub
+        telemetry_stub = SdkMgrTelemetryServiceStub(self.channel)
+        while not self.stopped.wait(self.interval):
+            try:
+                request = TelemetryUpdateRequest()
+                info = request.state.add()
+                info.key.js_path = '.system.configurationless.statistics'
+                info.data.json_content = json.dumps(statistics())
+                response = telemetry_stub.TelemetryAddOrUpdate(request=request, metadata=self.metadata)
+                if response.status == self.failed:
+                    raise Exception(response.error_str)
+                self.updates += 1
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"[TELEMETRY] :: Statistics not published: {str(e)}")
+
+    def close(self):
+        self.stopped.set()
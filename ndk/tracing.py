@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: tracing.py
+## Description: Timing of the handling of the notifications: every notification gets an id, and
+##              the stages of its handling (and of the batches it joins later) are timed as spans of
+##              a trace, logged at the end of the handling.
+##################################################################################################
+"""
+import time
+import threading
+import itertools
+import logging
+from collections import OrderedDict
+
+## - Set by the agent from its TRACE_SPANS and TRACE_SLOW settings (see configure)
+SPANS = True   # False: no timing at all
+SLOW = 0.1     # Seconds: slower traces are logged at INFO level, the others at DEBUG level
+
+## - Ids of the notifications, shared by the spans of their handling
+trace_ids = itertools.count(1)
+
+
+def configure(spans, slow):
+    global SPANS, SLOW
+    SPANS = spans
+    SLOW = slow
+
+
+class Trace(object):
+    ## - Timing spans of the handling of one notification, or of one batch of notifications (timer threads), tied
+    ## - together by the notification ids. The trace of a thread is found by span() through a thread-local variable
+    local = threading.local()
+    active = {}   # thread ident -> outermost trace: the threads handling notifications (see SamplingProfiler)
+
+    def __init__(self, name, ids):
+        self.name = name
+        self.ids = ids
+        self.spans = OrderedDict()
+        self.parent = None
+
+    @staticmethod
+    def current():
+        return getattr(Trace.local, 'trace', None)
+
+    @staticmethod
+    def currentIds():
+        trace = getattr(Trace.local, 'trace', None)
+        return trace.ids if trace is not None else ()
+
+    def __enter__(self):
+        self.parent = getattr(Trace.local, 'trace', None)
+        Trace.local.trace = self
+        if self.parent is None:
+            Trace.active[threading.get_ident()] = self
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        total = time.monotonic() - self.start
+        Trace.local.trace = self.parent
+        if self.parent is None:
+            Trace.active.pop(threading.get_ident(), None)
+        level = logging.INFO if total >= SLOW else logging.DEBUG
+        if logging.getLogger().isEnabledFor(level):
+            spans = ''.join(f"{name}={seconds * 1000:.1f}ms " for name, seconds in self.spans.items())
+            logging.log(level, f"[TRACE] :: {self.name} {traceIds(self.ids)}: {spans}total={total * 1000:.1f}ms")
+
+
+class Span(object):
+    ## - Adds its duration to the trace of the thread (spans of the same name add up)
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        trace = getattr(Trace.local, 'trace', None)
+        if trace is not None:
+            trace.spans[self.name] = trace.spans.get(self.name, 0.0) + time.monotonic() - self.start
+
+
+class NoTrace(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+
+NO_TRACE = NoTrace()
+
+
+def span(name):
+    return Span(name) if SPANS else NO_TRACE
+
+
+def trace(name, ids):
+    return Trace(name, ids) if SPANS else NO_TRACE
+
+
+def traceIds(ids):
+    ## - notification 12, notifications 12,15 or notifications 12..40 (9)
+    if len(ids) == 1:
+        return f"notification {ids[0]}"
+    if len(ids) <= 3:
+        return f"notifications {','.join(str(i) for i in ids)}"
+    return f"notifications {ids[0]}..{ids[-1]} ({len(ids)})"
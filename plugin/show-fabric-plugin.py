@@ -4,7 +4,7 @@ from srlinux.schema import FixedSchemaRoot
 from srlinux.syntax import Syntax
 from srlinux.location import build_path
 from datetime import datetime
-import ast
+import json
 
 class Plugin(CliPlugin):
     
@@ -99,27 +99,20 @@ class Plugin(CliPlugin):
         super_spines_line = None
         border_leaves_line = None
         rr_line = None
-        count = 0
         file_path = f"var/log/srlinux/stdout/{node}_configurationless.log"
         try:
             with open(file_path, 'r') as file:
                 for line in file:
-                    if count == 1:
-                        spines_line = ast.literal_eval(line[len("Spines: "):].strip())
-                        count = 2
-                    elif count == 2:
-                        super_spines_line = ast.literal_eval(line[len("Super-Spines: "):].strip())
-                        count = 3
-                    elif count == 3:
-                        border_leaves_line = ast.literal_eval(line[len("Border-Leaves: "):].strip())
-                        count = 0
-                    if line.startswith("Leaves"):
-                        leaves_line = ast.literal_eval(line[len("Leaves: "):].strip())  # Update leaves_line if it starts with "Leaves"
-                        count = 1
-                    elif line.startswith("[OVERLAY] :: Elected RRs are"):
-                        rr_line = ast.literal_eval(line[len("[OVERLAY] :: Elected RRs are "):].strip())
+                    ## - Roles and RRs as one JSON line: the last one is the current topology
+                    if line.startswith('{"event": "roles"'):
+                        roles = json.loads(line)
+                        leaves_line, spines_line, super_spines_line = roles['leaves'], roles['spines'], roles['super_spines']
+                        border_leaves_line, rr_line = roles['border_leaves'], roles['route_reflectors']
         except:
             ctrl = False
+        if leaves_line is None:
+            ## - No roles logged yet
+            ctrl = False
         return ctrl, leaves_line, spines_line, super_spines_line, border_leaves_line, rr_line
     
 
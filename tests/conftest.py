@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: conftest.py
+## Description: Puts the agent modules (ndk/) and the bench tools (bench/) on the path of the
+##              tests. As in the nodes, nodesRolesAlgorithm.py is imported from an algorithms
+##              package, which here is the ndk folder itself.
+##              Usage: python -m pytest -q tests
+##################################################################################################
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+NDK_DIR = os.path.join(ROOT, 'ndk')
+BENCH_DIR = os.path.join(ROOT, 'bench')
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, NDK_DIR)
+if 'algorithms' not in sys.modules:
+    algorithms = types.ModuleType('algorithms')
+    algorithms.__path__ = [NDK_DIR]
+    sys.modules['algorithms'] = algorithms
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: test_incrementalRoles.py
+## Description: The incremental roles engine, fed with node and link deltas, must give the roles
+##              of a full nodesRolesAlgorithm run on the same topology after every change.
+##################################################################################################
+"""
+import random
+
+import pytest
+
+from algorithms.nodesRolesAlgorithm import IncrementalRoles, nodesRolesAlgorithm
+from closTopology import closTopology
+
+
+def fullRoles(engine):
+    ## - Full run on the graph g of the nodes of the engine, in the order of their keys
+    nodes = [node for _, node in engine.order]
+    if len(nodes) < 2:
+        return ([], [], [], [])
+    ids = {node : i + 1 for i, node in enumerate(nodes)}
+    g = [[0,0]] + [[ids[nei] for nei in engine.neighbors[node]] for node in nodes]
+    return tuple([nodes[i - 1] for i in role] for role in nodesRolesAlgorithm(g))
+
+
+def assertSameRoles(engine):
+    assert tuple(map(list, engine.roles())) == tuple(map(list, fullRoles(engine)))
+
+
+def fabricEngine(fabric, seed):
+    ## - Engine keyed by node name, ordered by a random key (the loopback IPs in the agent)
+    keys = {node : i for i, node in enumerate(random.Random(seed).sample(fabric.nodes, len(fabric.nodes)))}
+    engine = IncrementalRoles(order_key=lambda node: keys[node])
+    engine.sync(fabric.neighbors())
+    return engine
+
+
+@pytest.mark.parametrize('shape', [dict(pods=1, leaves=4, spines=2, super_spines=0),
+                                   dict(pods=2, leaves=3, spines=2, super_spines=2, borders=2),
+                                   dict(pods=3, leaves=4, spines=3, super_spines=2, borders=1, partial_leaves=1)])
+def test_clos_fabric(shape):
+    fabric = closTopology(**shape)
+    engine = fabricEngine(fabric, 1)
+    leaves, spines, super_spines, border = engine.roles()
+    assertSameRoles(engine)
+    five_stage = shape['pods'] > 1 or shape['super_spines'] > 0
+    assert set(leaves) == {n for n, role in fabric.roles.items() if role == 'leaf' or (role == 'border' and not five_stage)}
+    assert set(spines) == {n for n, role in fabric.roles.items() if role == 'spine'}
+    assert set(super_spines) == {n for n, role in fabric.roles.items() if role == 'super-spine'}
+    assert set(border) == {n for n, role in fabric.roles.items() if role == 'border' and five_stage}
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_deltas(seed):
+    ## - Nodes leaving and coming back and links flapping, one change at a time
+    rng = random.Random(seed)
+    fabric = closTopology(pods=1 + seed % 3, leaves=2 + seed % 3, spines=2, super_spines=(seed // 2) % 3, borders=seed % 2, partial_leaves=(seed // 3) % 2)
+    adjacency = fabric.neighbors()
+    engine = fabricEngine(fabric, seed)
+    up = set(fabric.nodes)
+    for _ in range(30):
+        change = rng.random()
+        if change < 0.3 and len(up) > 2:
+            up.discard(rng.choice(sorted(up)))
+        elif change < 0.6:
+            up.add(rng.choice(fabric.nodes))
+        else:
+            a, b = rng.sample(fabric.nodes, 2)
+            if b in adjacency[a]:
+                adjacency[a].remove(b)
+                adjacency[b].remove(a)
+            else:
+                adjacency[a].append(b)
+                adjacency[b].append(a)
+        engine.sync({node : [nei for nei in adjacency[node] if nei in up] for node in up})
+        assertSameRoles(engine)
+
+
+def test_removed_nodes_free_their_slots():
+    fabric = closTopology(pods=2, leaves=3, spines=2, super_spines=2)
+    engine = fabricEngine(fabric, 2)
+    engine.roles()
+    slots = len(engine.keys)
+    adjacency = fabric.neighbors()
+    for leaf in ['pod1-leaf1', 'pod2-leaf2']:
+        engine.removeNode(leaf)
+    assertSameRoles(engine)
+    for leaf in ['pod1-leaf1', 'pod2-leaf2']:
+        engine.addNode(leaf, adjacency[leaf])
+    for leaf in ['pod1-leaf1', 'pod2-leaf2']:
+        for spine in adjacency[leaf]:
+            engine.setNeighbors(spine, adjacency[spine])
+    assertSameRoles(engine)
+    assert len(engine.keys) == slots
+    assert not engine.free
+
+
+def test_asymmetric_adjacency():
+    ## - An LSP may list a neighbor whose own LSP does not list it back yet
+    fabric = closTopology(pods=2, leaves=2, spines=2, super_spines=2)
+    engine = fabricEngine(fabric, 3)
+    engine.roles()
+    row = list(engine.neighbors['pod1-leaf1'])
+    engine.setNeighbors('pod1-leaf1', row[:-1])
+    assertSameRoles(engine)
+    engine.setNeighbors('pod1-leaf1', row)
+    assertSameRoles(engine)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: test_lsdbMirror.py
+## Description: Streamed level-database notifications (pygnmi format) applied to the LSDB mirror:
+##              whole LSPs are set or deleted in place, any other change asks for a re-read, and the
+##              loopback IPs of the changed LSPs are reported once.
+##################################################################################################
+"""
+import threading
+
+from lsdbMirror import IsisLsdb, lspId, lspIp
+
+LSDB_PATH = "network-instance[name=default]/protocols/isis/instance[name=i1]/level-database[level-number=1][lsp-id=*]/defined-tlvs"
+LEVEL_DB = "network-instance[name=default]/protocols/isis/instance[name=i1]/level-database[level-number=1]"
+
+
+def tlvs(ip, *neighbors):
+    return {'ipv4-interface-addresses' : [ip],
+            'extended-is-reachability' : [{'neighbor' : n, 'default-metric' : 10} for n in neighbors]}
+
+
+def streamed(updates=(), deletes=(), prefix=None):
+    ## - One notification of the subscription, as pygnmi yields it
+    return {'update' : {'prefix' : prefix, 'update' : [{'path' : p, 'val' : v} for p, v in updates], 'delete' : [{'path' : p} for p in deletes]}}
+
+
+def mirror(lsps=None):
+    lsdb = IsisLsdb(LSDB_PATH, threading.RLock())
+    lsdb.fill({'notification' : [{'update' : [{'val' : {'level-database' : [{'lsp-id' : lsp_id, 'defined-tlvs' : t} for lsp_id, t in (lsps or {}).items()]}}]}]})
+    return lsdb
+
+
+def test_lsp_paths():
+    assert lspId(f"{LEVEL_DB}[lsp-id=1000.0000.0001.00-00]/defined-tlvs") == '1000.0000.0001.00-00'
+    assert lspId(LEVEL_DB) is None
+    assert lspIp(tlvs('10.0.0.1')) == '10.0.0.1'
+    assert lspIp({}) is None and lspIp(None) is None
+
+
+def test_first_sync_is_no_change():
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1')})
+    assert lsdb.synced and lsdb.knows('10.0.0.1')
+    assert lsdb.changed == set()
+
+
+def test_whole_lsp_is_applied():
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1')})
+    refresh = lsdb.apply(streamed([(f"{LEVEL_DB}[lsp-id=1000.0000.0002.00-00]/defined-tlvs", tlvs('10.0.0.2', '1000.0000.0001.00'))]))
+    assert refresh == set()
+    assert lsdb.lsps['1000.0000.0002.00-00'] == tlvs('10.0.0.2', '1000.0000.0001.00')
+    assert lsdb.changed == {'10.0.0.2'}
+    assert lsdb.updates == 1
+
+
+def test_prefix_and_path_are_joined():
+    lsdb = mirror()
+    refresh = lsdb.apply(streamed([('defined-tlvs', tlvs('10.0.0.3'))], prefix=f"{LEVEL_DB}[lsp-id=1000.0000.0003.00-00]"))
+    assert refresh == set()
+    assert lsdb.knows('10.0.0.3')
+
+
+def test_partial_change_is_read_again():
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1')})
+    path = f"{LEVEL_DB}[lsp-id=1000.0000.0001.00-00]/defined-tlvs/extended-is-reachability[neighbor=1000.0000.0002.00]/default-metric"
+    refresh = lsdb.apply(streamed([(path, 20)], [f"{LEVEL_DB}[lsp-id=1000.0000.0001.00-00]/defined-tlvs/router-capability"]))
+    assert refresh == {'1000.0000.0001.00-00'}
+    assert lsdb.lsps['1000.0000.0001.00-00'] == tlvs('10.0.0.1')
+    assert lsdb.changed == set()
+
+
+def test_deleted_lsp():
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1'), '1000.0000.0002.00-00' : tlvs('10.0.0.2')})
+    ## - A partial change and then the delete of the same LSP: nothing is left to read again
+    refresh = lsdb.apply(streamed([(f"{LEVEL_DB}[lsp-id=1000.0000.0002.00-00]/defined-tlvs/hostname", 'leaf2')],
+                                  [f"{LEVEL_DB}[lsp-id=1000.0000.0002.00-00]"]))
+    assert refresh == set()
+    assert '1000.0000.0002.00-00' not in lsdb.lsps and not lsdb.knows('10.0.0.2')
+    assert lsdb.changed == {'10.0.0.2'}
+
+
+def test_notification_without_update():
+    lsdb = mirror()
+    assert lsdb.apply({'sync_response' : True}) == set()
+    assert lsdb.updates == 0
+
+
+def test_same_lsp_is_no_change():
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1')})
+    lsdb.apply(streamed([(f"{LEVEL_DB}[lsp-id=1000.0000.0001.00-00]/defined-tlvs", tlvs('10.0.0.1'))]))
+    assert lsdb.changed == set()
+
+
+def test_report_hands_the_changes_once():
+    lsdb = mirror()
+    reported = []
+    lsdb.on_change = reported.append
+    lsdb.apply(streamed([(f"{LEVEL_DB}[lsp-id=1000.0000.0001.00-00]/defined-tlvs", tlvs('10.0.0.1')),
+                         (f"{LEVEL_DB}[lsp-id=1000.0000.0002.00-00]/defined-tlvs", tlvs('10.0.0.2'))]))
+    lsdb.report()
+    lsdb.report()
+    assert reported == [{'10.0.0.1', '10.0.0.2'}]
+
+
+def test_resync_reports_the_differences():
+    ## - LSPs that changed or left while the stream was down (new gNMI session)
+    lsdb = mirror({'1000.0000.0001.00-00' : tlvs('10.0.0.1'), '1000.0000.0002.00-00' : tlvs('10.0.0.2'), '1000.0000.0003.00-00' : tlvs('10.0.0.3')})
+    lsdb.fill({'notification' : [{'update' : [{'val' : {'level-database' : [
+        {'lsp-id' : '1000.0000.0001.00-00', 'defined-tlvs' : tlvs('10.0.0.1')},
+        {'lsp-id' : '1000.0000.0002.00-00', 'defined-tlvs' : tlvs('10.0.0.2', '1000.0000.0001.00')}]}}]}]})
+    assert lsdb.changed == {'10.0.0.2', '10.0.0.3'}
+    assert not lsdb.knows('10.0.0.3')
+    assert lsdb.database()['notification'][0]['update'][0]['val']['level-database'][0]['lsp-id'] == '1000.0000.0001.00-00'
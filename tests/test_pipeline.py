@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+##################################################################################################
+## File: test_pipeline.py
+## Description: Notification pipeline between the NDK stream and the handler thread: route
+##              notifications of the same prefix are merged, and a route notification dropped by the
+##              drop_oldest policy leads to one read of the whole route table, once the routes still
+##              queued are handled.
+##################################################################################################
+"""
+import time
+import threading
+
+from ndk.sdk_service_pb2 import Notification
+
+from pipeline import NotificationPipeline
+
+
+def route(ip, op):
+    notification = Notification()
+    notification.route.op = op
+    notification.route.key.ip_prefix.ip_addr.addr = bytes(int(b) for b in ip.split('.'))
+    notification.route.key.ip_prefix.prefix_length = 32
+    return notification
+
+
+def lldp():
+    notification = Notification()
+    notification.lldp_neighbor.SetInParent()
+    return notification
+
+
+class Handler(object):
+    ## - Handler and route resync of the agent: records what it is given, in order
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = fail
+
+    def handle(self, notification, state, gnmiclient):
+        if notification.HasField('route'):
+            ip = '.'.join(str(b) for b in notification.route.key.ip_prefix.ip_addr.addr)
+            self.calls.append(('route', ip, notification.route.op))
+            if ip in self.fail:
+                raise ValueError(ip)
+        else:
+            self.calls.append(('lldp',))
+
+    def resync(self, state, gnmiclient):
+        self.calls.append(('resync',))
+
+
+def newPipeline(size, overload, handler):
+    return NotificationPipeline(size, overload, threading.RLock(), handler.handle, handler.resync, 60)
+
+
+def settle(pipeline, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with pipeline.cond:
+            if (not pipeline.events and pipeline.handled + pipeline.coalesced + pipeline.dropped == pipeline.received
+                    and not pipeline.resync and not pipeline.resyncing):
+                return
+        time.sleep(0.005)
+    raise AssertionError(f"pipeline not settled: {pipeline}")
+
+
+def test_same_prefix_is_merged():
+    handler = Handler()
+    pipeline = newPipeline(16, 'block', handler)
+    pipeline.put(route('10.0.0.1', 0))
+    pipeline.put(route('10.0.0.2', 0))
+    pipeline.put(route('10.0.0.1', 2))
+    pipeline.put(route('10.0.0.1', 0))
+    assert len(pipeline) == 2 and pipeline.coalesced == 2
+    pipeline.start(None, None)
+    settle(pipeline)
+    pipeline.close()
+    ## - A create after a pending op is an update, in the place of the first notification of the prefix
+    assert handler.calls == [('route', '10.0.0.1', 1), ('route', '10.0.0.2', 0)]
+
+
+def test_drop_oldest_resyncs_after_the_queued_routes():
+    handler = Handler()
+    pipeline = newPipeline(2, 'drop_oldest', handler)
+    pipeline.put(route('10.0.0.9', 2))
+    pipeline.put(lldp())
+    pipeline.put(route('10.0.0.1', 1))
+    pipeline.put(route('10.0.0.2', 1))
+    ## - The DELETE was the oldest route notification; the LLDP one is kept
+    assert pipeline.dropped == 2 and pipeline.resync
+    pipeline.start(None, None)
+    settle(pipeline)
+    pipeline.close()
+    assert handler.calls == [('lldp',), ('route', '10.0.0.2', 1), ('resync',)]
+    assert pipeline.resyncs == 1
+
+
+def test_lldp_notifications_are_never_dropped():
+    pipeline = newPipeline(2, 'drop_oldest', Handler())
+    pipeline.put(lldp())
+    pipeline.put(lldp())
+    assert not pipeline.dropOldestRoute()
+    assert len(pipeline) == 2 and pipeline.dropped == 0 and not pipeline.resync
+
+
+def test_block_waits_for_the_handler():
+    handler = Handler()
+    pipeline = newPipeline(1, 'block', handler)
+    pipeline.put(route('10.0.0.1', 0))
+    reader = threading.Thread(target=pipeline.put, args=(route('10.0.0.2', 0),))
+    reader.start()
+    reader.join(0.1)
+    assert reader.is_alive()
+    pipeline.start(None, None)
+    reader.join(5.0)
+    settle(pipeline)
+    pipeline.close()
+    assert handler.calls == [('route', '10.0.0.1', 0), ('route', '10.0.0.2', 0)]
+    assert pipeline.dropped == 0 and pipeline.resyncs == 0
+
+
+def test_failed_notification_does_not_stop_the_handler():
+    handler = Handler(fail={'10.0.0.1'})
+    pipeline = newPipeline(16, 'block', handler)
+    pipeline.put(route('10.0.0.1', 0))
+    pipeline.put(route('10.0.0.2', 0))
+    pipeline.start(None, None)
+    settle(pipeline)
+    pipeline.close()
+    assert pipeline.errors == 1 and pipeline.handled == 2
+    assert handler.calls[-1] == ('route', '10.0.0.2', 0)